@@ -33,6 +33,9 @@ from gpodder import console
 from gpodder import dbsqlite
 from gpodder import config
 from gpodder import youtube
+from gpodder import feedupdate
+
+import time
 
 class Podcast(object):
     """API interface of gPodder podcasts
@@ -138,6 +141,7 @@ class Episode(object):
     Public attributes:
       title
       url
+      podcast_title
       is_new
       is_downloaded
       is_deleted
@@ -148,6 +152,7 @@ class Episode(object):
         self._manager = _manager
         self.title = self._episode.title
         self.url = self._episode.url
+        self.podcast_title = self._episode.channel.title
         self.is_new = (self._episode.state == gpodder.STATE_NORMAL and \
                 not self._episode.is_played)
         self.is_downloaded = (self._episode.state == gpodder.STATE_DOWNLOADED)
@@ -198,6 +203,89 @@ class PodcastClient(object):
         else:
             return Podcast(channel, self)
 
+    def search_episodes(self, query):
+        """Search the episodes of all podcasts
+
+        Returns a list of Episode objects (newest first) that
+        contain all words of "query" in their title or description.
+        """
+        podcasts = PodcastChannel.load_from_db(self._db, self._config.download_dir)
+        channel_mapping = dict((p.id, p) for p in podcasts)
+        return [Episode(e, self) for e in \
+                self._db.search_episodes(channel_mapping, query)]
+
+    def update_podcasts(self, podcasts, jobs=None, callback=None):
+        """Update several podcasts in parallel
+
+        Downloads the feeds of "podcasts" (a list of Podcast objects)
+        using up to "jobs" connections at the same time (the default
+        is the "max_feed_updates" setting). After each podcast has been
+        updated, "callback" is called (in the calling thread) with the
+        Podcast object and the exception that happened while updating
+        it, or None if the update was successful.
+        """
+        mapping = dict((podcast._podcast, podcast) for podcast in podcasts)
+
+        def fetch(channel):
+            return channel.fetch(self._config.max_episodes_per_feed)
+
+        def consume(channel, result):
+            channel.consume(result, self._config.max_episodes_per_feed, \
+                    self._config.mimetype_prefs)
+
+        def on_updated(channel, error):
+            if callback is not None:
+                callback(mapping[channel], error)
+
+        updater = feedupdate.FeedUpdater(self._config)
+        updater.update(mapping.keys(), fetch, consume, on_updated, \
+                self._db.commit, jobs)
+
+    def download_episodes(self, episodes, jobs=None, callback=None):
+        """Download several episodes in parallel
+
+        Downloads "episodes" (a list of Episode objects) using the
+        download queue, with up to "jobs" downloads at the same time
+        (the default is the "max_downloads" setting). Blocks until all
+        downloads are finished and returns the number of successfully
+        downloaded episodes.
+
+        About twice a second, "callback" is called (in the calling
+        thread) with each running download as callback(episode,
+        progress, False). When a download has finished, it is called
+        once as callback(episode, progress, True); "is_downloaded" of
+        the episode tells if the download was successful.
+        """
+        manager = download.DownloadQueueManager(self._config, jobs)
+        tasks = []
+        for episode in episodes:
+            task = download.DownloadTask(episode._episode, self._config)
+            tasks.append((episode, task))
+            manager.add_task(task)
+
+        count = 0
+        running = tasks
+        while running:
+            time.sleep(.5)
+            unfinished = []
+            for episode, task in running:
+                if task.status == download.DownloadTask.DOWNLOADING:
+                    unfinished.append((episode, task))
+                    if callback is not None:
+                        callback(episode, task.progress, False)
+                elif task.status == download.DownloadTask.QUEUED:
+                    unfinished.append((episode, task))
+                else:
+                    episode.is_downloaded = (task.status == download.DownloadTask.DONE)
+                    if episode.is_downloaded:
+                        count += 1
+                    if callback is not None:
+                        callback(episode, task.progress, True)
+            running = unfinished
+
+        self._db.commit()
+        return count
+
     def create_podcast(self, url, title=None):
         """Subscribe to a new podcast
 
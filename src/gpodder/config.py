@@ -27,11 +27,10 @@
 import gpodder
 from gpodder import util
 from gpodder.liblogger import log
+from gpodder.executor import executor
 
 import atexit
 import os
-import time
-import threading
 import ConfigParser
 
 _ = gpodder.gettext
@@ -65,11 +64,26 @@ gPodderSettings = {
         "time. Requires 'max_downloads_enabled'.")),
     'max_downloads_enabled': ( bool, True,
       ("The 'max_downloads' setting will only work if this is set to 'True'.")), 
+    'max_downloads_per_host': ( int, 2,
+      ("The maximum number of episodes from the same server that are "
+        "downloaded at the same time (forced downloads are not limited).")),
+    'max_feed_updates': ( int, 8,
+      ("The maximum number of feeds that are updated at the same time.")),
+    'max_feed_updates_per_host': ( int, 2,
+      ("The maximum number of feeds from the same server that are "
+        "updated at the same time.")),
+    'download_segments': ( int, 1,
+      ("The number of connections used for downloading a large episode "
+        "in parallel segments from servers that support it (1 disables "
+        "segmented downloads).")),
     'limit_rate': ( bool, False,
       ("The 'limit_rate_value' setting will only work if this is set to 'True'.")),
     'limit_rate_value': ( float, 500.0,
       ("Set a global speed limit (in KB/s) when downloading files. "
         "Requires 'limit_rate'.")),
+    'limit_rate_per_host_value': ( float, 0.0,
+      ("Limit the speed (in KB/s) of all downloads from the same server "
+        "together; 0 means no limit. Requires 'limit_rate'.")),
     'episode_old_age': ( int, 7,
       ("The number of days before an episode is considered old.")),
 
@@ -278,11 +292,13 @@ class Config(dict):
 
     def __init__(self, filename='gpodder.conf'):
         dict.__init__(self)
-        self.__save_thread = None
+        self.__save_job = None
         self.__filename = filename
         self.__section = 'gpodder-conf-1'
         self.__observers = []
 
+        executor.add_queue('config', executor.PRIORITY_LOW, 1)
+
         self.load()
         self.apply_fixes()
 
@@ -342,18 +358,16 @@ class Config(dict):
             log('Observer not added :%s', repr(callback), sender=self)
 
     def schedule_save(self):
-        if self.__save_thread is None:
-            self.__save_thread = threading.Thread(target=self.save_thread_proc)
-            self.__save_thread.setDaemon(True)
-            self.__save_thread.start()
-
-    def save_thread_proc(self):
-        time.sleep(self.WRITE_TO_DISK_TIMEOUT)
-        if self.__save_thread is not None:
+        if self.__save_job is None:
+            self.__save_job = executor.submit_later(self.WRITE_TO_DISK_TIMEOUT, \
+                    'config', self.save_job_proc)
+
+    def save_job_proc(self):
+        if self.__save_job is not None:
             self.save()
 
     def __atexit(self):
-        if self.__save_thread is not None:
+        if self.__save_job is not None:
             self.save()
 
     def get_backup(self):
@@ -394,7 +408,7 @@ class Config(dict):
             log('Cannot write settings to %s', filename, sender=self)
             raise IOError('Cannot write to file: %s' % filename)
 
-        self.__save_thread = None
+        self.__save_job = None
 
     def load(self, filename=None):
         if filename is not None:
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2011 Thomas Perl and the gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+#
+#  connectionpool.py -- Persistent and compressed HTTP connections for urllib2
+#
+
+from __future__ import with_statement
+
+from gpodder.liblogger import log
+
+import threading
+import urllib2
+import httplib
+import socket
+import time
+import zlib
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of idle HTTP connections
+
+    Connections are kept by a key (the scheme and host they are
+    connected to). A connection is taken out of the pool while it
+    is in use and put back after its response has been read, so a
+    connection is never used by two requests at the same time.
+    """
+    # Maximum number of idle connections per key
+    MAX_IDLE = 4
+
+    # Idle connections are closed after this many seconds
+    # (most servers close them after a few seconds anyway)
+    IDLE_TIMEOUT = 15.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def get(self, key):
+        """Take an idle connection for "key"; returns None if none"""
+        with self._lock:
+            connections = self._idle.get(key, [])
+            now = time.time()
+            while connections:
+                connection, since = connections.pop()
+                if now - since < self.IDLE_TIMEOUT:
+                    return connection
+                connection.close()
+        return None
+
+    def put(self, key, connection):
+        """Give a connection back for reusing it"""
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.MAX_IDLE:
+                connections.append((connection, time.time()))
+                return
+        connection.close()
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            for connections in self._idle.values():
+                for connection, since in connections:
+                    connection.close()
+            self._idle = {}
+
+
+# The connection pool shared by all handlers (see get_handlers)
+pool = ConnectionPool()
+
+
+class _PooledResponse(object):
+    """Wraps a httplib response to give the connection back when done
+
+    The connection is given back to the pool once the response body
+    has been read completely. Closing the response before that closes
+    the connection, because the rest of the body would still be sent.
+    """
+    def __init__(self, pool, key, connection, response):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._check_finished()
+
+    def _check_finished(self):
+        if self._connection is not None and self._response.isclosed():
+            if self._response.will_close:
+                self._connection.close()
+            else:
+                self._pool.put(self._key, self._connection)
+            self._connection = None
+
+    def recv(self, amt=None):
+        data = self._response.read(amt)
+        self._check_finished()
+        return data
+
+    read = recv
+
+    def close(self):
+        self._response.close()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class KeepAliveHandlerMixin(object):
+    """Open HTTP requests using connections from a ConnectionPool
+
+    Idle connections are only reused for requests that can be sent
+    again safely (GET and HEAD): a pooled connection might have been
+    closed by the server in the meantime, in which case the request is
+    sent again using a new connection.
+    """
+    RETRY_METHODS = ('GET', 'HEAD')
+
+    def _keepalive_open(self, connection_class, req):
+        if getattr(req, '_tunnel_host', None):
+            # Connections through proxy tunnels are not pooled
+            return self.do_open(connection_class, req)
+
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((key, value) for key, value in req.headers.items() \
+                if key not in headers)
+        headers['Connection'] = 'keep-alive'
+        headers = dict((key.title(), value) for key, value in headers.items())
+
+        key = (req.get_type(), host)
+        method = req.get_method()
+        connection = None
+        if method in self.RETRY_METHODS:
+            connection = self._pool.get(key)
+
+        while True:
+            reused = connection is not None
+            if not reused:
+                connection = connection_class(host, timeout=req.timeout)
+            try:
+                connection.request(method, req.get_selector(), req.data, headers)
+                response = connection.getresponse()
+                break
+            except (socket.error, httplib.HTTPException), e:
+                connection.close()
+                if not reused:
+                    raise urllib2.URLError(e)
+                log('Reused connection to %s failed: %s', host, e, sender=self)
+                connection = None
+
+        if response.length == 0:
+            # No body (e.g. HEAD or 304) - give the connection back now
+            response.read()
+
+        fp = socket._fileobject(_PooledResponse(self._pool, key, \
+                connection, response), close=True)
+        result = urllib2.addinfourl(fp, response.msg, req.get_full_url())
+        result.code = response.status
+        result.msg = response.reason
+        return result
+
+
+class KeepAliveHandler(KeepAliveHandlerMixin, urllib2.HTTPHandler):
+    """Replaces urllib2.HTTPHandler in openers (see urllib2.build_opener)"""
+
+    def __init__(self, connection_pool=None, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self._pool = connection_pool or pool
+
+    def http_open(self, req):
+        return self._keepalive_open(httplib.HTTPConnection, req)
+
+
+if hasattr(urllib2, 'HTTPSHandler'):
+    class KeepAliveHTTPSHandler(KeepAliveHandlerMixin, urllib2.HTTPSHandler):
+        """Replaces urllib2.HTTPSHandler in openers (see urllib2.build_opener)"""
+
+        def __init__(self, connection_pool=None, debuglevel=0):
+            urllib2.HTTPSHandler.__init__(self, debuglevel)
+            self._pool = connection_pool or pool
+
+        def https_open(self, req):
+            return self._keepalive_open(httplib.HTTPSConnection, req)
+else:
+    # Python has been built without SSL support
+    KeepAliveHTTPSHandler = None
+
+
+class _DecompressingReader(object):
+    """Decompress a gzip or deflate response body while reading it"""
+    CHUNK_SIZE = 64*1024
+
+    def __init__(self, fp, encoding):
+        self._fp = fp
+        self._deflate = (encoding == 'deflate')
+        # Automatic header detection for gzip and zlib streams
+        self._decompressor = zlib.decompressobj(32+zlib.MAX_WBITS)
+        self._started = False
+        self._buffer = ''
+        self._finished = False
+
+    def _decompress(self, data):
+        if self._started or not self._deflate:
+            self._started = True
+            return self._decompressor.decompress(data)
+
+        # Some servers send raw deflate data without the zlib header
+        self._started = True
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decompressor.decompress(data)
+
+    def recv(self, amt):
+        while not self._buffer and not self._finished:
+            data = self._fp.read(self.CHUNK_SIZE)
+            if data:
+                self._buffer = self._decompress(data)
+            else:
+                self._buffer = self._decompressor.flush()
+                self._finished = True
+
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self._fp.close()
+
+
+class DecompressionHandler(urllib2.BaseHandler):
+    """Ask for compressed responses and decompress them on the fly
+
+    Adds "Accept-Encoding: gzip, deflate" to requests that don't
+    set their own Accept-Encoding header. Compressed responses are
+    decompressed while they are read and the Content-Encoding
+    header is removed, so code reading the response (including code
+    that asked for compression itself) always gets the plain data.
+    """
+    # Decompress before other handlers (e.g. ContentDigestHandler) see it
+    handler_order = 400
+
+    ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+    def http_request(self, req):
+        if not req.has_header('Accept-encoding'):
+            req.add_unredirected_header('Accept-encoding', 'gzip, deflate')
+        return req
+
+    def http_response(self, req, response):
+        headers = response.info()
+        encoding = headers.get('content-encoding', '').strip().lower()
+        if encoding not in self.ENCODINGS:
+            return response
+
+        del headers['content-encoding']
+        del headers['content-length']
+        fp = socket._fileobject(_DecompressingReader(response, encoding), \
+                close=True)
+        result = urllib2.addinfourl(fp, headers, response.geturl(), \
+                response.code)
+        result.msg = response.msg
+        return result
+
+    https_request = http_request
+    https_response = http_response
+
+
+def get_handlers():
+    """Returns urllib2 handlers for gPodder's HTTP requests
+
+    The handlers use the shared connection pool and negotiate
+    compressed responses (see DecompressionHandler).
+    """
+    handlers = [KeepAliveHandler(), DecompressionHandler()]
+    if KeepAliveHTTPSHandler is not None:
+        handlers.append(KeepAliveHTTPSHandler())
+    return handlers
+
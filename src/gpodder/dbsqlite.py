@@ -74,16 +74,19 @@ class Database(object):
             ('channel_is_locked', 'INTEGER', True, '0'), # 1 if deletion is prevented, 0 otherwise
             ('foldername', 'TEXT', True, "''"), # Folder name (basename) to put downloaded episodes
             ('auto_foldername', 'INTEGER', True, '1'), # 1 if the foldername was auto-generated, 0 otherwise
-            ('release_expected', 'INTEGER', True, '0'), # Statistic value for when a new release is expected
-            ('release_deviation', 'INTEGER', True, '0'), # Deviation of the release cycle differences
+            ('release_expected', 'INTEGER', True, '0'), # Time when the next release is expected (0 if unknown)
+            ('release_deviation', 'INTEGER', True, '0'), # Median deviation of the release cycle in seconds
             ('updated_timestamp', 'INTEGER', True, '0'), # Timestamp of the last feed update
             ('feed_update_enabled', 'INTEGER', True, '1'), # 0 to skip this feed when checking for new episodes
+            ('content_digest', 'TEXT', False, None), # Digest of the feed content from last update
+            ('sort_key', 'TEXT', True, "''"), # Title for sorting podcasts (see get_sort_key)
     )
     INDEX_CHANNELS = (
             ('foldername', 'UNIQUE INDEX'),
             ('url', 'UNIQUE INDEX'),
             ('sync_to_devices', 'INDEX'),
             ('title', 'INDEX'),
+            ('sort_key', 'INDEX'),
     )
 
     # Column names and types for the episodes table
@@ -118,23 +121,161 @@ class Database(object):
             ('locked', 'INDEX'),
     )
 
+    # Column names and types for the downloads table (the download queue)
+    TABLE_DOWNLOADS = 'downloads'
+    SCHEMA_DOWNLOADS = (
+            ('episode_id', 'INTEGER PRIMARY KEY', True, '-1'), # Foreign key: ID of the downloaded episode
+            ('tempname', 'TEXT', True, "''"), # Filename of the partial download
+            ('downloaded', 'INTEGER', True, '0'), # Number of bytes downloaded so far
+            ('status', 'INTEGER', True, '0'), # Status of the download (see DownloadTask)
+    )
+    INDEX_DOWNLOADS = ()
+
+    # Number of characters of the description to load with episode lists
+    DESCRIPTION_EXCERPT_LENGTH = 500
+
+    # Full-text search index for episode titles and descriptions, using
+    # the first module in SEARCH_MODULES that is supported by SQLite;
+    # FTS4 reads the text from the episodes table instead of a copy
+    TABLE_EPISODES_SEARCH = 'episodes_search'
+    SEARCH_MODULES = (
+            'fts4(title, description, content="%s", tokenize=unicode61)' % \
+                    TABLE_EPISODES,
+            'fts4(title, description, content="%s")' % TABLE_EPISODES,
+            'fts3(title, description)',
+    )
+
+    # External content tables need SQLite 3.7.9 or newer
+    SEARCH_CONTENT_VERSION = (3, 7, 9)
+
+    # Value of PRAGMA auto_vacuum when free pages are kept in the file
+    # until they are given back with PRAGMA incremental_vacuum
+    AUTO_VACUUM_INCREMENTAL = 2
+
+    # Database maintenance (see maintenance): maximum number of free
+    # pages to give back per call, fraction of free pages in databases
+    # without incremental vacuuming that causes a full VACUUM and the
+    # number of changed rows after which the statistics are updated
+    MAINTENANCE_VACUUM_PAGES = 1024
+    MAINTENANCE_VACUUM_RATIO = .25
+    MAINTENANCE_ANALYZE_CHANGES = 10000
+
+    # Changes to the download queue are committed after this many seconds
+    # (batching frequent status changes), so that they don't keep reads
+    # on the shared connection for long (see read_cursor)
+    DOWNLOADS_COMMIT_DELAY = 1.
+
+    # Version of the data (stored as PRAGMA user_version), for upgrades
+    # that can't be detected from the layout of the tables:
+    #  1: release_expected is only set from the release cycle
+    SCHEMA_VERSION = 1
+
     def __init__(self, filename):
         self.database_file = filename
         self._db = None
         self.lock = threading.RLock()
 
+        # Read-only connections of threads, by thread ID (see read_cursor)
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+
+        # True if the database uses write-ahead logging (see read_cursor)
+        self._wal = False
+
+        # Value of total_changes of the shared connection at the last commit
+        self._committed_changes = 0
+
+        # Timer that commits changes to the download queue (see save_download)
+        self._commit_timer = None
+
+        # Value of total_changes at the last ANALYZE (see maintenance)
+        self._analyzed_changes = None
+        self._sql_cache = {}
+
+        # Cached statistics (see get_channel_count); None if not loaded
+        self._channel_counts = None
+        self._counts_lock = threading.Lock()
+        self._counts_generation = 0
+
+        # True if the full-text search index is available
+        self._have_search_index = False
+
+        # Names of tables that did not exist before (see create_table)
+        self._created_tables = set()
+
     def close(self):
-        self.commit()
+        # Wait for a write that is still in progress
+        self.lock.acquire()
+        try:
+            # Changes to the download queue are committed right now
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+
+            self.commit()
+            self._close_readers()
 
+            self._db.close()
+            self._db = None
+        finally:
+            self.lock.release()
+
+    def _get_pragma(self, cur, name):
+        cur.execute('PRAGMA %s' % name)
+        return cur.fetchone()[0]
+
+    def maintenance(self):
+        """Give unused space back and keep statistics up to date
+
+        This should be called from time to time while idle. Each call
+        only does a bounded amount of work: at most
+        MAINTENANCE_VACUUM_PAGES free pages are given back to the
+        file system, ANALYZE is only run after many changes, and a
+        full VACUUM is only done when a large part of a database
+        without incremental vacuuming (created with gPodder 2.x)
+        is unused - this also enables incremental vacuuming for it.
+        """
         cur = self.cursor(lock=True)
-        log('Optimizing database for faster startup.', sender=self)
-        cur.execute("VACUUM")
+        try:
+            # PRAGMA and VACUUM can't be used in a transaction
+            self.commit()
+
+            page_count = self._get_pragma(cur, 'page_count')
+            free_pages = self._get_pragma(cur, 'freelist_count')
+            incremental = (self._get_pragma(cur, 'auto_vacuum') == \
+                    self.AUTO_VACUUM_INCREMENTAL)
+            self.log('Maintenance: %d of %d pages free', free_pages, page_count)
+
+            if incremental:
+                if free_pages:
+                    cur.execute('PRAGMA incremental_vacuum(%d)' % \
+                            self.MAINTENANCE_VACUUM_PAGES)
+                    # Each row returned is one page given back
+                    cur.fetchall()
+            elif free_pages > page_count*self.MAINTENANCE_VACUUM_RATIO:
+                log('Compacting database (%d of %d pages unused)', \
+                        free_pages, page_count, sender=self)
+                cur.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cur.execute('VACUUM')
+
+            if self._analyzed_changes is None:
+                # Analyze right away if it has never been done before
+                cur.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")
+                if cur.fetchone() is not None:
+                    self._analyzed_changes = 0
+
+            if self._analyzed_changes is None or self._db.total_changes - \
+                    self._analyzed_changes >= self.MAINTENANCE_ANALYZE_CHANGES:
+                self.log('Updating statistics')
+                cur.execute('ANALYZE')
+                self.commit()
+                self._analyzed_changes = self._db.total_changes
+        except Exception, e:
+            log('Database maintenance failed: %s', e, sender=self, traceback=True)
+
         cur.close()
         self.lock.release()
 
-        self._db.close()
-        self._db = None
-
     def log(self, message, *args, **kwargs):
         try:
             message = message % args
@@ -160,49 +301,129 @@ class Database(object):
         cur.execute(sql, (channel_id, gpodder.STATE_DOWNLOADED, channel_id, max_episodes))
 
         cur.close()
+        self._counts_changed(channel_id)
         self.lock.release()
 
-    def db_sort_cmp(self, a, b):
+    def get_sort_key(self, title):
         """
-        Compare two strings for sorting, including removing
+        Returns the key for sorting podcasts by title, removing
         a possible "The " prefix and converting umlauts to
         normal characters so they can be sorted correctly.
         (i.e. "Ö1" should not appear at the end of the list)
+
+        The key is saved in the "sort_key" column of the
+        channels table, so SQLite can sort without calling
+        back into Python for each comparison.
         """
-        try:
-            a = a.decode('utf-8', 'ignore').lower()
-            a = re.sub('^the ', '', a)
-            a = a.translate(self.UNICODE_TRANSLATE)
-            b = b.decode('utf-8', 'ignore').lower()
-            b = re.sub('^the ', '', b)
-            b = b.translate(self.UNICODE_TRANSLATE)
-            return cmp(a, b)
-        except:
-            log('Error while comparing "%s" and "%s"', a, b, sender=self, traceback=True)
-            a = re.sub('^the ', '', a.lower())
-            b = re.sub('^the ', '', b.lower())
-            return cmp(a, b)
+        if not isinstance(title, unicode):
+            title = title.decode('utf-8', 'ignore')
+        title = re.sub('^the ', '', title.lower())
+        return title.translate(self.UNICODE_TRANSLATE)
 
     @property
     def db(self):
         if self._db is None:
             self._db = sqlite.connect(self.database_file, check_same_thread=False)
             self._db.text_factory = str
-            self._db.create_collation("UNICODE", self.db_sort_cmp)
             self.log('Connected')
+            # Only has an effect before the first table has been created;
+            # existing databases are converted by maintenance()
+            self._db.cursor().execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self._wal = self._enable_wal(self._db)
             self.__check_schema()
         return self._db
 
+    def _enable_wal(self, db):
+        """Switch the database to write-ahead logging if possible
+
+        With write-ahead logging, readers don't block writers and
+        writers don't block readers. This needs SQLite 3.7.0 and a
+        file system that supports shared memory. Returns True if
+        write-ahead logging is used.
+        """
+        try:
+            cur = db.cursor()
+            cur.execute('PRAGMA journal_mode = WAL')
+            mode = cur.fetchone()[0]
+            if mode.lower() != 'wal':
+                self.log('Write-ahead logging not available (%s)', mode)
+                return False
+
+            # Commits only need to be synced at checkpoints with WAL
+            cur.execute('PRAGMA synchronous = NORMAL')
+            cur.close()
+            return True
+        except Exception, e:
+            log('Cannot enable write-ahead logging: %s', e, sender=self)
+            return False
+
     def cursor(self, lock=False):
         if lock:
             self.lock.acquire()
         return self.db.cursor()
 
+    def read_cursor(self):
+        """Returns a cursor for read-only queries
+
+        With write-ahead logging, each thread reads using a connection
+        of its own, so reads don't have to wait for writes of other
+        threads. These connections only see committed data, so reads
+        use the shared connection (with the lock held) while there are
+        uncommitted changes. Pass the cursor to release() when done.
+        """
+        db = self._get_reader()
+        if db is None:
+            self.lock.acquire()
+            db = self.db
+        return db.cursor()
+
+    def release(self, cur):
+        """Close a cursor returned by read_cursor()"""
+        cur.close()
+        if cur.connection is self._db:
+            self.lock.release()
+
+    def _get_reader(self):
+        # Returns the read-only connection of the calling thread, or
+        # None if the shared connection has to be used for reading
+        db = self.db
+        if not self._wal or db.total_changes != self._committed_changes:
+            return None
+
+        ident = threading.currentThread().ident
+        reader = self._readers.get(ident)
+        if reader is None:
+            self._readers_lock.acquire()
+            try:
+                # Close connections of threads that have finished
+                alive = set(t.ident for t in threading.enumerate())
+                for id in self._readers.keys():
+                    if id not in alive:
+                        self._readers.pop(id).close()
+
+                reader = sqlite.connect(self.database_file, \
+                        check_same_thread=False)
+                reader.text_factory = str
+                self._readers[ident] = reader
+            finally:
+                self._readers_lock.release()
+        return reader
+
+    def _close_readers(self):
+        self._readers_lock.acquire()
+        try:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
+        finally:
+            self._readers_lock.release()
+
     def commit(self):
         self.lock.acquire()
         try:
             self.log("COMMIT")
             self.db.commit()
+            self._committed_changes = self._db.total_changes
         except Exception, e:
             log('Error commiting changes: %s', e, sender=self, traceback=True)
         self.lock.release()
@@ -250,6 +471,15 @@ class Database(object):
         cur.execute(sql % (self.TABLE_EPISODES, self.TABLE_CHANNELS,))
         self.lock.release()
 
+    def _remove_orphaned_downloads(self):
+        """Remove downloads of episodes that have been deleted"""
+        cur = self.cursor(lock=True)
+        cur.execute('DELETE FROM %s WHERE episode_id NOT IN ' \
+                '(SELECT id FROM %s)' % (self.TABLE_DOWNLOADS, \
+                self.TABLE_EPISODES))
+        cur.close()
+        self.lock.release()
+
     def __check_schema(self):
         """
         Creates all necessary tables and indexes that don't exist.
@@ -265,10 +495,28 @@ class Database(object):
         # Create tables and possibly add newly-added columns
         self.upgrade_table(self.TABLE_CHANNELS, self.SCHEMA_CHANNELS, self.INDEX_CHANNELS)
         self.upgrade_table(self.TABLE_EPISODES, self.SCHEMA_EPISODES, self.INDEX_EPISODES)
+        self.upgrade_table(self.TABLE_DOWNLOADS, self.SCHEMA_DOWNLOADS, self.INDEX_DOWNLOADS)
+
+        version = self._get_pragma(cur, 'user_version')
+        if version < 1:
+            # Older versions set release_expected to the subscription time;
+            # the release cycle is estimated again on the next update
+            cur.execute('UPDATE %s SET release_expected = 0, release_deviation = 0' % \
+                    self.TABLE_CHANNELS)
+        if version < self.SCHEMA_VERSION:
+            cur.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+
+        # Fill in sort keys of podcasts saved without one
+        cur.execute("SELECT id, title FROM %s WHERE sort_key = '' AND title != ''" % \
+                self.TABLE_CHANNELS)
+        cur.executemany('UPDATE %s SET sort_key = ? WHERE id = ?' % \
+                self.TABLE_CHANNELS, [(self.get_sort_key(title), id) \
+                for id, title in cur.fetchall()])
 
         # Remove orphaned episodes (episodes without a corresponding
         # channel object) from the database to keep the DB clean
         self._remove_orphaned_episodes()
+        self._remove_orphaned_downloads()
 
         # Make sure deleted episodes are played, to simplify querying statistics.
         try:
@@ -276,45 +524,179 @@ class Database(object):
         except OperationalError:
             pass
 
+        self._have_search_index = self._setup_search_index(cur)
+
         cur.close()
+        self._counts_changed()
         self.lock.release()
 
-    def get_channel_count(self, id):
-        """Given a channel ID, returns the statistics for it
+    def _setup_search_index(self, cur):
+        """Create the full-text search index and keep it up to date
 
-        Returns a tuple (total, deleted, new, downloaded, unplayed)
+        The index is maintained by triggers on the episodes table, so it
+        is current after every save and delete. It is only rebuilt if it
+        has just been created or if its triggers are missing (they are
+        removed with the table in recreate_table()). Returns False if
+        SQLite has no full-text search support (searching then uses LIKE).
         """
-        total, deleted, new, downloaded, unplayed = 0, 0, 0, 0, 0
+        table = self.TABLE_EPISODES_SEARCH
+        created = False
 
-        cur = self.cursor(lock=True)
-        cur.execute('SELECT COUNT(*), state, played FROM episodes WHERE channel_id = ? GROUP BY state, played', (id,))
-        for count, state, played in cur:
-            total += count
-            if state == gpodder.STATE_DELETED:
-                deleted += count
-            elif state == gpodder.STATE_NORMAL and not played:
-                new += count
-            elif state == gpodder.STATE_DOWNLOADED and not played:
-                downloaded += count
-                unplayed += count
-            elif state == gpodder.STATE_DOWNLOADED:
-                downloaded += count
+        cur.execute("SELECT sql FROM sqlite_master WHERE name = ?", (table,))
+        row = cur.fetchone()
+        if row is not None and 'content=' not in row[0] and \
+                sqlite.sqlite_version_info >= self.SEARCH_CONTENT_VERSION:
+            # Indices of older versions store a copy of all descriptions
+            log('Replacing search index', sender=self)
+            cur.execute('DROP TABLE %s' % table)
+            row = None
 
-        cur.close()
-        self.lock.release()
+        if row is None:
+            for module in self.SEARCH_MODULES:
+                try:
+                    cur.execute('CREATE VIRTUAL TABLE %s USING %s' % (table, module))
+                    log('Created search index using %s', module, sender=self)
+                    created = True
+                    break
+                except OperationalError, e:
+                    log('Cannot use %s: %s', module, e, sender=self)
+            else:
+                log('Full-text search is not available', sender=self)
+                return False
 
-        return (total, deleted, new, downloaded, unplayed)
+            cur.execute("SELECT sql FROM sqlite_master WHERE name = ?", (table,))
+            row = cur.fetchone()
 
-    def get_total_count(self):
-        """Get statistics for episodes in all channels
+        external = ('content=' in row[0])
+        if external:
+            triggers = self._search_content_triggers(table)
+        else:
+            triggers = self._search_copy_triggers(table)
+
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' " \
+                "AND tbl_name = ?", (self.TABLE_EPISODES,))
+        existing = set(name for (name,) in cur)
+        if not created and set(triggers).issubset(existing):
+            return True
+
+        names = set(self._search_content_triggers(table)) | \
+                set(self._search_copy_triggers(table))
+        for name in names:
+            cur.execute('DROP TRIGGER IF EXISTS %s' % name)
+        for name, sql in triggers.iteritems():
+            cur.execute('CREATE TRIGGER %s %s' % (name, sql))
+
+        log('Building search index', sender=self)
+        if external:
+            cur.execute("INSERT INTO %s (%s) VALUES ('rebuild')" % \
+                    (table, table))
+        else:
+            cur.execute('DELETE FROM %s' % table)
+            cur.execute('INSERT INTO %s (docid, title, description) '
+                    'SELECT id, title, description FROM %s' % \
+                    (table, self.TABLE_EPISODES))
 
-        Returns a tuple (total, deleted, new, downloaded, unplayed)
+        return True
+
+    def _search_content_triggers(self, table):
+        """Triggers for an index that reads from the episodes table
+
+        The old text has to be removed from the index before the row in
+        the episodes table is changed, as it is read from there.
+        """
+        values = {'table': table, 'episodes': self.TABLE_EPISODES}
+        changed = """OF id, title, description ON %(episodes)s
+            WHEN new.id IS NOT old.id OR new.title IS NOT old.title
+                OR new.description IS NOT old.description""" % values
+        insert = """BEGIN
+                INSERT INTO %(table)s (docid, title, description)
+                VALUES (new.id, new.title, new.description);
+            END""" % values
+        delete = """BEGIN
+                DELETE FROM %(table)s WHERE docid = old.id;
+            END""" % values
+        return {
+            table + '_insert': 'AFTER INSERT ON %s %s' % \
+                    (self.TABLE_EPISODES, insert),
+            table + '_before_update': 'BEFORE UPDATE %s %s' % \
+                    (changed, delete),
+            table + '_update': 'AFTER UPDATE %s %s' % (changed, insert),
+            table + '_before_delete': 'BEFORE DELETE ON %s %s' % \
+                    (self.TABLE_EPISODES, delete),
+        }
+
+    def _search_copy_triggers(self, table):
+        """Triggers for an index that stores its own copy of the text"""
+        values = {'table': table, 'episodes': self.TABLE_EPISODES}
+        return {
+            table + '_insert': """AFTER INSERT ON %(episodes)s
+            BEGIN
+                INSERT INTO %(table)s (docid, title, description)
+                VALUES (new.id, new.title, new.description);
+            END""" % values,
+            table + '_update': """AFTER UPDATE OF id, title, description
+            ON %(episodes)s
+            WHEN new.id IS NOT old.id OR new.title IS NOT old.title
+                OR new.description IS NOT old.description
+            BEGIN
+                DELETE FROM %(table)s WHERE docid = old.id;
+                INSERT INTO %(table)s (docid, title, description)
+                VALUES (new.id, new.title, new.description);
+            END""" % values,
+            table + '_delete': """AFTER DELETE ON %(episodes)s
+            BEGIN
+                DELETE FROM %(table)s WHERE docid = old.id;
+            END""" % values,
+        }
+
+    def search_condition(self, query):
+        """Returns an SQL condition and arguments for searching episodes
+
+        Episodes match if all words in "query" appear in their title or
+        description (words in the query also match as prefixes, so the
+        search can be used while typing). The condition can be used with
+        load_episode_ids(). If the query contains no words, the episode
+        titles are searched for the query text instead.
         """
+        if isinstance(query, str):
+            query = query.decode('utf-8', 'ignore')
+        words = re.findall(r'\w+', query, re.UNICODE)
+
+        def like(text):
+            return '%' + re.sub(r'([\\%_])', r'\\\1', text.lower()) + '%'
+
+        if not words:
+            return ("title LIKE ? ESCAPE '\\'", (like(query),))
+
+        self.db # Make sure the search index has been set up
+        if self._have_search_index:
+            match = ' '.join('"%s*"' % word for word in words)
+            return ('id IN (SELECT docid FROM %s WHERE %s MATCH ?)' % \
+                    ((self.TABLE_EPISODES_SEARCH,)*2), (match,))
+
+        conditions, args = [], []
+        for word in words:
+            conditions.append("(title LIKE ? ESCAPE '\\' OR " + \
+                    "description LIKE ? ESCAPE '\\')")
+            args.extend((like(word),)*2)
+        return (' AND '.join(conditions), tuple(args))
+
+    def search_episodes(self, channel_mapping, query, limit=1000):
+        """Search the episodes of all podcasts in "channel_mapping"
+
+        Returns a list of matching episodes, newest episodes first.
+        See search_condition() for how "query" is matched.
+        """
+        condition, args = self.search_condition(query)
+        ids = self.load_episode_ids((condition,), args, limit)
+        episodes = self.load_episodes_by_ids(channel_mapping, ids)
+        return [episodes[id] for id in ids if id in episodes]
+
+    def _count_episodes(self, rows):
+        """Sum up (count, state, played) rows to a statistics tuple"""
         total, deleted, new, downloaded, unplayed = 0, 0, 0, 0, 0
 
-        cur = self.cursor(lock=True)
-        cur.execute('SELECT COUNT(*), state, played FROM episodes GROUP BY state, played')
-        for count, state, played in cur:
+        for count, state, played in rows:
             total += count
             if state == gpodder.STATE_DELETED:
                 deleted += count
@@ -326,11 +708,79 @@ class Database(object):
             elif state == gpodder.STATE_DOWNLOADED:
                 downloaded += count
 
-        cur.close()
-        self.lock.release()
-
         return (total, deleted, new, downloaded, unplayed)
 
+    def _load_channel_counts(self):
+        # The cache is protected by self._counts_lock, which is not held
+        # while querying, as the query might have to wait for self.lock
+        self._counts_lock.acquire()
+        try:
+            counts = self._channel_counts
+            generation = self._counts_generation
+            if counts is not None:
+                stale = [id for id, c in counts.iteritems() if c is None]
+                if not stale:
+                    return counts
+                counts = dict(counts)
+        finally:
+            self._counts_lock.release()
+
+        cur = self.read_cursor()
+        if counts is None:
+            rows = {}
+            cur.execute('SELECT channel_id, COUNT(*), state, played FROM episodes GROUP BY channel_id, state, played')
+            for channel_id, count, state, played in cur:
+                rows.setdefault(channel_id, []).append((count, state, played))
+
+            counts = dict((channel_id, self._count_episodes(r)) \
+                    for channel_id, r in rows.iteritems())
+        else:
+            # Re-count the channels that have changed since loading
+            for id in stale:
+                cur.execute('SELECT COUNT(*), state, played FROM episodes WHERE channel_id = ? GROUP BY state, played', (id,))
+                counts[id] = self._count_episodes(cur)
+        self.release(cur)
+
+        self._counts_lock.acquire()
+        # Don't cache the result if episodes have changed in the meantime
+        if self._counts_generation == generation:
+            self._channel_counts = counts
+        self._counts_lock.release()
+
+        return counts
+
+    def _counts_changed(self, channel_id=None):
+        """Invalidate cached statistics after episodes have changed
+
+        If channel_id is None, the statistics of all channels are
+        loaded again when they are needed the next time.
+        """
+        self._counts_lock.acquire()
+        self._counts_generation += 1
+        if channel_id is None:
+            self._channel_counts = None
+        elif self._channel_counts is not None:
+            self._channel_counts[channel_id] = None
+        self._counts_lock.release()
+
+    def get_channel_count(self, id):
+        """Given a channel ID, returns the statistics for it
+
+        The statistics of all channels are loaded with a single
+        query and cached until the episodes of a channel change.
+
+        Returns a tuple (total, deleted, new, downloaded, unplayed)
+        """
+        return self._load_channel_counts().get(id, (0, 0, 0, 0, 0))
+
+    def get_total_count(self):
+        """Get statistics for episodes in all channels
+
+        Returns a tuple (total, deleted, new, downloaded, unplayed)
+        """
+        counts = self._load_channel_counts().values()
+        return tuple(sum(column) for column in zip((0, 0, 0, 0, 0), *counts))
+
     def load_channels(self, factory=None, url=None):
         """
         Returns channel descriptions as a list of dictionaries or objects,
@@ -340,8 +790,8 @@ class Database(object):
 
         self.log("load_channels()")
 
-        cur = self.cursor(lock=True)
-        cur.execute('SELECT * FROM %s ORDER BY title COLLATE UNICODE' % self.TABLE_CHANNELS)
+        cur = self.read_cursor()
+        cur.execute('SELECT * FROM %s ORDER BY sort_key' % self.TABLE_CHANNELS)
 
         result = []
         keys = list(desc[0] for desc in cur.description)
@@ -354,12 +804,12 @@ class Database(object):
                 else:
                     result.append(factory(channel, self))
 
-        cur.close()
-        self.lock.release()
+        self.release(cur)
 
         return result
 
     def save_channel(self, c):
+        c.sort_key = self.get_sort_key(c.title)
         self._save_object(c, self.TABLE_CHANNELS, self.SCHEMA_CHANNELS)
 
     def delete_channel(self, channel):
@@ -372,54 +822,135 @@ class Database(object):
         cur.execute("DELETE FROM episodes WHERE channel_id = ?", (channel.id, ))
 
         cur.close()
+        self._counts_changed(channel.id)
         # Commit changes
-        self.db.commit()
+        self.commit()
         self.lock.release()
 
-    def load_all_episodes(self, channel_mapping, limit=10000):
+    def _episode_columns(self, descriptions):
+        """Column list for loading episodes
+
+        If "descriptions" is False, only an excerpt of the description
+        is loaded (as "description_excerpt"); the full description is
+        loaded on demand by the episode object (see PodcastEpisode).
+        """
+        if descriptions:
+            return '*'
+
+        key = ('COLUMNS', self.TABLE_EPISODES)
+        if key not in self._sql_cache:
+            columns = [name for name, typ, required, default in \
+                    self.SCHEMA_EPISODES if name != 'description']
+            columns.append('substr(description, 1, %d) AS description_excerpt' % \
+                    self.DESCRIPTION_EXCERPT_LENGTH)
+            self._sql_cache[key] = ', '.join(columns)
+        return self._sql_cache[key]
+
+    def load_all_episodes(self, channel_mapping, limit=10000, descriptions=False):
         self.log('Loading all episodes from the database')
-        sql = 'SELECT * FROM %s ORDER BY pubDate DESC LIMIT ?' % (self.TABLE_EPISODES,)
+        sql = 'SELECT %s FROM %s ORDER BY pubDate DESC LIMIT ?' % (self._episode_columns(descriptions), self.TABLE_EPISODES,)
         args = (limit,)
-        cur = self.cursor(lock=True)
+        cur = self.read_cursor()
         cur.execute(sql, args)
         keys = [desc[0] for desc in cur.description]
         id_index = keys.index('channel_id')
         result = map(lambda row: channel_mapping[row[id_index]].episode_factory(dict(zip(keys, row))), cur)
-        cur.close()
-        self.lock.release()
+        self.release(cur)
         return result
 
-    def load_new_episodes(self, channel_mapping, limit=10000):
+    def load_new_episodes(self, channel_mapping, limit=10000, descriptions=False):
         self.log('Loading new episodes from the database')
-        sql = 'SELECT * FROM %s WHERE state=? AND played=0 ORDER BY pubDate DESC LIMIT ?' % (self.TABLE_EPISODES,)
+        sql = 'SELECT %s FROM %s WHERE state=? AND played=0 ORDER BY pubDate DESC LIMIT ?' % (self._episode_columns(descriptions), self.TABLE_EPISODES,)
         args = (gpodder.STATE_NORMAL,limit,)
-        cur = self.cursor(lock=True)
+        cur = self.read_cursor()
         cur.execute(sql, args)
         keys = [desc[0] for desc in cur.description]
         id_index = keys.index('channel_id')
         result = map(lambda row: channel_mapping[row[id_index]].episode_factory(dict(zip(keys, row))), cur)
-        cur.close()
-        self.lock.release()
+        self.release(cur)
+        return result
+
+    def load_episode_ids(self, conditions=(), args=(), limit=10000):
+        """Returns the IDs of episodes, newest episodes first
+
+        "conditions" is a list of SQL expressions that all have to
+        be true for an episode, "args" are the values for the
+        placeholders in "conditions". This is cheap even for many
+        episodes, and the episodes can then be loaded in pages with
+        load_episodes_by_ids().
+        """
+        sql = 'SELECT id FROM %s' % (self.TABLE_EPISODES,)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join('(%s)' % c for c in conditions)
+        sql += ' ORDER BY pubDate DESC LIMIT ?'
+
+        cur = self.read_cursor()
+        cur.execute(sql, tuple(args) + (limit,))
+        result = [id for (id,) in cur]
+        self.release(cur)
         return result
 
-    def load_episodes(self, channel, factory=lambda x: x, limit=1000, state=None):
+    def load_episodes_by_ids(self, channel_mapping, ids, descriptions=False):
+        """Load the episodes with the given IDs
+
+        Returns a dictionary mapping IDs to episode objects. Episodes
+        of podcasts that are not in "channel_mapping" are left out.
+        """
+        if not ids:
+            return {}
+
+        ids = list(ids)
+        result = {}
+        cur = self.read_cursor()
+        # Older SQLite versions allow at most 999 variables per query
+        for offset in range(0, len(ids), 500):
+            chunk = ids[offset:offset+500]
+            sql = 'SELECT %s FROM %s WHERE id IN (%s)' % \
+                    (self._episode_columns(descriptions), self.TABLE_EPISODES, \
+                    ', '.join('?'*len(chunk)))
+            cur.execute(sql, tuple(chunk))
+            keys = [desc[0] for desc in cur.description]
+            for row in cur:
+                d = dict(zip(keys, row))
+                if d['channel_id'] in channel_mapping:
+                    channel = channel_mapping[d['channel_id']]
+                    result[d['id']] = channel.episode_factory(d)
+        self.release(cur)
+        return result
+
+    def load_episode_summaries(self, channel):
+        """Returns (id, guid, title, pubDate, state) for all episodes
+
+        This is used to find existing episodes of a podcast after a
+        feed update without creating objects for all of them.
+        """
+        assert channel.id is not None
+
+        cur = self.read_cursor()
+        cur.execute('SELECT id, guid, title, pubDate, state FROM %s ' \
+                'WHERE channel_id = ?' % self.TABLE_EPISODES, (channel.id,))
+        result = cur.fetchall()
+        self.release(cur)
+        return result
+
+    def load_episodes(self, channel, factory=lambda x: x, limit=1000, state=None, descriptions=False):
         assert channel.id is not None
 
         self.log('Loading episodes for channel %d', channel.id)
 
+        columns = self._episode_columns(descriptions)
         if state is None:
-            sql = 'SELECT * FROM %s WHERE channel_id = ? ORDER BY pubDate DESC LIMIT ?' % (self.TABLE_EPISODES,)
+            sql = 'SELECT %s FROM %s WHERE channel_id = ? ORDER BY pubDate DESC LIMIT ?' % (columns, self.TABLE_EPISODES,)
             args = (channel.id, limit)
         else:
-            sql = 'SELECT * FROM %s WHERE channel_id = ? AND state = ? ORDER BY pubDate DESC LIMIT ?' % (self.TABLE_EPISODES,)
+            sql = 'SELECT %s FROM %s WHERE channel_id = ? AND state = ? ORDER BY pubDate DESC LIMIT ?' % (columns, self.TABLE_EPISODES,)
             args = (channel.id, state, limit)
 
-        cur = self.cursor(lock=True)
+        cur = self.read_cursor()
         cur.execute(sql, args)
         keys = [desc[0] for desc in cur.description]
         result = map(lambda row: factory(dict(zip(keys, row)), self), cur)
-        cur.close()
-        self.lock.release()
+        self.release(cur)
         return result
 
     def load_single_episode(self, channel, factory=lambda x: x, **kwargs):
@@ -449,7 +980,7 @@ class Database(object):
         sql = 'SELECT * FROM %s WHERE %s LIMIT 1' % (self.TABLE_EPISODES, \
                 ' AND '.join('%s=?' % k for k in keys))
 
-        cur = self.cursor(lock=True)
+        cur = self.read_cursor()
         cur.execute(sql, args)
         keys = [desc[0] for desc in cur.description]
         row = cur.fetchone()
@@ -458,11 +989,10 @@ class Database(object):
         else:
             result = None
 
-        cur.close()
-        self.lock.release()
+        self.release(cur)
         return result
 
-    def load_episode(self, id):
+    def load_episode(self, id, descriptions=True):
         """Load episode as dictionary by its id
 
         This will return the data for an episode as
@@ -470,24 +1000,27 @@ class Database(object):
         """
         assert id is not None
 
-        cur = self.cursor(lock=True)
-        cur.execute('SELECT * from %s WHERE id = ? LIMIT 1' % (self.TABLE_EPISODES,), (id,))
+        cur = self.read_cursor()
+        cur.execute('SELECT %s from %s WHERE id = ? LIMIT 1' % (self._episode_columns(descriptions), self.TABLE_EPISODES,), (id,))
         try:
             d = dict(zip((desc[0] for desc in cur.description), cur.fetchone()))
-            cur.close()
+            self.release(cur)
             self.log('Loaded episode %d from DB', id)
-            self.lock.release()
             return d
         except:
-            cur.close()
-            self.lock.release()
+            self.release(cur)
             return None
 
+    def load_episode_description(self, id):
+        """Load the full description of an episode by its id"""
+        return self.__get__('SELECT description FROM %s WHERE id = ?' % \
+                self.TABLE_EPISODES, (id,))
+
     def get_channel_id_from_episode_url(self, url):
         """Return the (first) associated channel ID given an episode URL"""
         assert url is not None
 
-        cur = self.cursor(lock=True)
+        cur = self.read_cursor()
         cur.execute('SELECT channel_id FROM %s WHERE url = ? LIMIT 1' % (self.TABLE_EPISODES,), (url,))
         try:
             row = cur.fetchone()
@@ -495,7 +1028,7 @@ class Database(object):
                 self.log('Found channel ID: %d', int(row[0]), sender=self)
                 return int(row[0])
         finally:
-            self.lock.release()
+            self.release(cur)
 
         return None
 
@@ -508,27 +1041,139 @@ class Database(object):
 
         self._save_object(e, self.TABLE_EPISODES, self.SCHEMA_EPISODES)
 
+    def save_episodes(self, channel, episodes):
+        """Save a list of episodes of a channel in one go
+
+        New episodes are inserted and existing episodes are
+        updated using prepared statements (executemany), all
+        while holding the database lock only once. This is used
+        after feed updates, where saving each episode on its own
+        causes too many round trips and blocks other threads.
+        """
+        assert channel.id is not None
+
+        new_episodes, existing_episodes = [], []
+        for episode in episodes:
+            if not episode.guid:
+                self.log('Refusing to save an episode without guid: %s', episode)
+            elif episode.id is None:
+                new_episodes.append(episode)
+            else:
+                existing_episodes.append(episode)
+
+        if not new_episodes and not existing_episodes:
+            return
+
+        columns = self._schema_columns(self.SCHEMA_EPISODES)
+
+        self.lock.acquire()
+        try:
+            cur = self.cursor()
+
+            # Group changed episodes by their set of changed columns,
+            # so that each group can be updated with a single statement
+            updates = {}
+            for episode in existing_episodes:
+                dirty = tuple(episode.get_dirty_columns(columns))
+                if dirty:
+                    updates.setdefault(dirty, []).append(episode)
+
+            for dirty, changed_episodes in updates.iteritems():
+                sql = self._update_sql(self.TABLE_EPISODES, dirty)
+                try:
+                    cur.executemany(sql, ([getattr(e, name) for name in dirty] + [e.id] \
+                            for e in changed_episodes))
+                    for episode in changed_episodes:
+                        episode.mark_clean(dirty)
+                except Exception, e:
+                    log('Cannot update episodes of %s: %s', channel.url, e, \
+                            sender=self, traceback=True)
+
+            if new_episodes:
+                # Row IDs of inserted episodes are bigger than all existing
+                # IDs, so we can look them up after the insert has been done
+                cur.execute('SELECT MAX(id) FROM %s' % self.TABLE_EPISODES)
+                last_id = cur.fetchone()[0] or 0
+
+                sql = self._insert_sql(self.TABLE_EPISODES, columns)
+                try:
+                    cur.executemany(sql, ([getattr(e, name) for name in columns] \
+                            for e in new_episodes))
+                except Exception, e:
+                    log('Cannot insert episodes of %s: %s', channel.url, e, \
+                            sender=self, traceback=True)
+
+                cur.execute('SELECT guid, id FROM %s WHERE channel_id = ? AND id > ?' % \
+                        self.TABLE_EPISODES, (channel.id, last_id))
+                inserted = dict(cur)
+                for episode in new_episodes:
+                    episode.id = inserted.get(self._guid_key(episode.guid), None)
+                    if episode.id is not None:
+                        episode.mark_clean(columns)
+
+                # Fall back to saving episodes one-by-one if the batch failed
+                for episode in new_episodes:
+                    if episode.id is None:
+                        self._save_object(episode, self.TABLE_EPISODES, \
+                                self.SCHEMA_EPISODES)
+
+            cur.close()
+        finally:
+            self._counts_changed(channel.id)
+            self.lock.release()
+
+    def _guid_key(self, guid):
+        # GUIDs are returned as UTF-8 encoded strings (see text_factory)
+        if isinstance(guid, unicode):
+            return guid.encode('utf-8')
+        return guid
+
+    def _schema_columns(self, schema):
+        return [name for name, typ, required, default in schema if name != 'id']
+
+    def _insert_sql(self, table, columns):
+        key = ('INSERT', table, tuple(columns))
+        if key not in self._sql_cache:
+            qmarks = ', '.join('?'*len(columns))
+            self._sql_cache[key] = 'INSERT INTO %s (%s) VALUES (%s)' % \
+                    (table, ', '.join(columns), qmarks)
+        return self._sql_cache[key]
+
+    def _update_sql(self, table, columns):
+        key = ('UPDATE', table, tuple(columns))
+        if key not in self._sql_cache:
+            qmarks = ', '.join('%s = ?' % name for name in columns)
+            self._sql_cache[key] = 'UPDATE %s SET %s WHERE id = ?' % \
+                    (table, qmarks)
+        return self._sql_cache[key]
+
     def _save_object(self, o, table, schema):
+        columns = self._schema_columns(schema)
+
+        if o.id is not None:
+            # Only write the columns that have changed since loading
+            columns = o.get_dirty_columns(columns)
+            if not columns:
+                return
+
         self.lock.acquire()
         try:
             cur = self.cursor()
-            columns = [name for name, typ, required, default in schema if name != 'id']
             values = [getattr(o, name) for name in columns]
 
             if o.id is None:
-                qmarks = ', '.join('?'*len(columns))
-                sql = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(columns), qmarks)
-                cur.execute(sql, values)
+                cur.execute(self._insert_sql(table, columns), values)
                 o.id = cur.lastrowid
             else:
-                qmarks = ', '.join('%s = ?' % name for name in columns)
                 values.append(o.id)
-                sql = 'UPDATE %s SET %s WHERE id = ?' % (table, qmarks)
-                cur.execute(sql, values)
+                cur.execute(self._update_sql(table, columns), values)
+            o.mark_clean(columns)
         except Exception, e:
             log('Cannot save %s to %s: %s', o, table, e, sender=self, traceback=True)
 
         cur.close()
+        if table == self.TABLE_EPISODES:
+            self._counts_changed(o.channel_id)
         self.lock.release()
 
     def save_downloaded_episode(self, episode):
@@ -538,6 +1183,8 @@ class Database(object):
         cur.execute('UPDATE episodes SET state = ?, played = ?, length = ? WHERE id = ?', \
                 (episode.state, episode.is_played, episode.length, episode.id))
         cur.close()
+        episode.mark_clean(('state', 'played', 'length'))
+        self._counts_changed(episode.channel_id)
         self.lock.release()
 
     def update_episode_state(self, episode):
@@ -546,6 +1193,8 @@ class Database(object):
         cur = self.cursor(lock=True)
         cur.execute('UPDATE episodes SET state = ?, played = ?, locked = ? WHERE id = ?', (episode.state, episode.is_played, episode.is_locked, episode.id))
         cur.close()
+        episode.mark_clean(('state', 'played', 'locked'))
+        self._counts_changed(episode.channel_id)
         self.lock.release()
 
     def update_channel_lock(self, channel):
@@ -555,6 +1204,7 @@ class Database(object):
         cur = self.cursor(lock=True)
         cur.execute("UPDATE channels SET channel_is_locked = ? WHERE id = ?", (channel.channel_is_locked, channel.id, ))
         cur.close()
+        channel.mark_clean(('channel_is_locked',))
 
         self.lock.release()
 
@@ -562,7 +1212,7 @@ class Database(object):
         """
         Returns the first cell of a query result, useful for COUNT()s.
         """
-        cur = self.cursor(lock=True)
+        cur = self.read_cursor()
 
         self.log("__get__(): %s", sql)
 
@@ -572,8 +1222,7 @@ class Database(object):
             cur.execute(sql, params)
 
         row = cur.fetchone()
-        cur.close()
-        self.lock.release()
+        self.release(cur)
 
         if row is None:
             return None
@@ -601,6 +1250,18 @@ class Database(object):
         """
         return self.__get__('SELECT MAX(pubDate) FROM episodes WHERE channel_id = ?', (channel.id,))
 
+    def get_recent_pubdates(self, channel, limit):
+        """
+        Returns the "pubDate" values of the "limit"
+        most recent episodes of the given podcast.
+        """
+        cur = self.read_cursor()
+        cur.execute('SELECT pubDate FROM episodes WHERE channel_id = ? ORDER BY pubDate DESC LIMIT ?', (channel.id, limit))
+        result = [row[0] for row in cur]
+        self.release(cur)
+
+        return result
+
     def force_last_new(self, channel):
         """
         Only set the most-recent episode as "new"; this
@@ -618,8 +1279,65 @@ class Database(object):
         """, (True, channel.id, channel.id))
 
         cur.close()
+        self._counts_changed(channel.id)
+        self.lock.release()
+
+    def save_download(self, episode_id, tempname, downloaded, status):
+        """Add or update a download in the download queue"""
+        cur = self.cursor(lock=True)
+        cur.execute('INSERT OR REPLACE INTO %s (episode_id, tempname, ' \
+                'downloaded, status) VALUES (?, ?, ?, ?)' % \
+                self.TABLE_DOWNLOADS, (episode_id, tempname, downloaded, status))
+        cur.close()
+        self._commit_later()
+        self.lock.release()
+
+    def delete_download(self, episode_id):
+        """Remove a finished or cancelled download from the queue"""
+        cur = self.cursor(lock=True)
+        cur.execute('DELETE FROM %s WHERE episode_id = ?' % \
+                self.TABLE_DOWNLOADS, (episode_id,))
+        cur.close()
+        self._commit_later()
+        self.lock.release()
+
+    def _commit_later(self):
+        # Must be called with self.lock held
+        if self._commit_timer is None:
+            self._commit_timer = threading.Timer(self.DOWNLOADS_COMMIT_DELAY, \
+                    self._commit_timer_proc)
+            self._commit_timer.setDaemon(True)
+            self._commit_timer.start()
+
+    def _commit_timer_proc(self):
+        self.lock.acquire()
+        self._commit_timer = None
+        if self._db is not None:
+            self.commit()
         self.lock.release()
 
+    def load_downloads(self):
+        """Returns the saved download queue
+
+        Returns a list of (episode_id, tempname, downloaded, status)
+        tuples for all unfinished downloads.
+        """
+        cur = self.read_cursor()
+        cur.execute('SELECT episode_id, tempname, downloaded, status ' \
+                'FROM %s ORDER BY episode_id' % self.TABLE_DOWNLOADS)
+        result = cur.fetchall()
+        self.release(cur)
+        return result
+
+    def table_created(self, table_name):
+        """Returns True if "table_name" has been newly created
+
+        This is the case if the table did not exist before the
+        database has been opened (e.g. after an upgrade).
+        """
+        self.db # Make sure the tables have been set up
+        return table_name in self._created_tables
+
     def _upgrade_name(self, table_name):
         return table_name + '_save'
 
@@ -634,6 +1352,7 @@ class Database(object):
             cur.execute('DROP INDEX IF EXISTS idx_%s' % (column))
 
         self.create_table(cur, table_name, fields)
+        self._created_tables.discard(table_name)
 
         log('Correct NULL values in the existing data', sender=self)
         columns = set((column, default) for column, typ, required, default in fields if required)
@@ -647,6 +1366,7 @@ class Database(object):
 
     def create_table(self, cur, table_name, fields):
         log('Creating table %s', table_name, sender=self)
+        self._created_tables.add(table_name)
         columns = ''
         for column, typ, required, default in fields:
             if required:
@@ -718,7 +1438,9 @@ class Database(object):
         # be recreated without the unique flag. (Maemo bug 12094)
         cur.execute('PRAGMA index_list(%s)' % self.TABLE_EPISODES)
         current_indices = cur.fetchall()
-        for pos, idx_name, idx_is_unique in current_indices:
+        # Newer SQLite versions return more than three columns here
+        for index_info in current_indices:
+            pos, idx_name, idx_is_unique = index_info[:3]
             if idx_name == 'idx_guid' and idx_is_unique:
                 log('Fixing unique index (%s) in %s', idx_name, \
                         self.TABLE_EPISODES, sender=self)
@@ -742,5 +1464,18 @@ class Database(object):
         cur = self.cursor(lock=True)
         cur.execute('DELETE FROM episodes WHERE channel_id = ? AND guid = ?', \
                 (channel_id, guid))
+        self._counts_changed(channel_id)
+        self.lock.release()
+
+    def delete_episodes_by_guids(self, guids, channel_id):
+        """
+        Deletes all episodes with the given GUIDs for a
+        channel using a single prepared statement.
+        """
+        cur = self.cursor(lock=True)
+        cur.executemany('DELETE FROM episodes WHERE channel_id = ? AND guid = ?', \
+                ((channel_id, guid) for guid in guids))
+        cur.close()
+        self._counts_changed(channel_id)
         self.lock.release()
 
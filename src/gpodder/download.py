@@ -39,7 +39,6 @@ import shutil
 import os.path
 import os
 import time
-import collections
 
 import mimetypes
 import email
@@ -199,6 +198,17 @@ class DownloadURLOpener(urllib.FancyURLopener):
     # FYI: The omission of "%" in the list is to avoid double escaping!
     ESCAPE_CHARS = dict((ord(c), u'%%%x'%ord(c)) for c in u' <>#"{}|\\^[]`')
 
+    # The read size is adapted to the throughput of the download, so
+    # that each read takes about READ_TIME seconds (see adapt_block_size)
+    MIN_BLOCK_SIZE = 64*1024
+    MAX_BLOCK_SIZE = 1024*1024
+    READ_TIME = .1
+
+    # The reporthook is called every REPORT_INTERVAL seconds, and after
+    # at most REPORT_SIZE bytes
+    REPORT_INTERVAL = .2
+    REPORT_SIZE = 1024*1024
+
     def __init__( self, channel):
         self.channel = channel
         self._auth_retry_counter = 0
@@ -244,16 +254,51 @@ class DownloadURLOpener(urllib.FancyURLopener):
         # method, at the end after the line "if errcode == 200:"
         return urllib.addinfourl(fp, headers, 'http:' + url)
 
-    def retrieve_resume(self, url, filename, reporthook=None, data=None):
+    @classmethod
+    def adapt_block_size(cls, block_size, count, duration):
+        """Returns the block size for the next read of a download
+
+        "count" is the number of bytes that the last read of at most
+        "block_size" bytes returned and "duration" is the time since
+        the read before it. The block size doubles while reads are
+        fast and halves while they are slow.
+        """
+        if count == block_size and duration < cls.READ_TIME/2:
+            return min(cls.MAX_BLOCK_SIZE, block_size*2)
+        elif duration > cls.READ_TIME*2:
+            return max(cls.MIN_BLOCK_SIZE, block_size/2)
+
+        return block_size
+
+    def _remove_header(self, name):
+        self.addheaders = [(key, value) for key, value in self.addheaders \
+                if key.lower() != name.lower()]
+
+    def retrieve_resume(self, url, filename, reporthook=None, data=None, \
+            segments=1, bandwidth=None):
         """Download files from an URL; return (headers, real_url)
 
         Resumes a download if the local filename exists and
         the server supports download resuming.
+
+        If "bandwidth" is set (see BandwidthLimiter.open), the
+        number of bytes read is passed to its consume() method,
+        which waits as long as the speed limit requires.
+
+        If "segments" is greater than 1 and the server supports byte
+        ranges, large files are downloaded using up to "segments"
+        connections at the same time (see SegmentedDownload). An
+        interrupted segmented download is always resumed as such.
         """
 
         current_size = 0
         tfp = None
-        if os.path.exists(filename):
+        download = SegmentedDownload.load(self.channel, filename)
+        if download is not None:
+            # Continue with the first unfinished segment
+            current_size = download.get_resume_position()
+            self.addheader('Range', 'bytes=%s-' % (current_size))
+        elif os.path.exists(filename):
             try:
                 current_size = os.path.getsize(filename)
                 tfp = open(filename, 'ab')
@@ -265,8 +310,13 @@ class DownloadURLOpener(urllib.FancyURLopener):
                 tfp = None
                 current_size = 0
 
-        if tfp is None:
-            tfp = open(filename, 'wb')
+        if download is None:
+            if tfp is None:
+                tfp = open(filename, 'wb')
+
+            # Ask for a range to find out if the server supports segments
+            if segments > 1 and current_size == 0:
+                self.addheader('Range', 'bytes=0-')
 
         # Fix a problem with bad URLs that are not encoded correctly (bug 549)
         url = url.decode('ascii', 'ignore')
@@ -276,12 +326,36 @@ class DownloadURLOpener(urllib.FancyURLopener):
         url = urllib.unwrap(urllib.toBytes(url))
         fp = self.open(url, data)
         headers = fp.info()
+        range = ContentRange.parse(headers.get('content-range', ''))
+        result = headers, fp.geturl()
+
+        if download is not None:
+            if download.can_resume(range):
+                download.run(fp.geturl(), fp, reporthook, bandwidth)
+                return result
+
+            # Start again from scratch with a single connection
+            log('Cannot resume segmented download', sender=self)
+            fp.close()
+            download.discard()
+            open(filename, 'wb').close()
+            self._remove_header('Range')
+            return self.retrieve_resume(url, filename, reporthook, data, \
+                    segments, bandwidth)
+
+        if segments > 1 and range is not None and \
+                range.start == current_size and range.length is not None:
+            download = SegmentedDownload.create(self.channel, filename, \
+                    current_size, range.length, segments)
+            if download is not None:
+                tfp.close()
+                download.run(fp.geturl(), fp, reporthook, bandwidth)
+                return result
 
         if current_size > 0:
             # We told the server to resume - see if she agrees
             # See RFC2616 (206 Partial Content + Section 14.16)
             # XXX check status code here, too...
-            range = ContentRange.parse(headers.get('content-range', ''))
             if range is None or range.start != current_size:
                 # Ok, that did not work. Reset the download
                 # TODO: seek and truncate if content-range differs from request
@@ -290,15 +364,15 @@ class DownloadURLOpener(urllib.FancyURLopener):
                 current_size = 0
                 log('Cannot resume. Missing or wrong Content-Range header (RFC2616)', sender=self)
 
-        result = headers, fp.geturl()
-        bs = 1024*8
+        bs = self.MIN_BLOCK_SIZE
         size = -1
         read = current_size
-        blocknum = int(current_size/bs)
+        if "content-length" in headers:
+            size = int(headers.getrawheader("Content-Length")) + current_size
         if reporthook:
-            if "content-length" in headers:
-                size = int(headers.getrawheader("Content-Length"))  + current_size
-            reporthook(blocknum, bs, size)
+            reporthook(read, 1, size)
+        last_read = last_report = time.time()
+        last_report_size = read
         while read < size or size == -1:
             if size == -1:
                 block = fp.read(bs)
@@ -308,9 +382,19 @@ class DownloadURLOpener(urllib.FancyURLopener):
                 break
             read += len(block)
             tfp.write(block)
-            blocknum += 1
-            if reporthook:
-                reporthook(blocknum, bs, size)
+            if bandwidth is not None:
+                bandwidth.consume(len(block))
+
+            now = time.time()
+            bs = self.adapt_block_size(bs, len(block), now-last_read)
+            last_read = now
+            if reporthook and (now - last_report >= self.REPORT_INTERVAL or \
+                    read - last_report_size >= self.REPORT_SIZE):
+                reporthook(read, 1, size)
+                last_report = now
+                last_report_size = read
+        if reporthook:
+            reporthook(read, 1, size)
         fp.close()
         tfp.close()
         del fp
@@ -338,93 +422,637 @@ class DownloadURLOpener(urllib.FancyURLopener):
         return (None, None)
 
 
+class DownloadSegment(object):
+    """A byte range of a segmented download
+
+    "end" is the offset after the last byte of the segment and
+    "position" is the offset of the next byte to be downloaded.
+    """
+    def __init__(self, start, end, position=None):
+        self.start = start
+        self.end = end
+        if position is None:
+            self.position = start
+        else:
+            self.position = position
+
+    def is_finished(self):
+        return self.position >= self.end
+
+
+class SegmentedDownload(object):
+    """Download a file in parallel byte ranges
+
+    The target file is preallocated to its full size, and every
+    segment is downloaded with its own connection into its part of
+    the file. The progress of all segments is saved in a state file
+    next to the target file, so that the download can be resumed
+    after gPodder has been closed (or crashed).
+
+    This is used for large files on servers that support byte ranges,
+    as some servers limit the bandwidth of each single connection.
+
+    >>> import tempfile, shutil
+    >>> tempdir = tempfile.mkdtemp()
+    >>> filename = os.path.join(tempdir, 'episode.mp3.partial')
+
+    Files smaller than two segments are not split:
+
+    >>> print SegmentedDownload.create(None, filename, 0, 1024*1024, 4)
+    None
+    >>> download = SegmentedDownload.create(None, filename, 0, 10*1024*1024, 4)
+    >>> [(s.start, s.end) for s in download.segments]
+    [(0, 5242880), (5242880, 10485760)]
+
+    The state is saved next to the (preallocated) file:
+
+    >>> fp = open(filename, 'wb')
+    >>> fp.truncate(download.length)
+    >>> fp.close()
+    >>> download.segments[0].position = 1000
+    >>> download.save()
+    >>> os.path.exists(filename + '.segments')
+    True
+
+    An interrupted download is resumed from its first unfinished segment:
+
+    >>> download = SegmentedDownload.load(None, filename)
+    >>> [(s.start, s.end, s.position) for s in download.segments]
+    [(0, 5242880, 1000), (5242880, 10485760, 5242880)]
+    >>> download.get_resume_position()
+    1000
+    >>> SegmentedDownload.get_downloaded_size(filename)
+    1000
+    >>> download.can_resume(ContentRange.parse('bytes 1000-10485759/10485760'))
+    True
+    >>> download.can_resume(ContentRange.parse('bytes 0-10485759/10485760'))
+    False
+
+    Invalid state files are removed:
+
+    >>> open(filename + '.segments', 'w').write('invalid')
+    >>> print SegmentedDownload.load(None, filename)
+    None
+    >>> os.path.exists(filename + '.segments')
+    False
+    >>> shutil.rmtree(tempdir)
+    """
+    # Segments are never smaller than this (in bytes)
+    MIN_SEGMENT_SIZE = 4*1024*1024
+
+    # Seconds between progress reports and saving the state file
+    REPORT_INTERVAL = .5
+    SAVE_INTERVAL = 5.
+
+    def __init__(self, channel, filename, length, segments):
+        self.channel = channel
+        self.filename = filename
+        self.length = length
+        self.segments = segments
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._error = None
+        self._bandwidth = None
+
+    @classmethod
+    def get_state_filename(cls, filename):
+        return filename + '.segments'
+
+    @classmethod
+    def create(cls, channel, filename, start, length, count):
+        """Plan a new segmented download of "filename"
+
+        The bytes from "start" up to "length" are split into at most
+        "count" segments. Returns None if the file is too small to be
+        split, so it should be downloaded with one connection.
+        """
+        count = min(count, (length-start) / cls.MIN_SEGMENT_SIZE)
+        if count < 2:
+            return None
+
+        size = (length-start) / count
+        offsets = [start+i*size for i in range(count)] + [length]
+        segments = [DownloadSegment(offsets[i], offsets[i+1]) \
+                for i in range(count)]
+        return cls(channel, filename, length, segments)
+
+    @classmethod
+    def load(cls, channel, filename):
+        """Load an interrupted segmented download of "filename"
+
+        Returns None if there is no (valid) state file for it.
+        """
+        state_filename = cls.get_state_filename(filename)
+        if not os.path.exists(state_filename):
+            return None
+
+        try:
+            lines = open(state_filename).read().splitlines()
+            length = int(lines[0])
+            segments = [DownloadSegment(*map(int, line.split())) \
+                    for line in lines[1:]]
+            if segments and os.path.getsize(filename) == length:
+                return cls(channel, filename, length, segments)
+        except Exception, e:
+            log('Invalid segment state for %s: %s', filename, e)
+
+        util.delete_file(state_filename)
+        return None
+
+    @classmethod
+    def get_downloaded_size(cls, filename):
+        """Returns the number of downloaded bytes of "filename"
+
+        Returns None if "filename" is not a segmented download.
+        """
+        download = cls.load(None, filename)
+        if download is None:
+            return None
+
+        return download.length - sum(s.end-s.position for s in download.segments)
+
+    def save(self):
+        state_filename = self.get_state_filename(self.filename)
+        with self._lock:
+            lines = [str(self.length)] + ['%d %d %d' % \
+                    (s.start, s.end, s.position) for s in self.segments]
+        fp = open(state_filename+'.tmp', 'w')
+        fp.write('\n'.join(lines))
+        fp.close()
+        try:
+            os.rename(state_filename+'.tmp', state_filename)
+        except OSError:
+            # os.rename() does not replace existing files on Windows
+            util.delete_file(state_filename)
+            os.rename(state_filename+'.tmp', state_filename)
+
+    def discard(self):
+        util.delete_file(self.get_state_filename(self.filename))
+
+    def get_resume_position(self):
+        """The offset from which a resumed download should start"""
+        for segment in self.segments:
+            if not segment.is_finished():
+                return segment.position
+
+        return self.length
+
+    def can_resume(self, range):
+        """Check if the response to a resume request can be used
+
+        "range" is the ContentRange of the response to a request
+        for the bytes starting at get_resume_position().
+        """
+        return range is not None and range.length == self.length and \
+                range.start == self.get_resume_position()
+
+    def _download_segment(self, segment, url, fp):
+        tfp = None
+        try:
+            if fp is None:
+                opener = DownloadURLOpener(self.channel)
+                opener.addheader('Range', 'bytes=%d-%d' % \
+                        (segment.position, segment.end-1))
+                fp = opener.open(url)
+                range = ContentRange.parse(fp.info().get('content-range', ''))
+                if range is None or range.start != segment.position:
+                    raise urllib.ContentTooShortError('server did not ' \
+                            'send the requested range', None)
+
+            # Unbuffered, so saved positions are never ahead of the file
+            tfp = open(self.filename, 'r+b', 0)
+            tfp.seek(segment.position)
+            bs = DownloadURLOpener.MIN_BLOCK_SIZE
+            last_read = time.time()
+            while not self._stopped and not segment.is_finished():
+                block = fp.read(min(bs, segment.end-segment.position))
+                if not block:
+                    break
+                tfp.write(block)
+                with self._lock:
+                    segment.position += len(block)
+                if self._bandwidth is not None:
+                    self._bandwidth.consume(len(block))
+
+                now = time.time()
+                bs = DownloadURLOpener.adapt_block_size(bs, len(block), \
+                        now-last_read)
+                last_read = now
+        except Exception, e:
+            log('Error in segment %d-%d: %s', segment.start, segment.end, \
+                    e, sender=self)
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self._stopped = True
+
+        if fp is not None:
+            fp.close()
+        if tfp is not None:
+            tfp.close()
+
+    def run(self, url, fp, reporthook=None, bandwidth=None):
+        """Download all unfinished segments from "url"
+
+        "fp" is an open response for the bytes starting at
+        get_resume_position() and is used for that segment. If
+        "reporthook" raises an exception, the download is stopped
+        and the exception is passed on to the caller. All segments
+        share the speed limit of "bandwidth" (if it is set).
+        """
+        self._bandwidth = bandwidth
+        if not os.path.exists(self.filename) or \
+                os.path.getsize(self.filename) < self.length:
+            tfp = open(self.filename, 'ab')
+            tfp.truncate(self.length)
+            tfp.close()
+        self.save()
+
+        log('Downloading %s in %d segments', self.filename, \
+                len(self.segments), sender=self)
+
+        workers = []
+        resume_position = self.get_resume_position()
+        for segment in self.segments:
+            if segment.is_finished():
+                continue
+            elif segment.position == resume_position:
+                segment_fp, fp = fp, None
+            else:
+                segment_fp = None
+            worker = threading.Thread(target=self._download_segment, \
+                    args=(segment, url, segment_fp))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+
+        if fp is not None:
+            fp.close()
+
+        last_save = time.time()
+        try:
+            while True:
+                active = [w for w in workers if w.isAlive()]
+                if not active:
+                    break
+
+                active[0].join(self.REPORT_INTERVAL)
+                if reporthook is not None:
+                    remaining = sum(s.end-s.position for s in self.segments)
+                    reporthook(self.length-remaining, 1, self.length)
+
+                if time.time() - last_save > self.SAVE_INTERVAL:
+                    self.save()
+                    last_save = time.time()
+        except:
+            self._stopped = True
+            for worker in workers:
+                worker.join()
+            self.save()
+            raise
+
+        self.save()
+
+        if self._error is not None:
+            raise self._error
+
+        remaining = sum(s.end-s.position for s in self.segments)
+        if remaining:
+            raise urllib.ContentTooShortError('retrieval incomplete: got ' \
+                    'only %i out of %i bytes' % (self.length-remaining, \
+                    self.length), None)
+
+        self.discard()
+
+
+class BandwidthStream(object):
+    """The share of a single download in a BandwidthLimiter"""
+
+    def __init__(self, limiter, host, weight):
+        self.limiter = limiter
+        self.host = host
+        self.weight = weight
+        # Token bucket of this download: [tokens, last update]
+        self.bucket = [0., time.time()]
+        # Time until which the download waits to pay off its debt
+        self.wake_time = 0.
+
+    def consume(self, count):
+        """Take "count" bytes from the bandwidth; may block"""
+        self.limiter._consume(self, count)
+
+    def close(self):
+        """Give the share of this download to the others"""
+        self.limiter._close(self)
+
+
+class BandwidthLimiter(object):
+    """Speed limit for all downloads, shared using token buckets
+
+    If "limit_rate" is enabled, the downloads that are open in this
+    limiter together get at most "limit_rate_value" KB/s. Each download
+    gets a share of this limit according to its weight (a download with
+    weight 4 can be four times as fast as one with weight 1), which is
+    recalculated whenever downloads start, finish or idle. If the
+    "limit_rate_per_host_value" setting is not zero, all downloads from
+    the same host together are also limited to that speed (in KB/s).
+
+    Usage (all methods can be called from any thread):
+
+        limiter = BandwidthLimiter(config)
+        bandwidth = limiter.open('example.com', weight=1)
+        bandwidth.consume(len(data)) # after each read
+        bandwidth.close()
+
+    consume() waits until the download has enough tokens for the data
+    that it has read. The limits are read from the configuration on
+    every call, so changes are applied to running downloads at once.
+
+    Four downloads reading 64 KB at a time, simulated for two minutes
+    with a fake clock, together stay at the limit of 50 KB/s:
+
+    >>> class Config(object):
+    ...     limit_rate, limit_rate_value, limit_rate_per_host_value = True, 50, 0
+    >>> class Clock(object):
+    ...     now, slept = 0., 0.
+    ...     def time(self): return self.now
+    ...     def sleep(self, seconds): self.slept = seconds
+    >>> import gpodder.download
+    >>> clock = gpodder.download.time = Clock()
+    >>> limiter = BandwidthLimiter(Config())
+    >>> streams = [limiter.open('example.com') for i in range(4)]
+    >>> wake_times = [0.]*len(streams)
+    >>> received = 0
+    >>> while clock.now < 120:
+    ...     index = wake_times.index(min(wake_times))
+    ...     clock.now, clock.slept = wake_times[index], 0.
+    ...     streams[index].consume(64*1024)
+    ...     received += 64*1024
+    ...     wake_times[index] = clock.now + clock.slept
+    >>> gpodder.download.time = time
+    >>> 45 < received/1024./120 < 55
+    True
+    """
+
+    # Seconds of unused bandwidth that a download can save up for bursts
+    BURST_TIME = 1.
+
+    # Downloads that have not read anything for this many seconds (e.g.
+    # from a slow server) leave their share to the others; downloads
+    # waiting in consume() keep their share until they wake up
+    IDLE_TIME = 1.
+
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+        self._streams = []
+        # Token buckets shared by downloads from the same host
+        self._hosts = {}
+
+    def open(self, host, weight=1):
+        """Start a download from "host"; returns a BandwidthStream"""
+        stream = BandwidthStream(self, host, max(1, weight))
+        with self._lock:
+            self._streams.append(stream)
+            if host not in self._hosts:
+                self._hosts[host] = [0., time.time()]
+        return stream
+
+    def _close(self, stream):
+        with self._lock:
+            if stream in self._streams:
+                self._streams.remove(stream)
+                if not [s for s in self._streams if s.host == stream.host]:
+                    del self._hosts[stream.host]
+
+    def _take(self, bucket, rate, count, now):
+        # Refill "bucket" with "rate" bytes per second and take "count"
+        # bytes from it; returns the time to wait if it is in debt now
+        tokens, last_update = bucket
+        tokens = min(rate*self.BURST_TIME, tokens + (now-last_update)*rate)
+        bucket[:] = [tokens-count, now]
+        if tokens < count:
+            return float(count-tokens)/rate
+        return 0.
+
+    def _consume(self, stream, count):
+        if not self._config.limit_rate:
+            return
+
+        rate = self._config.limit_rate_value*1024.
+        host_rate = self._config.limit_rate_per_host_value*1024.
+        delay = 0.
+
+        with self._lock:
+            now = time.time()
+            if rate > 0:
+                total_weight = stream.weight + sum(s.weight for s in \
+                        self._streams if s is not stream and \
+                        max(s.bucket[1], s.wake_time) > now - self.IDLE_TIME)
+                share = rate*stream.weight/total_weight
+                delay = self._take(stream.bucket, share, count, now)
+            if host_rate > 0 and stream.host in self._hosts:
+                delay = max(delay, self._take(self._hosts[stream.host], \
+                        host_rate, count, now))
+            stream.wake_time = now + delay
+
+        if delay > 0:
+            time.sleep(delay)
+
+
 class DownloadQueueWorker(threading.Thread):
-    def __init__(self, queue, exit_callback, continue_check_callback, minimum_tasks):
-        threading.Thread.__init__(self)
-        self.queue = queue
-        self.exit_callback = exit_callback
-        self.continue_check_callback = continue_check_callback
+    """A worker thread that runs tasks of a DownloadQueueManager
 
-        # The minimum amount of tasks that should be downloaded by this worker
-        # before using the continue_check_callback to determine if it might
-        # continue accepting tasks. This can be used to forcefully start a
-        # download, even if a download limit is in effect.
-        self.minimum_tasks = minimum_tasks
+    The worker asks the manager for the next task that can be started
+    and waits for new tasks while there are none. After being idle for
+    IDLE_TIMEOUT seconds, the worker exits.
+    """
+    IDLE_TIMEOUT = 60.
+
+    def __init__(self, manager):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.manager = manager
 
     def run(self):
         log('Running new thread: %s', self.getName(), sender=self)
         while True:
-            # Check if this thread is allowed to continue accepting tasks
-            # (But only after reducing minimum_tasks to zero - see above)
-            if self.minimum_tasks > 0:
-                self.minimum_tasks -= 1
-            elif not self.continue_check_callback(self):
-                log('%s must not accept new tasks.', self.getName(), sender=self)
-                return
+            task = self.manager._next_task(self, self.IDLE_TIMEOUT)
+            if task is None:
+                log('No more tasks for %s to carry out.', self.getName(), sender=self)
+                break
 
+            log('%s is processing: %s', self.getName(), task, sender=self)
             try:
-                task = self.queue.pop()
-                log('%s is processing: %s', self.getName(), task, sender=self)
                 task.run()
-            except IndexError, e:
-                log('No more tasks for %s to carry out.', self.getName(), sender=self)
-                break
-        self.exit_callback(self)
+            finally:
+                self.manager._task_finished(task)
 
 
 class DownloadQueueManager(object):
-    def __init__(self, config):
+    """Schedule download tasks on a pool of worker threads
+
+    Queued tasks are started in order of their priority (forced tasks
+    first), then newest episodes first and then smallest files first.
+    At most "max_downloads" tasks (if "max_downloads_enabled" is set)
+    and at most "max_downloads_per_host" tasks from the same server are
+    downloaded at the same time, so that tasks from a slow server can't
+    block downloads from other servers. Forced tasks ignore both limits.
+
+    Idle worker threads are reused for new tasks (see DownloadQueueWorker).
+    If "max_downloads" is set, it is used instead of the settings.
+    """
+
+    def __init__(self, config, max_downloads=None):
         self._config = config
-        self.tasks = collections.deque()
+        self._max_downloads = max_downloads
+        self.tasks = []
+        self.bandwidth_limiter = BandwidthLimiter(config)
 
-        self.worker_threads_access = threading.RLock()
+        self.worker_threads_access = threading.Condition(threading.RLock())
         self.worker_threads = []
+        self._idle_workers = 0
+        self._active_tasks = 0
+        self._active_hosts = {}
+        self._closed = False
 
-    def __exit_callback(self, worker_thread):
-        with self.worker_threads_access:
-            self.worker_threads.remove(worker_thread)
+    def _get_host(self, task):
+        return urlparse.urlparse(task.url)[1]
 
-    def __continue_check_callback(self, worker_thread):
-        with self.worker_threads_access:
-            if len(self.worker_threads) > self._config.max_downloads and \
-                    self._config.max_downloads_enabled:
-                self.worker_threads.remove(worker_thread)
-                return False
-            else:
-                return True
+    def _get_sort_key(self, task):
+        return (-task.priority, -(task.episode.pubDate or 0), task.total_size)
 
-    def spawn_threads(self, force_start=False):
-        """Spawn new worker threads if necessary
+    def _get_startable_tasks(self):
+        """Returns the queued tasks that can be started now, in order
 
-        If force_start is True, forcefully spawn a thread and
-        let it process at least one episodes, even if a download
-        limit is in effect at the moment.
+        Must be called with self.worker_threads_access held.
+        """
+        active = self._active_tasks
+        active_hosts = dict(self._active_hosts)
+        if self._max_downloads is not None:
+            max_active = max(1, self._max_downloads)
+        elif self._config.max_downloads_enabled:
+            max_active = max(1, self._config.max_downloads)
+        else:
+            max_active = None
+        max_per_host = max(1, self._config.max_downloads_per_host)
+
+        result = []
+        for task in sorted(self.tasks, key=self._get_sort_key):
+            host = self._get_host(task)
+            if task.status != DownloadTask.QUEUED:
+                # Will be skipped by task.run(), so don't wait for it
+                result.append(task)
+                continue
+            elif task.priority < DownloadTask.PRIORITY_HIGH:
+                if max_active is not None and active >= max_active:
+                    continue
+                if active_hosts.get(host, 0) >= max_per_host:
+                    continue
+            active += 1
+            active_hosts[host] = active_hosts.get(host, 0) + 1
+            result.append(task)
+
+        return result
+
+    def _next_task(self, worker_thread, timeout):
+        """Take the next task for "worker_thread" from the queue
+
+        Waits up to "timeout" seconds for a task that can be started
+        and returns None (removing the worker) if there is none. The
+        worker counts as idle from its start or the end of its last
+        task until it gets a new task.
+        """
+        with self.worker_threads_access:
+            end_time = time.time() + timeout
+            while True:
+                if self._closed:
+                    self._idle_workers -= 1
+                    self.worker_threads.remove(worker_thread)
+                    return None
+
+                startable = self._get_startable_tasks()
+                if startable:
+                    task = startable[0]
+                    self.tasks.remove(task)
+                    host = self._get_host(task)
+                    self._idle_workers -= 1
+                    self._active_tasks += 1
+                    self._active_hosts[host] = self._active_hosts.get(host, 0) + 1
+                    return task
+
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    self._idle_workers -= 1
+                    self.worker_threads.remove(worker_thread)
+                    return None
+
+                self.worker_threads_access.wait(remaining)
+
+    def _task_finished(self, task):
+        with self.worker_threads_access:
+            host = self._get_host(task)
+            self._idle_workers += 1
+            self._active_tasks -= 1
+            self._active_hosts[host] -= 1
+            if not self._active_hosts[host]:
+                del self._active_hosts[host]
+        # A slot is free now - another task might be able to start
+        self.spawn_threads()
+
+    def spawn_threads(self):
+        """Wake up or spawn worker threads for tasks that can start
+
+        Idle worker threads are woken up first; new threads are only
+        created if there are more tasks that can be started right now
+        than idle threads.
         """
         with self.worker_threads_access:
-            if not len(self.tasks):
+            if self._closed:
                 return
 
-            if force_start or len(self.worker_threads) == 0 or \
-                    len(self.worker_threads) < self._config.max_downloads or \
-                    not self._config.max_downloads_enabled:
-                # We have to create a new thread here, there's work to do
-                log('I am going to spawn a new worker thread.', sender=self)
+            startable = len(self._get_startable_tasks())
+            if not startable:
+                return
 
-                # The new worker should process at least one task (the one
-                # that we want to forcefully start) if force_start is True.
-                if force_start:
-                    minimum_tasks = 1
-                else:
-                    minimum_tasks = 0
+            if self._idle_workers:
+                self.worker_threads_access.notifyAll()
 
-                worker = DownloadQueueWorker(self.tasks, self.__exit_callback, \
-                        self.__continue_check_callback, minimum_tasks)
+            for i in range(startable - self._idle_workers):
+                log('I am going to spawn a new worker thread.', sender=self)
+                worker = DownloadQueueWorker(self)
                 self.worker_threads.append(worker)
+                self._idle_workers += 1
                 worker.start()
 
+    def close(self, timeout=None):
+        """Stop the worker threads and wait for running tasks
+
+        Call this after all tasks have been paused or cancelled, so that
+        they can save their state. No new tasks are started afterwards.
+        Running tasks get at most "timeout" seconds (all together) to
+        finish; returns False if some are still running after that.
+        """
+        with self.worker_threads_access:
+            self._closed = True
+            self.worker_threads_access.notifyAll()
+            workers = list(self.worker_threads)
+
+        if timeout is not None:
+            end_time = time.time() + timeout
+        for worker in workers:
+            if timeout is None:
+                worker.join()
+            else:
+                worker.join(max(0, end_time-time.time()))
+            if worker.isAlive():
+                log('Downloads still running after closing', sender=self)
+                return False
+        return True
+
     def are_queued_or_active_tasks(self):
         with self.worker_threads_access:
-            return len(self.worker_threads) > 0
+            return len(self.tasks) > 0 or self._active_tasks > 0
 
     def add_task(self, task, force_start=False):
         """Add a new task to the download queue
@@ -433,24 +1061,30 @@ class DownloadQueueManager(object):
         and forcefully start the download right away.
         """
         if task.status != DownloadTask.INIT:
-            # This task is old so update episode from db
-            task.episode.reload_from_db()
-
             # Remove the task from its current position in the
             # download queue (if any) to avoid race conditions
             # where two worker threads download the same file
-            try:
-                self.tasks.remove(task)
-            except ValueError, e:
-                pass
-        task.status = DownloadTask.QUEUED
+            with self.worker_threads_access:
+                try:
+                    self.tasks.remove(task)
+                except ValueError, e:
+                    pass
+
+            # This task is old so update episode from db
+            task.episode.reload_from_db()
+
+        # Setting the status saves it and notifies the GUI, so this
+        # is done without holding the lock of the queue
+        task.bandwidth_limiter = self.bandwidth_limiter
         if force_start:
-            # Add the task to be taken on next pop
-            self.tasks.append(task)
+            task.priority = DownloadTask.PRIORITY_HIGH
         else:
-            # Add the task to the end of the queue
-            self.tasks.appendleft(task)
-        self.spawn_threads(force_start)
+            task.priority = DownloadTask.PRIORITY_NORMAL
+        task.status = DownloadTask.QUEUED
+
+        with self.worker_threads_access:
+            self.tasks.append(task)
+        self.spawn_threads()
 
 
 class DownloadTask(object):
@@ -530,6 +1164,9 @@ class DownloadTask(object):
             _('Finished'), _('Failed'), _('Cancelled'), _('Paused'))
     (INIT, QUEUED, DOWNLOADING, DONE, FAILED, CANCELLED, PAUSED) = range(7)
 
+    # Priorities of tasks; also their weight when sharing the bandwidth
+    PRIORITY_NORMAL, PRIORITY_HIGH = 1, 4
+
     def __str__(self):
         return self.__episode.title
 
@@ -540,6 +1177,8 @@ class DownloadTask(object):
         if status != self.__status:
             self.__status_changed = True
             self.__status = status
+            self.__save_state()
+            self._changed(self)
 
     status = property(fget=__get_status, fset=__set_status)
 
@@ -569,7 +1208,22 @@ class DownloadTask(object):
 
     def removed_from_list(self):
         if self.status != self.DONE:
-            util.delete_file(self.tempname)
+            self.__delete_partial()
+        self.__episode.db.delete_download(self.__episode.id)
+
+    def __save_state(self):
+        # Unfinished downloads are kept in the database, so
+        # they can be restored when gPodder is started again
+        if self.status in (self.DONE, self.CANCELLED):
+            self.__episode.db.delete_download(self.__episode.id)
+        else:
+            self.__episode.db.save_download(self.__episode.id, \
+                    self.tempname, int(self.progress*self.total_size), \
+                    self.status)
+
+    def __delete_partial(self):
+        util.delete_file(self.tempname)
+        util.delete_file(SegmentedDownload.get_state_filename(self.tempname))
 
     def __init__(self, episode, config):
         self.__status = DownloadTask.INIT
@@ -593,19 +1247,24 @@ class DownloadTask(object):
         # Have we already shown this task in a notification?
         self._notification_shown = False
 
-        # Variables for speed limit and speed calculation
+        # Variables for speed calculation
         self.__start_time = 0
         self.__start_blocks = 0
-        self.__limit_rate_value = self._config.limit_rate_value
-        self.__limit_rate = self._config.limit_rate
+
+        # Set by DownloadQueueManager (see BandwidthLimiter)
+        self.priority = DownloadTask.PRIORITY_NORMAL
+        self.bandwidth_limiter = None
 
         # Callbacks
         self._progress_updated = lambda x: None
+        self._changed = lambda task: None
 
         # If the tempname already exists, set progress accordingly
         if os.path.exists(self.tempname):
             try:
-                already_downloaded = os.path.getsize(self.tempname)
+                already_downloaded = SegmentedDownload.get_downloaded_size(self.tempname)
+                if already_downloaded is None:
+                    already_downloaded = os.path.getsize(self.tempname)
                 if self.total_size > 0:
                     self.progress = max(0.0, min(1.0, float(already_downloaded)/self.total_size))
             except OSError, os_error:
@@ -638,6 +1297,15 @@ class DownloadTask(object):
     def add_progress_callback(self, callback):
         self._progress_updated = callback
 
+    def add_changed_callback(self, callback):
+        """Set a function to be called when this task changes
+
+        The callback is called with the task as parameter when its
+        status or progress has changed. It can be called from any
+        thread, so it should only take note of the change.
+        """
+        self._changed = callback
+
     def status_updated(self, count, blockSize, totalSize):
         # We see a different "total size" while downloading,
         # so correct the total size variable in the thread
@@ -649,6 +1317,7 @@ class DownloadTask(object):
             self._progress_updated(self.progress)
 
         self.calculate_speed(count, blockSize)
+        self._changed(self)
 
         if self.status == DownloadTask.CANCELLED:
             raise DownloadCancelledException()
@@ -657,44 +1326,19 @@ class DownloadTask(object):
             raise DownloadCancelledException()
 
     def calculate_speed(self, count, blockSize):
-        if count % 5 == 0:
-            now = time.time()
-            if self.__start_time > 0:
-                # Has rate limiting been enabled or disabled?                
-                if self.__limit_rate != self._config.limit_rate: 
-                    # If it has been enabled then reset base time and block count                    
-                    if self._config.limit_rate:
-                        self.__start_time = now
-                        self.__start_blocks = count
-                    self.__limit_rate = self._config.limit_rate
-                    
-                # Has the rate been changed and are we currently limiting?            
-                if self.__limit_rate_value != self._config.limit_rate_value and self.__limit_rate: 
-                    self.__start_time = now
-                    self.__start_blocks = count
-                    self.__limit_rate_value = self._config.limit_rate_value
-
-                passed = now - self.__start_time
-                if passed > 0:
-                    speed = ((count-self.__start_blocks)*blockSize)/passed
-                else:
-                    speed = 0
+        now = time.time()
+        if self.__start_time > 0:
+            passed = now - self.__start_time
+            if passed > 0:
+                speed = ((count-self.__start_blocks)*blockSize)/passed
             else:
-                self.__start_time = now
-                self.__start_blocks = count
-                passed = now - self.__start_time
-                speed = count*blockSize
-
-            self.speed = float(speed)
-
-            if self._config.limit_rate and speed > self._config.limit_rate_value:
-                # calculate the time that should have passed to reach
-                # the desired download rate and wait if necessary
-                should_have_passed = float((count-self.__start_blocks)*blockSize)/(self._config.limit_rate_value*1024.0)
-                if should_have_passed > passed:
-                    # sleep a maximum of 10 seconds to not cause time-outs
-                    delay = min(10.0, float(should_have_passed-passed))
-                    time.sleep(delay)
+                speed = 0
+        else:
+            self.__start_time = now
+            self.__start_blocks = count
+            speed = 0
+
+        self.speed = float(speed)
 
     def run(self):
         # Speed calculation (re-)starts here
@@ -703,9 +1347,10 @@ class DownloadTask(object):
 
         # If the download has already been cancelled, skip it
         if self.status == DownloadTask.CANCELLED:
-            util.delete_file(self.tempname)
+            self.__delete_partial()
             self.progress = 0.0
             self.speed = 0.0
+            self._changed(self)
             return False
 
         # We only start this download if its status is "queued"
@@ -716,13 +1361,20 @@ class DownloadTask(object):
         self.status = DownloadTask.DOWNLOADING
         self._notification_shown = False
 
+        bandwidth = None
         try:
             # Resolve URL and start downloading the episode
             url = youtube.get_real_download_url(self.__episode.url, \
                     self._config.youtube_preferred_fmt_id)
+            limiter = self.bandwidth_limiter
+            if limiter is None:
+                limiter = BandwidthLimiter(self._config)
+            bandwidth = limiter.open(urlparse.urlparse(url)[1], self.priority)
             downloader =  DownloadURLOpener(self.__episode.channel)
             headers, real_url = downloader.retrieve_resume(url, \
-                    self.tempname, reporthook=self.status_updated)
+                    self.tempname, reporthook=self.status_updated, \
+                    segments=self._config.download_segments, \
+                    bandwidth=bandwidth)
 
             new_mimetype = headers.get('content-type', self.__episode.mimetype)
             old_mimetype = self.__episode.mimetype
@@ -777,7 +1429,7 @@ class DownloadTask(object):
         except DownloadCancelledException:
             log('Download has been cancelled/paused: %s', self, sender=self)
             if self.status == DownloadTask.CANCELLED:
-                util.delete_file(self.tempname)
+                self.__delete_partial()
                 self.progress = 0.0
                 self.speed = 0.0
         except urllib.ContentTooShortError, ctse:
@@ -798,6 +1450,9 @@ class DownloadTask(object):
             log('Download error: %s', str(e), traceback=True, sender=self)
             self.error_message = _('Error: %s') % (str(e),)
 
+        if bandwidth is not None:
+            bandwidth.close()
+
         if self.status == DownloadTask.DOWNLOADING:
             # Everything went well - we're done
             self.status = DownloadTask.DONE
@@ -805,11 +1460,13 @@ class DownloadTask(object):
                 self.total_size = util.calculate_size(self.filename)
                 log('Total size updated to %d', self.total_size, sender=self)
             self.progress = 1.0
+            self._changed(self)
             if gpodder.user_hooks is not None:
                 gpodder.user_hooks.on_episode_downloaded(self.__episode)
             return True
         
         self.speed = 0.0
+        self._changed(self)
 
         # We finished, but not successfully (at least not really)
         return False
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2011 Thomas Perl and the gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+#
+#  executor.py -- A shared pool of worker threads for background jobs
+#
+
+from __future__ import with_statement
+
+from gpodder.liblogger import log
+
+import threading
+import time
+
+
+class Job(object):
+    """A function call submitted to an Executor
+
+    Jobs that have not started yet can be cancelled. Running jobs
+    are not interrupted, but long-running functions can check the
+    "cancelled" attribute of the job (see Executor.current_job).
+    """
+    def __init__(self, executor, queue, func, args, kwargs, not_before):
+        self.queue = queue
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.not_before = not_before
+        self.cancelled = False
+        self._executor = executor
+        self._started = False
+        self._finished = threading.Event()
+
+    def cancel(self):
+        """Cancel the job; returns False if it has already started"""
+        return self._executor._cancel_job(self)
+
+    def done(self):
+        return self._finished.isSet()
+
+    def wait(self, timeout=None):
+        """Wait until the job has finished or has been cancelled"""
+        self._finished.wait(timeout)
+        return self._finished.isSet()
+
+
+class _JobQueue(object):
+    def __init__(self, name, priority, max_active):
+        self.name = name
+        self.priority = priority
+        self.max_active = max_active
+        self.jobs = []
+        self.active = 0
+
+
+class Executor(object):
+    """Run jobs in a bounded pool of long-lived worker threads
+
+    Jobs are submitted to named queues. Each queue has a priority and
+    a maximum number of jobs that can run at the same time, e.g. a
+    queue with max_active=1 runs its jobs one after another. Waiting
+    jobs of queues with a higher priority are started first; jobs of
+    the same priority are started in the order they were submitted.
+
+    Worker threads are started when needed (up to max_workers) and
+    exit after they have been idle for IDLE_TIMEOUT seconds.
+
+        executor.add_queue('delete', executor.PRIORITY_NORMAL, 1)
+        job = executor.submit('delete', episode.delete_from_disk)
+        job = executor.submit_later(60, 'default', config.save)
+        job.cancel()
+    """
+    PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH = range(3)
+
+    MAX_WORKERS = 4
+    IDLE_TIMEOUT = 30.
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._workers = []
+        self._busy_workers = 0
+        self._current = threading.local()
+        self._closed = False
+
+    def add_queue(self, name, priority=PRIORITY_NORMAL, max_active=None):
+        """Create (or change) the queue "name"
+
+        If max_active is None, the queue can use all worker threads.
+        Jobs submitted to unknown queues go to a new queue with
+        normal priority.
+        """
+        with self._cond:
+            queue = self._queues.get(name)
+            if queue is None:
+                self._queues[name] = _JobQueue(name, priority, max_active)
+            else:
+                queue.priority = priority
+                queue.max_active = max_active
+
+    def submit(self, queue, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a worker thread; returns a Job"""
+        return self.submit_later(0, queue, func, *args, **kwargs)
+
+    def submit_later(self, delay, queue, func, *args, **kwargs):
+        """Like submit, but start the job after "delay" seconds
+
+        A delayed job does not occupy a worker thread while waiting.
+        """
+        job = Job(self, queue, func, args, kwargs, time.time()+delay)
+        with self._cond:
+            if self._closed:
+                log('Executor closed, not running %s', func, sender=self)
+                job.cancelled = True
+                job._finished.set()
+                return job
+
+            if queue not in self._queues:
+                self._queues[queue] = _JobQueue(queue, \
+                        self.PRIORITY_NORMAL, None)
+            self._queues[queue].jobs.append(job)
+            self._spawn_worker()
+            self._cond.notifyAll()
+        return job
+
+    def current_job(self):
+        """Returns the Job running in the calling thread (or None)"""
+        return getattr(self._current, 'job', None)
+
+    def cancel(self, queue=None):
+        """Cancel jobs of "queue" (or of all queues if None)
+
+        Waiting jobs are removed and running jobs are marked as
+        cancelled (see Job). Returns the number of removed jobs.
+        """
+        with self._cond:
+            if queue is None:
+                queues = self._queues.values()
+            elif queue in self._queues:
+                queues = [self._queues[queue]]
+            else:
+                queues = []
+
+            count = 0
+            for q in queues:
+                for job in q.jobs:
+                    job.cancelled = True
+                    if not job._started:
+                        job._finished.set()
+                        count += 1
+                q.jobs = [job for job in q.jobs if job._started]
+            return count
+
+    def close(self, timeout=None):
+        """Cancel all jobs and wait for running jobs to finish
+
+        No new jobs are accepted afterwards. Running jobs get at most
+        "timeout" seconds (all together) to finish; returns False if
+        some are still running after that.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notifyAll()
+            workers = list(self._workers)
+
+        count = self.cancel()
+        if count:
+            log('Cancelled %d waiting job(s)', count, sender=self)
+
+        if timeout is not None:
+            end_time = time.time() + timeout
+        for worker in workers:
+            if timeout is None:
+                worker.join()
+            else:
+                worker.join(max(0, end_time-time.time()))
+            if worker.isAlive():
+                log('Jobs still running after closing', sender=self)
+                return False
+        return True
+
+    def _cancel_job(self, job):
+        with self._cond:
+            job.cancelled = True
+            if job._started:
+                return False
+            queue = self._queues[job.queue]
+            if job in queue.jobs:
+                queue.jobs.remove(job)
+            job._finished.set()
+            return True
+
+    def _spawn_worker(self):
+        # Must be called with self._cond held
+        now = time.time()
+        waiting, delayed = 0, False
+        for queue in self._queues.itervalues():
+            due = len([job for job in queue.jobs if job.not_before <= now])
+            delayed = delayed or due < len(queue.jobs)
+            if queue.max_active is not None:
+                due = min(due, max(0, queue.max_active-queue.active))
+            waiting += due
+
+        # Delayed jobs only need a worker to wait for them
+        if delayed and not self._workers:
+            waiting = max(waiting, 1)
+
+        idle = len(self._workers) - self._busy_workers
+        if idle >= waiting or len(self._workers) >= self.max_workers:
+            return
+        worker = threading.Thread(target=self._worker_proc)
+        worker.setDaemon(True)
+        self._workers.append(worker)
+        worker.start()
+
+    def _next_job(self):
+        # Must be called with self._cond held; returns the next job
+        # that can be started now and the time (in seconds) until
+        # the next delayed job can be started (or None)
+        now = time.time()
+        best, best_key, wait = None, None, None
+        for queue in self._queues.itervalues():
+            if queue.max_active is not None and \
+                    queue.active >= queue.max_active:
+                continue
+            for job in queue.jobs:
+                if job._started:
+                    continue
+                if job.not_before > now:
+                    if wait is None or job.not_before-now < wait:
+                        wait = job.not_before-now
+                    continue
+                key = (-queue.priority, job.not_before)
+                if best_key is None or key < best_key:
+                    best, best_key = job, key
+                # Jobs of a queue are started in order
+                break
+        return best, wait
+
+    def _worker_proc(self):
+        worker = threading.currentThread()
+        idle_since = time.time()
+        while True:
+            with self._cond:
+                job, wait = self._next_job()
+                while job is None:
+                    remaining = self.IDLE_TIMEOUT - (time.time()-idle_since)
+                    if self._closed or (remaining <= 0 and wait is None):
+                        self._workers.remove(worker)
+                        return
+                    if remaining > 0 and (wait is None or remaining < wait):
+                        wait = remaining
+                    self._cond.wait(wait)
+                    job, wait = self._next_job()
+
+                job._started = True
+                queue = self._queues[job.queue]
+                queue.jobs.remove(job)
+                queue.active += 1
+                self._busy_workers += 1
+                # Delayed jobs might have become due in the meantime
+                self._spawn_worker()
+
+            self._current.job = job
+            try:
+                try:
+                    job.func(*job.args, **job.kwargs)
+                except Exception, e:
+                    log('Error in %s: %s', job.func, e, \
+                            sender=self, traceback=True)
+            finally:
+                self._current.job = None
+                with self._cond:
+                    queue.active -= 1
+                    self._busy_workers -= 1
+                    # Another job of this queue might be able to run now
+                    self._cond.notifyAll()
+                job._finished.set()
+                idle_since = time.time()
+
+
+# The executor for gPodder's background jobs
+executor = Executor()
+
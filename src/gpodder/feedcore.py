@@ -24,6 +24,15 @@
 
 import feedparser
 
+import urllib2
+import hashlib
+import heapq
+import zlib
+import StringIO
+import xml.parsers.expat
+
+from gpodder.liblogger import log
+
 def patch_feedparser():
     """Monkey-patch the Universal Feed Parser"""
     # Detect the 'plain' content type as 'text/plain'
@@ -94,6 +103,195 @@ class UpdatedFeed(ExceptionWithData): pass
 class NewLocation(ExceptionWithData): pass
 class NotModified(ExceptionWithData): pass
 
+# The feed content is the same as in the last update (see below)
+class ContentUnchanged(ExceptionWithData): pass
+
+
+class ContentDigestHandler(urllib2.BaseHandler):
+    """Calculate a digest of the feed content while fetching it
+
+    Many servers send neither ETag nor Last-Modified headers, so we
+    would have to parse the whole feed on every update. This handler
+    calculates a digest of the (uncompressed) response body, and
+    raises ContentUnchanged before parsing if it equals the digest
+    from the last update. The new digest is available as "digest".
+    """
+    def __init__(self, old_digest=None):
+        self.old_digest = old_digest
+        self.digest = None
+
+    def _calculate_digest(self, data, encoding):
+        if 'gzip' in encoding or 'deflate' in encoding:
+            try:
+                # Automatic header detection for gzip and zlib streams
+                data = zlib.decompress(data, 32+zlib.MAX_WBITS)
+            except zlib.error:
+                pass
+        return hashlib.sha1(data).hexdigest()
+
+    def http_response(self, request, response):
+        if response.code != 200:
+            return response
+
+        headers = response.info()
+        data = response.read()
+        response.close()
+        self.digest = self._calculate_digest(data, \
+                headers.get('content-encoding', ''))
+
+        # Redirected requests might need to report the new location
+        if self.digest == self.old_digest and \
+                not hasattr(request, 'redirect_dict'):
+            raise ContentUnchanged(headers)
+
+        result = urllib2.addinfourl(StringIO.StringIO(data), headers, \
+                response.geturl(), response.code)
+        result.msg = response.msg
+        return result
+
+    https_response = http_response
+
+
+class EntryLimitHandler(urllib2.BaseHandler):
+    """Remove all but the most recent entries before parsing a feed
+
+    Parsing feeds with thousands of entries is slow and needs lots of
+    memory, even if only the most recent entries are used. This handler
+    scans the response body with a fast (non-validating) XML parser,
+    finding the byte ranges and dates of all <item> and <entry>
+    elements, and removes all but the "max_entries" most recent ones
+    from the document. If the document can't be scanned, or if dates
+    are missing, it is passed on unchanged.
+    """
+    # After ContentDigestHandler, which needs the complete content
+    handler_order = 600
+
+    ENTRY_ELEMENTS = ('item', 'entry')
+
+    # Date elements of entries (local names), the first one found is used
+    DATE_ELEMENTS = ('updated', 'modified', 'pubDate', 'date', \
+            'published', 'issued')
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+
+    def _scan_entries(self, data):
+        """Returns a list of (start, end, date) for all entries
+
+        >>> data = '<rss><channel><title>Podcast</title>' \\
+        ...        '<item><title>A</title><pubDate>Mon, 03 Jan 2011 ' \\
+        ...        '10:00:00 GMT</pubDate></item><item><title>B</title>' \\
+        ...        '</item></channel></rss>'
+        >>> entries = EntryLimitHandler(1)._scan_entries(data)
+        >>> [data[start:end] for start, end, date in entries]
+        ['<item><title>A</title><pubDate>Mon, 03 Jan 2011 10:00:00 GMT</pubDate></item>', '<item><title>B</title></item>']
+        >>> [date and date[:3] for start, end, date in entries]
+        [(2011, 1, 3), None]
+        """
+        entries = []
+        # [start offset, {date element: text}, current date element]
+        current = []
+
+        def start_element(name, attrs):
+            name = name.split(':')[-1]
+            if not current:
+                if name in self.ENTRY_ELEMENTS:
+                    current[:] = [parser.CurrentByteIndex, {}, None]
+            elif name in self.DATE_ELEMENTS and name not in current[1]:
+                current[1][name] = ''
+                current[2] = name
+
+        def end_element(name):
+            name = name.split(':')[-1]
+            if not current:
+                return
+            elif current[2] == name:
+                current[2] = None
+            elif name in self.ENTRY_ELEMENTS:
+                end = data.index('>', parser.CurrentByteIndex) + 1
+                dates = current[1]
+                date = None
+                for date_element in self.DATE_ELEMENTS:
+                    if dates.get(date_element):
+                        date = feedparser._parse_date(dates[date_element])
+                        break
+                entries.append((current[0], end, date))
+                current[:] = []
+
+        def character_data(text):
+            if current and current[2] is not None:
+                current[1][current[2]] += text
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        parser.Parse(data, True)
+        return entries
+
+    def limit_entries(self, data):
+        """Returns "data" with only the most recent entries
+
+        >>> handler = EntryLimitHandler(2)
+        >>> handler.limit_entries('<rss><channel>' \\
+        ...     '<item><pubDate>Mon, 03 Jan 2011 10:00:00 GMT</pubDate></item>' \\
+        ...     '<item><pubDate>Wed, 05 Jan 2011 10:00:00 GMT</pubDate></item>' \\
+        ...     '<item><pubDate>Tue, 04 Jan 2011 10:00:00 GMT</pubDate></item>' \\
+        ...     '</channel></rss>')
+        '<rss><channel><item><pubDate>Wed, 05 Jan 2011 10:00:00 GMT</pubDate></item><item><pubDate>Tue, 04 Jan 2011 10:00:00 GMT</pubDate></item></channel></rss>'
+        >>> handler.limit_entries('<feed xmlns="http://www.w3.org/2005/Atom">' \\
+        ...     '<entry><id>1</id><updated>2011-01-01T00:00:00Z</updated></entry>' \\
+        ...     '<entry><id>2</id><updated>2011-01-03T00:00:00Z</updated></entry>' \\
+        ...     '<entry><id>3</id><updated>2011-01-02T00:00:00Z</updated></entry>' \\
+        ...     '</feed>')
+        '<feed xmlns="http://www.w3.org/2005/Atom"><entry><id>2</id><updated>2011-01-03T00:00:00Z</updated></entry><entry><id>3</id><updated>2011-01-02T00:00:00Z</updated></entry></feed>'
+
+        Documents with entries without a date are not changed:
+
+        >>> handler.limit_entries('<rss><item/><item/><item/></rss>')
+        '<rss><item/><item/><item/></rss>'
+        """
+        if data[:2] in ('\xff\xfe', '\xfe\xff') or '\x00' in data[:4]:
+            # UTF-16 (and other wide encodings) can't be cut at '>'
+            return data
+
+        try:
+            entries = self._scan_entries(data)
+        except Exception, e:
+            log('Cannot scan entries: %s', e, sender=self, traceback=True)
+            return data
+
+        if len(entries) <= self.max_entries or \
+                [date for start, end, date in entries if date is None]:
+            return data
+
+        keep = set(heapq.nlargest(self.max_entries, entries, \
+                key=lambda entry: entry[2]))
+        parts = []
+        position = 0
+        for entry in entries:
+            if entry not in keep:
+                start, end, date = entry
+                parts.append(data[position:start])
+                position = end
+        parts.append(data[position:])
+        return ''.join(parts)
+
+    def http_response(self, request, response):
+        headers = response.info()
+        if response.code != 200 or headers.get('content-encoding'):
+            return response
+
+        data = response.read()
+        response.close()
+        result = urllib2.addinfourl(StringIO.StringIO( \
+                self.limit_entries(data)), headers, response.geturl(), \
+                response.code)
+        result.msg = response.msg
+        return result
+
+    https_response = http_response
 
 
 class Fetcher(object):
@@ -210,7 +408,8 @@ class Fetcher(object):
         else:
             raise UnknownStatusCode(status)
 
-    def _parse_feed(self, url, etag, modified, autodiscovery=True):
+    def _parse_feed(self, url, etag, modified, autodiscovery=True, \
+            digest=None, max_entries=0):
         """Parse the feed and raise the result."""
         if url.startswith('file://'):
             is_local = True
@@ -218,11 +417,23 @@ class Fetcher(object):
         else:
             is_local = False
 
+        digest_handler = ContentDigestHandler(digest)
+        handlers = self._get_handlers() + [digest_handler]
+        if max_entries > 0:
+            handlers.append(EntryLimitHandler(max_entries))
         feed = feedparser.parse(url,
                 agent=self.user_agent,
                 modified=modified,
                 etag=etag,
-                handlers=self._get_handlers())
+                handlers=handlers)
+
+        unchanged = feed.get('bozo_exception', None)
+        if isinstance(unchanged, ContentUnchanged):
+            feed['headers'] = dict(unchanged.data)
+            feed['status'] = 304
+            raise NotModified(feed)
+
+        feed['content_digest'] = digest_handler.digest
 
         if is_local:
             if feed.version:
@@ -240,13 +451,22 @@ class Fetcher(object):
             self._check_valid_feed(feed)
             self._check_statuscode(feed)
 
-    def fetch(self, url, etag=None, modified=None):
+    def fetch(self, url, etag=None, modified=None, digest=None, \
+            max_entries=0):
         """Download a feed, with optional etag an modified values
 
+        If "digest" is the content digest of the last update (as
+        found in the "content_digest" key of a parsed feed), the
+        feed is not parsed if its content has not changed.
+
+        If "max_entries" is set, only the "max_entries" most recent
+        entries of the feed are parsed (see EntryLimitHandler).
+
         This method will always raise an exception that tells
         the calling code the result of the fetch operation. See
         the code for the feedcore module for all the possible
         exception types.
         """
-        self._parse_feed(url, etag, modified)
+        self._parse_feed(url, etag, modified, digest=digest, \
+                max_entries=max_entries)
 
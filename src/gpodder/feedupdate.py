@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+# gPodder - A media aggregator and podcast client
+# Copyright (c) 2005-2011 Thomas Perl and the gPodder Team
+#
+# gPodder is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# gPodder is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+#
+#  feedupdate.py -- Parallel feed updates with a pool of worker threads
+#
+
+from __future__ import with_statement
+
+from gpodder.liblogger import log
+
+import threading
+import urlparse
+import Queue
+
+
+class FeedUpdater(object):
+    """Update a list of podcasts in a two-stage pipeline
+
+    Feeds are downloaded and parsed by a pool of worker threads. The
+    parsed results are put into a bounded queue, from which a single
+    writer (the thread calling update()) consumes them and writes to
+    the database, committing in batches. This way, the network can be
+    used in parallel while only one thread writes to the database.
+
+    The number of worker threads is limited by the "max_feed_updates"
+    setting, and at most "max_feed_updates_per_host" feeds from the same
+    server are fetched at the same time, so a single slow server can't
+    occupy all workers. The pool starts with all workers; each failed
+    fetch (e.g. a timeout) retires a worker, and each successful fetch
+    lets the pool grow again, so a flaky connection is not flooded
+    with parallel requests.
+
+    Usage:
+
+        updater = FeedUpdater(config)
+        updater.update(channels, fetch, consume, on_updated, commit)
+
+    update() blocks until all channels have been updated or until
+    cancel() has been called from another thread. "fetch" is called
+    with a channel in a worker thread and returns a result, which is
+    passed to "consume" (with the channel) in the writer thread. After
+    that, "on_updated" is called with the channel and the exception
+    raised by "fetch" or "consume" (or None if the update succeeded).
+    "commit" is called after each batch of consumed results.
+    """
+    # Maximum number of fetched feeds waiting for the writer
+    QUEUE_SIZE = 16
+
+    # Maximum number of consumed feeds per database commit
+    COMMIT_BATCH = 20
+
+    def __init__(self, config):
+        self._config = config
+        self._cond = threading.Condition()
+        self._pending = []
+        self._active_hosts = {}
+        self._workers = 0
+        self._target_workers = 1
+        self._max_workers = 1
+        self._max_per_host = 1
+        self._cancelled = False
+        self._fetch = None
+        self._results = None
+
+    def _get_host(self, channel):
+        return urlparse.urlparse(channel.url)[1]
+
+    def _spawn_worker(self):
+        # Must be called with self._cond held
+        self._workers += 1
+        worker = threading.Thread(target=self._worker_proc)
+        worker.setDaemon(True)
+        worker.start()
+
+    def _next_channel(self):
+        # Must be called with self._cond held; returns None if the
+        # calling worker thread should exit
+        while True:
+            if self._cancelled or not self._pending:
+                return None
+
+            if self._workers > self._target_workers:
+                log('Updates are failing, retiring a worker', sender=self)
+                return None
+
+            for index, channel in enumerate(self._pending):
+                host = self._get_host(channel)
+                if self._active_hosts.get(host, 0) < self._max_per_host:
+                    del self._pending[index]
+                    self._active_hosts[host] = self._active_hosts.get(host, 0) + 1
+                    return channel
+
+            # All pending feeds are on busy hosts - wait for a free slot
+            self._cond.wait()
+
+    def _channel_finished(self, channel, failed):
+        # Must be called with self._cond held
+        host = self._get_host(channel)
+        self._active_hosts[host] -= 1
+
+        if failed:
+            self._target_workers = max(1, self._target_workers-1)
+        else:
+            self._target_workers = min(self._max_workers, \
+                    self._target_workers+1)
+
+        if self._workers < self._target_workers and \
+                len(self._pending) > self._workers and \
+                not self._cancelled:
+            self._spawn_worker()
+
+        self._cond.notifyAll()
+
+    def _worker_proc(self):
+        while True:
+            with self._cond:
+                channel = self._next_channel()
+                if channel is None:
+                    self._workers -= 1
+                    last_worker = (self._workers == 0)
+                    self._cond.notifyAll()
+                    break
+
+            result, error = None, None
+            try:
+                result = self._fetch(channel)
+            except Exception, e:
+                error = e
+
+            with self._cond:
+                self._channel_finished(channel, error is not None)
+
+            # Blocks if the writer is behind (bounded queue)
+            self._results.put((channel, result, error))
+
+        if last_worker:
+            # Tell the writer that no more results will come
+            self._results.put(None)
+
+    def update(self, channels, fetch, consume, on_updated=lambda c, e: None, \
+            commit=lambda: None, max_workers=None):
+        """Update "channels" in parallel and wait until it's done
+
+        If "max_workers" is set, it is used instead of the
+        "max_feed_updates" setting. Returns True if all channels
+        have been updated or False if the update has been
+        cancelled using cancel().
+        """
+        if max_workers is None:
+            max_workers = self._config.max_feed_updates
+
+        with self._cond:
+            self._pending = list(channels)
+            self._active_hosts = {}
+            self._cancelled = False
+            self._fetch = fetch
+            self._results = Queue.Queue(self.QUEUE_SIZE)
+
+            self._max_workers = max(1, max_workers)
+            self._max_per_host = max(1, self._config.max_feed_updates_per_host)
+            self._target_workers = self._max_workers
+
+            if not self._pending:
+                return True
+
+            for i in range(min(self._max_workers, len(self._pending))):
+                self._spawn_worker()
+
+        uncommitted = 0
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+
+            channel, result, error = item
+            if self._cancelled:
+                continue
+
+            if error is None:
+                try:
+                    consume(channel, result)
+                except Exception, e:
+                    error = e
+                uncommitted += 1
+
+            try:
+                on_updated(channel, error)
+            except Exception, e:
+                log('Error in update callback: %s', e, sender=self, traceback=True)
+
+            if uncommitted >= self.COMMIT_BATCH or \
+                    (uncommitted and self._results.empty()):
+                commit()
+                uncommitted = 0
+
+        if uncommitted:
+            commit()
+
+        return not self._cancelled
+
+    def cancel(self):
+        """Cancel the current update
+
+        Feeds that are currently being fetched will be finished, but
+        their results are discarded and no new feed updates will be
+        started.
+        """
+        with self._cond:
+            self._cancelled = True
+            self._pending = []
+            self._cond.notifyAll()
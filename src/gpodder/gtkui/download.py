@@ -23,14 +23,18 @@
 #  Based on code from gpodder.services (thp, 2007-08-24)
 #
 
+from __future__ import with_statement
+
 import gpodder
 
 from gpodder import util
 from gpodder import download
 
 import gtk
+import gobject
 
 import collections
+import threading
 
 _ = gpodder.gettext
 
@@ -41,9 +45,30 @@ class DownloadStatusModel(gtk.ListStore):
 
     SEARCH_COLUMNS = (C_NAME, C_URL)
 
+    # Changes of tasks are collected for this long (in milliseconds)
+    # before the rows are updated and the changed callback is called
+    UPDATE_INTERVAL = 500
+
     def __init__(self):
         gtk.ListStore.__init__(self, object, str, str, int, str, str)
 
+        # Rows of all tasks and the tasks that have changed since the
+        # last update (tasks notify us from their download threads)
+        self._iters = {}
+        self._changed_tasks = set()
+        self._changed_lock = threading.Lock()
+        self._update_scheduled = False
+        self._on_tasks_changed = lambda tasks: None
+
+        # Statistics for all tasks, updated with the rows: The status
+        # and contribution to total_speed, total_size and done_size of
+        # each task, so they can be updated without going over all rows
+        self._task_statistics = {}
+        self._status_counts = collections.defaultdict(int)
+        self._total_speed = 0.
+        self._total_size = 0.
+        self._done_size = 0.
+
         # Set up stock icon IDs for tasks
         self._status_ids = collections.defaultdict(lambda: None)
         self._status_ids[download.DownloadTask.DOWNLOADING] = gtk.STOCK_GO_DOWN
@@ -112,11 +137,103 @@ class DownloadStatusModel(gtk.ListStore):
 
     def __add_new_task(self, task):
         iter = self.append()
+        self._iters[task] = iter
         self.request_update(iter, task)
+        task.add_changed_callback(self._task_changed)
+        self._task_changed(task)
 
     def register_task(self, task):
         util.idle_add(self.__add_new_task, task)
 
+    def remove(self, iter):
+        task = self.get_value(iter, self.C_TASK)
+        if task is not None and self._iters.pop(task, None) is not None:
+            task.add_changed_callback(lambda task: None)
+            self._update_statistics(task, removed=True)
+        return gtk.ListStore.remove(self, iter)
+
+    def set_changed_callback(self, callback):
+        """Set a function to be called when tasks have changed
+
+        The callback is called in the GUI thread with the set of
+        tasks that have changed (or have been added), after their
+        rows have been updated.
+        """
+        self._on_tasks_changed = callback
+
+    def _task_changed(self, task):
+        # Called by the task from any thread - schedule an update
+        with self._changed_lock:
+            self._changed_tasks.add(task)
+            if self._update_scheduled:
+                return
+            self._update_scheduled = True
+        gobject.timeout_add(self.UPDATE_INTERVAL, self._on_update_timeout)
+
+    def _on_update_timeout(self):
+        self.update_changed_tasks()
+        return False
+
+    def update_changed_tasks(self, notify=True):
+        """Update the rows of all tasks that have changed
+
+        This is done automatically after changes. If "notify" is
+        False, the changed callback is not called for the tasks.
+        """
+        with self._changed_lock:
+            tasks = self._changed_tasks
+            self._changed_tasks = set()
+            self._update_scheduled = False
+
+        tasks = set(task for task in tasks if task in self._iters)
+        for task in tasks:
+            self.request_update(self._iters[task])
+            self._update_statistics(task)
+
+        if tasks and notify:
+            self._on_tasks_changed(tasks)
+
+    def _update_statistics(self, task, removed=False):
+        old = self._task_statistics.pop(task, None)
+        if old is not None:
+            status, speed, size, done = old
+            self._status_counts[status] -= 1
+            self._total_speed -= speed
+            self._total_size -= size
+            self._done_size -= done
+
+        if removed:
+            return
+
+        status, size = task.status, task.total_size
+        if status == task.DOWNLOADING:
+            speed = task.speed
+        else:
+            speed = 0.
+        done = size*task.progress
+        self._task_statistics[task] = (status, speed, size, done)
+        self._status_counts[status] += 1
+        self._total_speed += speed
+        self._total_size += size
+        self._done_size += done
+
+    def get_tasks(self):
+        """Returns a list of all tasks in this model"""
+        return self._iters.keys()
+
+    def get_status_count(self, status):
+        """Returns the number of tasks with the given status
+
+        This (and get_transfer_statistics) reflects the state of
+        the tasks when their rows have been updated last.
+        """
+        return self._status_counts[status]
+
+    def get_transfer_statistics(self):
+        """Returns (total_speed, total_size, done_size) of all tasks"""
+        return (self._total_speed, max(0., self._total_size), \
+                max(0., self._done_size))
+
     def tell_all_tasks_to_quit(self):
         for row in self:
             task = row[DownloadStatusModel.C_TASK]
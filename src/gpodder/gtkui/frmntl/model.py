@@ -93,6 +93,10 @@ class EpisodeListModel(gtk.GenericTreeModel):
             return None
 
         episode = self._episodes[rowref]
+        if episode is None:
+            # Deleted after the list has been loaded (see PagedEpisodeList)
+            return None
+
         downloading = self._downloading
 
         if column == self.C_URL:
@@ -300,6 +304,9 @@ class EpisodeListModel(gtk.GenericTreeModel):
         applied, return True (otherwise return False).
         """
 
+        if hasattr(self._episodes, 'exists'):
+            return self._paged_has_episodes()
+
         # XXX: This must be kept in sync with the behaviour of _filter_visible_func
         if self._search_term is not None:
             key = self._search_term.lower()
@@ -324,6 +331,28 @@ class EpisodeListModel(gtk.GenericTreeModel):
 
         return any(is_visible(episode) for episode in self._episodes)
 
+    def _paged_has_episodes(self):
+        # Like has_episodes, but asks the database instead of loading
+        # all pages of the PagedEpisodeList
+        if any(self._downloading(episode) for index, episode in \
+                self._episodes.get_loaded()):
+            return True
+
+        if self._search_term is not None:
+            condition, args = self._episodes.get_db().search_condition(\
+                    self._search_term)
+            return self._episodes.exists((condition,), args)
+
+        return self._episodes.exists(model.PagedEpisodeListModel.VIEW_CONDITIONS.get(\
+                self._view_mode, ()))
+
+    def _get_loaded_episodes(self):
+        # Returns (index, episode) pairs for the episodes in this model;
+        # for a PagedEpisodeList, only the episodes that are loaded
+        if hasattr(self._episodes, 'get_loaded'):
+            return list(self._episodes.get_loaded())
+        return list(enumerate(self._episodes))
+
     def get_filtered_model(self):
         """Returns a filtered version of this episode model
 
@@ -385,9 +414,9 @@ class EpisodeListModel(gtk.GenericTreeModel):
 
     def clear(self):
         count = len(self._episodes)
+        self._episodes = []
         for i in reversed(range(count)):
             self.emit('row-deleted', (i,))
-            self._episodes.pop()
 
     def replace_from_channel(self, channel, downloading=None, \
             include_description=False, generate_thumbnails=False):
@@ -432,8 +461,8 @@ class EpisodeListModel(gtk.GenericTreeModel):
         self._include_description = include_description
         self._generate_thumbnails = generate_thumbnails
 
-        for i in range(len(self._episodes)):
-            self.emit('row-changed', (i,), self.create_tree_iter(i))
+        for index, episode in self._get_loaded_episodes():
+            self.emit('row-changed', (index,), self.create_tree_iter(index))
 
     def update_by_urls(self, urls, downloading=None, include_description=False, \
             generate_thumbnails=False):
@@ -442,7 +471,8 @@ class EpisodeListModel(gtk.GenericTreeModel):
         self._include_description = include_description
         self._generate_thumbnails = generate_thumbnails
 
-        for index, episode in enumerate(self._episodes):
+        # Episodes that are not loaded will be up to date when loaded
+        for index, episode in self._get_loaded_episodes():
             if episode.url in urls:
                 episode.reload_from_db()
                 self.emit('row-changed', (index,), self.create_tree_iter(index))
@@ -463,7 +493,7 @@ class EpisodeListModel(gtk.GenericTreeModel):
 
         index = self.get_user_data(iter)
         episode = self._episodes[index]
-        if reload_from_db:
+        if episode is not None and reload_from_db:
             episode.reload_from_db()
 
         self.emit('row-changed', (index,), self.create_tree_iter(index))
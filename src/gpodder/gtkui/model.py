@@ -42,7 +42,9 @@ try:
 except ImportError:
     have_gio = False
 
-class EpisodeListModel(gtk.ListStore):
+
+class EpisodeListMixin(object):
+    """Columns and row formatting shared by the episode list models"""
     C_URL, C_TITLE, C_FILESIZE_TEXT, C_EPISODE, C_STATUS_ICON, \
             C_PUBLISHED_TEXT, C_DESCRIPTION, C_TOOLTIP, \
             C_VIEW_SHOW_UNDELETED, C_VIEW_SHOW_DOWNLOADED, \
@@ -57,25 +59,7 @@ class EpisodeListModel(gtk.ListStore):
     # In which steps the UI is updated for "loading" animations
     _UI_UPDATE_STEP = .03
 
-    def __init__(self, on_filter_changed=lambda has_episodes: None):
-        gtk.ListStore.__init__(self, str, str, str, object, \
-                str, str, str, str, bool, bool, bool, \
-                int, int, str, bool, bool, bool)
-
-        # Callback for when the filter / list changes, gets one parameter
-        # (has_episodes) that is True if the list has any episodes
-        self._on_filter_changed = on_filter_changed
-
-        # Filter to allow hiding some episodes
-        self._filter = self.filter_new()
-        self._sorter = gtk.TreeModelSort(self._filter)
-        self._view_mode = self.VIEW_ALL
-        self._search_term = None
-        self._filter.set_visible_func(self._filter_visible_func)
-
-        # Are we currently showing the "all episodes" view?
-        self._all_episodes_view = False
-
+    def _init_icons(self):
         # "ICON" is used to mark icon names in source files
         ICON = lambda x: x
 
@@ -100,18 +84,176 @@ class EpisodeListModel(gtk.ListStore):
             self.ICON_LOCKED = ICON('emblem-locked')
             self.ICON_MISSING = ICON('vcs-conflicting')
 
-
     def _format_filesize(self, episode):
         if episode.length > 0:
             return util.format_filesize(episode.length, 1)
         else:
             return None
 
+    def _format_description(self, episode, include_description=False, is_downloading=None):
+        a, b = '', ''
+        if episode.state != gpodder.STATE_DELETED and not episode.is_played:
+            a, b = '<b>', '</b>'
+        if include_description and self._all_episodes_view:
+            return '%s%s%s\n<small>%s</small>' % (a, xml.sax.saxutils.escape(episode.title), b,
+                    _('from %s') % xml.sax.saxutils.escape(episode.channel.title))
+        elif include_description:
+            return '%s%s%s\n<small>%s</small>' % (a, xml.sax.saxutils.escape(episode.title), b,
+                    xml.sax.saxutils.escape(episode.one_line_description()))
+        else:
+            return ''.join((a, xml.sax.saxutils.escape(episode.title), b))
+
+    def _get_row_values(self, episode, downloading=None, \
+            include_description=False, generate_thumbnails=False):
+        """Returns the status columns of an episode row
+
+        The result is a flat sequence of alternating columns and
+        values that can be passed to gtk.ListStore.set().
+        """
+        show_bullet = False
+        show_padlock = False
+        show_missing = False
+        status_icon = None
+        tooltip = []
+        view_show_undeleted = True
+        view_show_downloaded = False
+        view_show_unplayed = False
+        icon_theme = gtk.icon_theme_get_default()
+
+        if downloading is not None and downloading(episode):
+            tooltip.append(_('Downloading'))
+            status_icon = self.ICON_DOWNLOADING
+            view_show_downloaded = True
+            view_show_unplayed = True
+        else:
+            if episode.state == gpodder.STATE_DELETED:
+                tooltip.append(_('Deleted'))
+                status_icon = self.ICON_DELETED
+                view_show_undeleted = False
+            elif episode.state == gpodder.STATE_NORMAL and \
+                    not episode.is_played:
+                tooltip.append(_('New episode'))
+                status_icon = self.ICON_NEW
+                view_show_downloaded = True
+                view_show_unplayed = True
+            elif episode.state == gpodder.STATE_DOWNLOADED:
+                tooltip = []
+                view_show_downloaded = True
+                view_show_unplayed = not episode.is_played
+                show_bullet = not episode.is_played
+                show_padlock = episode.is_locked
+                show_missing = not episode.file_exists()
+                filename = episode.local_filename(create=False, check_only=True)
+
+                file_type = episode.file_type()
+                if file_type == 'audio':
+                    tooltip.append(_('Downloaded episode'))
+                    status_icon = self.ICON_AUDIO_FILE
+                elif file_type == 'video':
+                    tooltip.append(_('Downloaded video episode'))
+                    status_icon = self.ICON_VIDEO_FILE
+                elif file_type == 'image':
+                    tooltip.append(_('Downloaded image'))
+                    status_icon = self.ICON_IMAGE_FILE
+
+                    # Optional thumbnailing for image downloads
+                    if generate_thumbnails:
+                        if filename is not None:
+                            # set the status icon to the path itself (that
+                            # should be a good identifier anyway)
+                            status_icon = filename
+                else:
+                    tooltip.append(_('Downloaded file'))
+                    status_icon = self.ICON_GENERIC_FILE
+
+                # Try to find a themed icon for this file
+                if filename is not None and have_gio:
+                    file = gio.File(filename)
+                    if file.query_exists():
+                        file_info = file.query_info('*')
+                        icon = file_info.get_icon()
+                        for icon_name in icon.get_names():
+                            if icon_theme.has_icon(icon_name):
+                                status_icon = icon_name
+                                break
+
+                if show_missing:
+                    tooltip.append(_('missing file'))
+                else:
+                    if show_bullet:
+                        if file_type == 'image':
+                            tooltip.append(_('never displayed'))
+                        elif file_type in ('audio', 'video'):
+                            tooltip.append(_('never played'))
+                        else:
+                            tooltip.append(_('never opened'))
+                    else:
+                        if file_type == 'image':
+                            tooltip.append(_('displayed'))
+                        elif file_type in ('audio', 'video'):
+                            tooltip.append(_('played'))
+                        else:
+                            tooltip.append(_('opened'))
+                    if show_padlock:
+                        tooltip.append(_('deletion prevented'))
+
+                if episode.total_time > 0 and episode.current_position:
+                    tooltip.append('%d%%' % (100.*float(episode.current_position)/float(episode.total_time),))
+
+        if episode.total_time:
+            total_time = util.format_time(episode.total_time)
+            if total_time:
+                tooltip.append(total_time)
+
+        tooltip = ', '.join(tooltip)
+
+        description = self._format_description(episode, include_description, downloading)
+        return (self.C_STATUS_ICON, status_icon, \
+                self.C_VIEW_SHOW_UNDELETED, view_show_undeleted, \
+                self.C_VIEW_SHOW_DOWNLOADED, view_show_downloaded, \
+                self.C_VIEW_SHOW_UNPLAYED, view_show_unplayed, \
+                self.C_DESCRIPTION, description, \
+                self.C_TOOLTIP, tooltip, \
+                self.C_TIME, episode.get_play_info_string(), \
+                self.C_TIME_VISIBLE, episode.total_time, \
+                self.C_LOCKED, episode.is_locked)
+
+
+class EpisodeListModel(gtk.ListStore, EpisodeListMixin):
+    def __init__(self, on_filter_changed=lambda has_episodes: None):
+        gtk.ListStore.__init__(self, str, str, str, object, \
+                str, str, str, str, bool, bool, bool, \
+                int, int, str, bool, bool, bool)
+
+        # Callback for when the filter / list changes, gets one parameter
+        # (has_episodes) that is True if the list has any episodes
+        self._on_filter_changed = on_filter_changed
+
+        # Filter to allow hiding some episodes
+        self._filter = self.filter_new()
+        self._sorter = gtk.TreeModelSort(self._filter)
+        self._view_mode = self.VIEW_ALL
+        self._search_term = None
+        self._filter.set_visible_func(self._filter_visible_func)
+
+        # The current podcast and IDs of its episodes that match the
+        # search term in the full-text index (None if not searching)
+        self._channel = None
+        self._search_ids = None
+
+        # Are we currently showing the "all episodes" view?
+        self._all_episodes_view = False
+
+        self._init_icons()
 
     def _filter_visible_func(self, model, iter):
         # If searching is active, set visibility based on search text
         if self._search_term is not None:
             key = self._search_term.lower()
+            if self._search_ids is not None:
+                episode = model.get_value(iter, self.C_EPISODE)
+                if episode is not None and episode.id in self._search_ids:
+                    return True
             return any((key in (model.get_value(iter, column) or '').lower()) for column in self.SEARCH_COLUMNS)
 
         if self._view_mode == self.VIEW_ALL:
@@ -156,28 +298,26 @@ class EpisodeListModel(gtk.ListStore):
         """Returns the currently-set view mode"""
         return self._view_mode
 
+    def _search_episodes(self):
+        # Full-text search in the descriptions, which are not in the model
+        db = getattr(self._channel, 'db', None)
+        if self._search_term is None or db is None:
+            return None
+
+        condition, args = db.search_condition(self._search_term)
+        return set(db.load_episode_ids((condition, 'channel_id = ?'), \
+                args + (self._channel.id,)))
+
     def set_search_term(self, new_term):
         if self._search_term != new_term:
             self._search_term = new_term
+            self._search_ids = self._search_episodes()
             self._filter.refilter()
             self._on_filter_changed(self.has_episodes())
 
     def get_search_term(self):
         return self._search_term
 
-    def _format_description(self, episode, include_description=False, is_downloading=None):
-        a, b = '', ''
-        if episode.state != gpodder.STATE_DELETED and not episode.is_played:
-            a, b = '<b>', '</b>'
-        if include_description and self._all_episodes_view:
-            return '%s%s%s\n<small>%s</small>' % (a, xml.sax.saxutils.escape(episode.title), b,
-                    _('from %s') % xml.sax.saxutils.escape(episode.channel.title))
-        elif include_description:
-            return '%s%s%s\n<small>%s</small>' % (a, xml.sax.saxutils.escape(episode.title), b,
-                    xml.sax.saxutils.escape(episode.one_line_description()))
-        else:
-            return ''.join((a, xml.sax.saxutils.escape(episode.title), b))
-
     def replace_from_channel(self, channel, downloading=None, \
             include_description=False, generate_thumbnails=False, \
             treeview=None):
@@ -195,6 +335,8 @@ class EpisodeListModel(gtk.ListStore):
             util.idle_add(treeview.queue_draw)
 
         self._all_episodes_view = getattr(channel, 'ALL_EPISODES_PROXY', False)
+        self._channel = channel
+        self._search_ids = self._search_episodes()
 
         # Avoid gPodder bug 1291
         if channel is None:
@@ -261,121 +403,8 @@ class EpisodeListModel(gtk.ListStore):
         if reload_from_db:
             episode.reload_from_db()
 
-        if include_description or gpodder.ui.maemo:
-            icon_size = 32
-        else:
-            icon_size = 16
-
-        show_bullet = False
-        show_padlock = False
-        show_missing = False
-        status_icon = None
-        status_icon_to_build_from_file = False
-        tooltip = []
-        view_show_undeleted = True
-        view_show_downloaded = False
-        view_show_unplayed = False
-        icon_theme = gtk.icon_theme_get_default()
-
-        if downloading is not None and downloading(episode):
-            tooltip.append(_('Downloading'))
-            status_icon = self.ICON_DOWNLOADING
-            view_show_downloaded = True
-            view_show_unplayed = True
-        else:
-            if episode.state == gpodder.STATE_DELETED:
-                tooltip.append(_('Deleted'))
-                status_icon = self.ICON_DELETED
-                view_show_undeleted = False
-            elif episode.state == gpodder.STATE_NORMAL and \
-                    not episode.is_played:
-                tooltip.append(_('New episode'))
-                status_icon = self.ICON_NEW
-                view_show_downloaded = True
-                view_show_unplayed = True
-            elif episode.state == gpodder.STATE_DOWNLOADED:
-                tooltip = []
-                view_show_downloaded = True
-                view_show_unplayed = not episode.is_played
-                show_bullet = not episode.is_played
-                show_padlock = episode.is_locked
-                show_missing = not episode.file_exists()
-                filename = episode.local_filename(create=False, check_only=True)
-
-                file_type = episode.file_type()
-                if file_type == 'audio':
-                    tooltip.append(_('Downloaded episode'))
-                    status_icon = self.ICON_AUDIO_FILE
-                elif file_type == 'video':
-                    tooltip.append(_('Downloaded video episode'))
-                    status_icon = self.ICON_VIDEO_FILE
-                elif file_type == 'image':
-                    tooltip.append(_('Downloaded image'))
-                    status_icon = self.ICON_IMAGE_FILE
-
-                    # Optional thumbnailing for image downloads
-                    if generate_thumbnails:
-                        if filename is not None:
-                            # set the status icon to the path itself (that
-                            # should be a good identifier anyway)
-                            status_icon = filename
-                            status_icon_to_build_from_file = True
-                else:
-                    tooltip.append(_('Downloaded file'))
-                    status_icon = self.ICON_GENERIC_FILE
-
-                # Try to find a themed icon for this file
-                if filename is not None and have_gio:
-                    file = gio.File(filename)
-                    if file.query_exists():
-                        file_info = file.query_info('*')
-                        icon = file_info.get_icon()
-                        for icon_name in icon.get_names():
-                            if icon_theme.has_icon(icon_name):
-                                status_icon = icon_name
-                                break
-
-                if show_missing:
-                    tooltip.append(_('missing file'))
-                else:
-                    if show_bullet:
-                        if file_type == 'image':
-                            tooltip.append(_('never displayed'))
-                        elif file_type in ('audio', 'video'):
-                            tooltip.append(_('never played'))
-                        else:
-                            tooltip.append(_('never opened'))
-                    else:
-                        if file_type == 'image':
-                            tooltip.append(_('displayed'))
-                        elif file_type in ('audio', 'video'):
-                            tooltip.append(_('played'))
-                        else:
-                            tooltip.append(_('opened'))
-                    if show_padlock:
-                        tooltip.append(_('deletion prevented'))
-
-                if episode.total_time > 0 and episode.current_position:
-                    tooltip.append('%d%%' % (100.*float(episode.current_position)/float(episode.total_time),))
-
-        if episode.total_time:
-            total_time = util.format_time(episode.total_time)
-            if total_time:
-                tooltip.append(total_time)
-
-        tooltip = ', '.join(tooltip)
-
-        description = self._format_description(episode, include_description, downloading)
-        self.set(iter, \
-                self.C_STATUS_ICON, status_icon, \
-                self.C_VIEW_SHOW_UNDELETED, view_show_undeleted, \
-                self.C_VIEW_SHOW_DOWNLOADED, view_show_downloaded, \
-                self.C_VIEW_SHOW_UNPLAYED, view_show_unplayed, \
-                self.C_DESCRIPTION, description, \
-                self.C_TOOLTIP, tooltip, \
-                self.C_TIME, episode.get_play_info_string(), \
-                self.C_TIME_VISIBLE, episode.total_time, \
-                self.C_LOCKED, episode.is_locked)
+        self.set(iter, *self._get_row_values(episode, downloading, \
+                include_description, generate_thumbnails))
 
     def _get_icon_from_image(self,image_path, icon_size):
         """
@@ -488,6 +517,384 @@ class EpisodeListModel(gtk.ListStore):
         return icon
 
 
+class PagedEpisodeList(object):
+    """A read-only list of episodes that are loaded on demand
+
+    Only the IDs of the episodes are loaded when the list is created.
+    The episodes themselves are loaded from the database in pages of
+    PAGE_SIZE episodes when they are accessed, and at most MAX_PAGES
+    pages are kept in memory (the least recently used page is dropped).
+    """
+    PAGE_SIZE = 100
+    MAX_PAGES = 20
+
+    def __init__(self, db, channels, conditions=(), args=()):
+        self._db = db
+        self._channels = dict((c.id, c) for c in channels)
+        self._conditions = tuple(conditions)
+        self._args = tuple(args)
+        self._ids = db.load_episode_ids(self._conditions, self._args)
+        self._pages = {}
+        self._page_order = []
+
+    def filter(self, conditions, args=()):
+        """Returns a new list with additional SQL conditions"""
+        return PagedEpisodeList(self._db, self._channels.values(), \
+                self._conditions + tuple(conditions), self._args + tuple(args))
+
+    def search(self, query, channel_ids=()):
+        """Returns a new list with the episodes matching "query"
+
+        All episodes of the podcasts in "channel_ids" are included, too.
+        """
+        condition, args = self._db.search_condition(query)
+        if channel_ids:
+            condition = '(%s) OR channel_id IN (%s)' % (condition, \
+                    ', '.join(str(int(id)) for id in channel_ids))
+        return self.filter((condition,), args)
+
+    def get_channels(self):
+        return self._channels.values()
+
+    def get_db(self):
+        return self._db
+
+    def exists(self, conditions=(), args=()):
+        """Returns True if an episode matches additional SQL conditions
+
+        Unlike filter(), this only looks up a single episode ID.
+        """
+        return bool(self._db.load_episode_ids(self._conditions + \
+                tuple(conditions), self._args + tuple(args), 1))
+
+    def invalidate(self):
+        """Drop all loaded episodes, so they are loaded again"""
+        self._pages = {}
+        self._page_order = []
+
+    def get_loaded(self):
+        """Returns (index, episode) pairs for all loaded episodes"""
+        for number, page in self._pages.items():
+            for offset, episode in enumerate(page):
+                if episode is not None:
+                    yield number*self.PAGE_SIZE + offset, episode
+
+    def _get_page(self, number):
+        if number in self._pages:
+            self._page_order.remove(number)
+        else:
+            start = number*self.PAGE_SIZE
+            ids = self._ids[start:start+self.PAGE_SIZE]
+            episodes = self._db.load_episodes_by_ids(self._channels, ids)
+            self._pages[number] = [episodes.get(id, None) for id in ids]
+            if len(self._page_order) >= self.MAX_PAGES:
+                del self._pages[self._page_order.pop(0)]
+        self._page_order.append(number)
+        return self._pages[number]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        """Returns the episode at "index" (None if it has been deleted)"""
+        if index < 0:
+            index += len(self._ids)
+        if index < 0 or index >= len(self._ids):
+            raise IndexError(index)
+        page = self._get_page(index / self.PAGE_SIZE)
+        return page[index % self.PAGE_SIZE]
+
+    def __iter__(self):
+        for index in xrange(len(self._ids)):
+            episode = self[index]
+            if episode is not None:
+                yield episode
+
+
+class PagedEpisodeListModel(gtk.GenericTreeModel, EpisodeListMixin):
+    """Episode list model for the "All episodes" and "New episodes" views
+
+    Instead of adding a row for every episode up front (which takes a
+    long time for many thousands of episodes), the rows of this model
+    are created from a PagedEpisodeList when the view asks for them.
+    The view mode and search term are applied in the database.
+
+    This model has the same interface as EpisodeListModel. Rows are
+    not sortable, they are always sorted by release date.
+    """
+    DATA_TYPES = (str, str, str, object, str, str, str, str, bool, \
+            bool, bool, int, int, str, bool, bool, bool)
+
+    # Maximum number of formatted rows to keep in memory
+    MAX_CACHED_ROWS = 1000
+
+    # SQL conditions for the view modes (see EpisodeListMixin)
+    VIEW_CONDITIONS = {
+            EpisodeListMixin.VIEW_UNDELETED: ('state <> %d' % \
+                    gpodder.STATE_DELETED,),
+            EpisodeListMixin.VIEW_DOWNLOADED: ('state = %d OR (state = %d AND played = 0)' % \
+                    (gpodder.STATE_DOWNLOADED, gpodder.STATE_NORMAL),),
+            EpisodeListMixin.VIEW_UNPLAYED: ('played = 0 AND state IN (%d, %d)' % \
+                    (gpodder.STATE_DOWNLOADED, gpodder.STATE_NORMAL),),
+    }
+
+    def __init__(self, on_filter_changed=lambda has_episodes: None):
+        gtk.GenericTreeModel.__init__(self)
+
+        # Callback for when the filter / list changes, gets one parameter
+        # (has_episodes) that is True if the list has any episodes
+        self._on_filter_changed = on_filter_changed
+
+        self._downloading = None
+        self._include_description = False
+        self._generate_thumbnails = False
+        self._treeview = None
+
+        # All episodes of the channel and the ones currently shown
+        self._all_episodes = []
+        self._episodes = []
+        self._rows = {}
+
+        self._view_mode = self.VIEW_ALL
+        self._search_term = None
+        self._all_episodes_view = True
+
+        self._init_icons()
+
+    # ---------------------
+
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY
+
+    def on_get_n_columns(self):
+        return len(self.DATA_TYPES)
+
+    def on_get_column_type(self, index):
+        return self.DATA_TYPES[index]
+
+    def on_get_iter(self, path):
+        if path[0] < len(self._episodes):
+            return path[0]
+
+        return None
+
+    def on_get_path(self, rowref):
+        return (rowref,)
+
+    def on_get_value(self, rowref, column):
+        row = self._get_row(rowref)
+        if row is None:
+            return None
+
+        return row[column]
+
+    def on_iter_next(self, rowref):
+        if rowref + 1 < len(self._episodes):
+            return rowref + 1
+
+        return None
+
+    def on_iter_children(self, parent):
+        if parent is None and len(self._episodes):
+            return 0
+
+        return None
+
+    def on_iter_has_child(self, rowref):
+        return False
+
+    def on_iter_n_children(self, rowref):
+        if rowref is None:
+            return len(self._episodes)
+
+        return 0
+
+    def on_iter_nth_child(self, parent, n):
+        if parent is None and n < len(self._episodes):
+            return n
+
+        return None
+
+    def on_iter_parent(self, child):
+        return None
+
+    # ---------------------
+
+    def _get_row(self, index):
+        if index >= len(self._episodes):
+            return None
+
+        row = self._rows.get(index, None)
+        if row is None:
+            episode = self._episodes[index]
+            if episode is None:
+                return None
+
+            row = [None]*len(self.DATA_TYPES)
+            row[self.C_URL] = episode.url
+            row[self.C_TITLE] = episode.title
+            row[self.C_FILESIZE_TEXT] = self._format_filesize(episode)
+            row[self.C_EPISODE] = episode
+            row[self.C_PUBLISHED_TEXT] = episode.cute_pubdate()
+            row[self.C_FILESIZE] = episode.length
+            row[self.C_PUBLISHED] = episode.pubDate
+
+            values = self._get_row_values(episode, self._downloading, \
+                    self._include_description, self._generate_thumbnails)
+            for column, value in zip(values[::2], values[1::2]):
+                row[column] = value
+
+            if len(self._rows) >= self.MAX_CACHED_ROWS:
+                self._rows.clear()
+            self._rows[index] = row
+
+        return row
+
+    def _get_filtered_episodes(self):
+        if not hasattr(self._all_episodes, 'filter'):
+            return self._all_episodes
+
+        if self._search_term is not None:
+            key = self._search_term.lower()
+            channel_ids = [c.id for c in self._all_episodes.get_channels() \
+                    if key in c.title.lower()]
+            return self._all_episodes.search(self._search_term, channel_ids)
+
+        conditions = self.VIEW_CONDITIONS.get(self._view_mode, ())
+        if conditions:
+            return self._all_episodes.filter(conditions)
+
+        return self._all_episodes
+
+    def _set_episodes(self, episodes):
+        treeview = self._treeview
+        if treeview is not None and treeview.get_model() is self:
+            # Detach from the view to avoid signals for every row
+            treeview.set_model(None)
+            self._episodes = episodes
+            self._rows = {}
+            treeview.set_model(self)
+        else:
+            old_episodes = self._episodes
+            self._episodes = []
+            self._rows = {}
+            for index in reversed(xrange(len(old_episodes))):
+                self.row_deleted((index,))
+            self._episodes = episodes
+            for index in xrange(len(episodes)):
+                self.row_inserted((index,), self.get_iter((index,)))
+
+    def get_filtered_model(self):
+        """Returns the model that should be displayed in the UI
+
+        Filtering is done in the database, so this is the model itself.
+        """
+        return self
+
+    def has_episodes(self):
+        """Returns True if episodes are visible (filtered)"""
+        return len(self._episodes) > 0
+
+    def set_view_mode(self, new_mode):
+        """Sets a new view mode for this model
+
+        This loads the episodes matching the new mode from the database.
+        """
+        if self._view_mode != new_mode:
+            self._view_mode = new_mode
+            self._set_episodes(self._get_filtered_episodes())
+            self._on_filter_changed(self.has_episodes())
+
+    def get_view_mode(self):
+        """Returns the currently-set view mode"""
+        return self._view_mode
+
+    def set_search_term(self, new_term):
+        if self._search_term != new_term:
+            self._search_term = new_term
+            self._set_episodes(self._get_filtered_episodes())
+            self._on_filter_changed(self.has_episodes())
+
+    def get_search_term(self):
+        return self._search_term
+
+    def clear(self):
+        self._all_episodes = []
+        self._set_episodes([])
+
+    def replace_from_channel(self, channel, downloading=None, \
+            include_description=False, generate_thumbnails=False, \
+            treeview=None):
+        """
+        Show the episodes of "channel" (a podcast proxy) in this model.
+        Downloading should be a callback. If "treeview" is given, the
+        model is detached from it while the rows are replaced.
+        """
+        self._downloading = downloading
+        self._include_description = include_description
+        self._generate_thumbnails = generate_thumbnails
+        self._treeview = treeview
+
+        if channel is None:
+            self._all_episodes = []
+        else:
+            self._all_episodes = channel.get_all_episodes()
+
+        self._set_episodes(self._get_filtered_episodes())
+        self._on_filter_changed(self.has_episodes())
+
+    def update_all(self, downloading=None, include_description=False, \
+            generate_thumbnails=False):
+        self._downloading = downloading
+        self._include_description = include_description
+        self._generate_thumbnails = generate_thumbnails
+
+        # Only the visible rows are re-created (and reloaded)
+        if hasattr(self._episodes, 'invalidate'):
+            self._episodes.invalidate()
+        self._rows = {}
+        if self._treeview is not None:
+            self._treeview.queue_draw()
+
+    def update_by_urls(self, urls, downloading=None, include_description=False, \
+            generate_thumbnails=False):
+        self._downloading = downloading
+        self._include_description = include_description
+        self._generate_thumbnails = generate_thumbnails
+
+        # Episodes that are not loaded will be up to date when loaded
+        if hasattr(self._episodes, 'get_loaded'):
+            loaded = list(self._episodes.get_loaded())
+        else:
+            loaded = enumerate(self._episodes)
+
+        for index, episode in loaded:
+            if episode.url in urls:
+                episode.reload_from_db()
+                self._rows.pop(index, None)
+                self.row_changed((index,), self.get_iter((index,)))
+
+    def update_by_filter_iter(self, iter, downloading=None, \
+            include_description=False, generate_thumbnails=False):
+        # The filtered model is this model (see get_filtered_model)
+        self.update_by_iter(iter, downloading, include_description, \
+                generate_thumbnails)
+
+    def update_by_iter(self, iter, downloading=None, include_description=False, \
+            generate_thumbnails=False, reload_from_db=True):
+        self._downloading = downloading
+        self._include_description = include_description
+        self._generate_thumbnails = generate_thumbnails
+
+        index = self.get_user_data(iter)
+        episode = self._episodes[index]
+        if episode is not None and reload_from_db:
+            episode.reload_from_db()
+
+        self._rows.pop(index, None)
+        self.row_changed((index,), self.create_tree_iter(index))
+
+
 class PodcastChannelProxy(object):
     ALL_EPISODES_PROXY = True
 
@@ -517,9 +924,8 @@ class PodcastChannelProxy(object):
         return self._db.get_total_count()
 
     def get_all_episodes(self):
-        """Returns a generator that yields every episode"""
-        channel_lookup_map = dict((c.id, c) for c in self.channels)
-        return self._db.load_all_episodes(channel_lookup_map)
+        """Returns a PagedEpisodeList of every episode"""
+        return PagedEpisodeList(self._db, self.channels)
 
     def request_save_dir_size(self):
         if not self._save_dir_size_set:
@@ -561,11 +967,11 @@ class NewPodcastChannelProxy(object):
         
 
     def get_all_episodes(self):
-        """Returns a generator that yields new episodes
+        """Returns a PagedEpisodeList of new episodes
             from all channels
         """
-        channel_lookup_map = dict((c.id, c) for c in self.channels)
-        return self._db.load_new_episodes(channel_lookup_map)
+        return PagedEpisodeList(self._db, self.channels, \
+                ('state = ? AND played = 0',), (gpodder.STATE_NORMAL,))
 
     def request_save_dir_size(self):
         if not self._save_dir_size_set:
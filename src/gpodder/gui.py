@@ -47,8 +47,6 @@ import glob
 import time
 import tempfile
 import collections
-import threading
-import Queue
 import urllib
 
 from xml.sax import saxutils
@@ -88,10 +86,12 @@ from gpodder import feedcore
 from gpodder import util
 from gpodder import opml
 from gpodder import download
+from gpodder import feedupdate
 from gpodder import my
 from gpodder import youtube
 from gpodder import player
 from gpodder.liblogger import log
+from gpodder.executor import executor
 
 _ = gpodder.gettext
 N_ = gpodder.ngettext
@@ -102,6 +102,7 @@ from gpodder.dbsqlite import Database
 
 from gpodder.gtkui.model import PodcastListModel
 from gpodder.gtkui.model import EpisodeListModel
+from gpodder.gtkui.model import PagedEpisodeListModel
 from gpodder.gtkui.config import UIConfig
 from gpodder.gtkui.services import CoverDownloader
 from gpodder.gtkui.widgets import SimpleMessageArea
@@ -328,7 +329,21 @@ class gPodder(BuilderWidget, dbus.service.Object):
             self.sync_ui = None
 
         self.download_status_model = DownloadStatusModel()
+        self.download_status_model.set_changed_callback(lambda tasks: \
+                self.update_downloads_list(changed_tasks=tasks))
         self.download_queue_manager = download.DownloadQueueManager(self.config)
+        self.feed_updater = feedupdate.FeedUpdater(self.config)
+
+        # Queues for background jobs (see gpodder.executor); jobs that
+        # change podcasts or delete files are run one after another
+        executor.add_queue('podcasts', executor.PRIORITY_HIGH, 1)
+        executor.add_queue('feeds', executor.PRIORITY_HIGH, 1)
+        executor.add_queue('delete', executor.PRIORITY_NORMAL, 1)
+        executor.add_queue('background', executor.PRIORITY_LOW, 2)
+
+        # Give unused space in the database back while idle (this is
+        # a bounded amount of work, so it can't delay closing gPodder)
+        gobject.timeout_add(5*60*1000, self._on_db_maintenance_timer)
 
         if gpodder.ui.desktop:
             self.show_hide_tray_icon()
@@ -489,7 +504,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
 
         # load list of user applications for audio playback
         self.user_apps_reader = UserAppsReader(['audio', 'video'])
-        threading.Thread(target=self.user_apps_reader.read).start()
+        executor.submit('background', self.user_apps_reader.read)
 
         # Set the "Device" menu item for the first time
         if gpodder.ui.desktop:
@@ -512,8 +527,9 @@ class gPodder(BuilderWidget, dbus.service.Object):
 
         self.message_area = None
 
-        def find_partial_downloads():
-            # Look for partial file downloads
+        def find_partial_files():
+            # Look for partial file downloads (for upgrades from versions
+            # that did not save the download queue in the database)
             partial_files = glob.glob(os.path.join(self.config.download_dir, '*', '*.partial'))
             count = len(partial_files)
             resumable_episodes = []
@@ -543,6 +559,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
                                 # The file has already been downloaded;
                                 # remove the leftover partial file
                                 util.delete_file(filename+'.partial')
+                                util.delete_file(download.SegmentedDownload.get_state_filename(filename+'.partial'))
                             else:
                                 resumable_episodes.append(e)
 
@@ -555,35 +572,68 @@ class gPodder(BuilderWidget, dbus.service.Object):
                 for f in partial_files:
                     log('Partial file without episode: %s', f, sender=self)
                     util.delete_file(f)
+                    util.delete_file(download.SegmentedDownload.get_state_filename(f))
 
                 util.idle_add(indicator.on_finished)
 
-                if len(resumable_episodes):
-                    def offer_resuming():
-                        self.download_episode_list_paused(resumable_episodes)
-                        if not gpodder.ui.fremantle:
-                            resume_all = gtk.Button(_('Resume all'))
-                            #resume_all.set_border_width(0)
-                            def on_resume_all(button):
-                                selection = self.treeDownloads.get_selection()
-                                selection.select_all()
-                                selected_tasks, can_queue, can_cancel, can_pause, can_remove, can_force = self.downloads_list_get_selection()
-                                selection.unselect_all()
-                                self._for_each_task_set_status(selected_tasks, download.DownloadTask.QUEUED)
-                                self.message_area.hide()
-                            resume_all.connect('clicked', on_resume_all)
-
-                            self.message_area = SimpleMessageArea(_('Incomplete downloads from a previous session were found.'), (resume_all,))
-                            self.vboxDownloadStatusWidgets.pack_start(self.message_area, expand=False)
-                            self.vboxDownloadStatusWidgets.reorder_child(self.message_area, 0)
-                            self.message_area.show_all()
-                        self.clean_up_downloads(delete_partial=False)
-                    util.idle_add(offer_resuming)
-                elif not gpodder.ui.fremantle:
-                    util.idle_add(self.wNotebook.set_current_page, 0)
+            return resumable_episodes
+
+        def load_download_queue():
+            # Restore the unfinished downloads saved in the database
+            downloads = self.db.load_downloads()
+            channels = dict((c.id, c) for c in self.channels)
+            episodes = self.db.load_episodes_by_ids(channels, \
+                    [episode_id for episode_id, tempname, size, status in downloads])
+
+            resumable_episodes = []
+            for episode_id, tempname, size, status in downloads:
+                episode = episodes.get(episode_id, None)
+                if episode is None:
+                    self.db.delete_download(episode_id)
+                elif episode.was_downloaded(and_exists=True):
+                    # The file has already been downloaded;
+                    # remove the leftover partial file
+                    util.delete_file(tempname)
+                    util.delete_file(download.SegmentedDownload.get_state_filename(tempname))
+                    self.db.delete_download(episode_id)
+                else:
+                    resumable_episodes.append(episode)
+
+            if resumable_episodes and not gpodder.ui.fremantle:
+                util.idle_add(self.wNotebook.set_current_page, 1)
+
+            return resumable_episodes
+
+        def find_partial_downloads():
+            if self.db.table_created(self.db.TABLE_DOWNLOADS):
+                resumable_episodes = find_partial_files()
             else:
-                util.idle_add(self.clean_up_downloads, True)
-        threading.Thread(target=find_partial_downloads).start()
+                resumable_episodes = load_download_queue()
+
+            if resumable_episodes:
+                def offer_resuming():
+                    self.download_episode_list_paused(resumable_episodes)
+                    if not gpodder.ui.fremantle:
+                        resume_all = gtk.Button(_('Resume all'))
+                        #resume_all.set_border_width(0)
+                        def on_resume_all(button):
+                            selection = self.treeDownloads.get_selection()
+                            selection.select_all()
+                            selected_tasks, can_queue, can_cancel, can_pause, can_remove, can_force = self.downloads_list_get_selection()
+                            selection.unselect_all()
+                            self._for_each_task_set_status(selected_tasks, download.DownloadTask.QUEUED)
+                            self.message_area.hide()
+                        resume_all.connect('clicked', on_resume_all)
+
+                        self.message_area = SimpleMessageArea(_('Incomplete downloads from a previous session were found.'), (resume_all,))
+                        self.vboxDownloadStatusWidgets.pack_start(self.message_area, expand=False)
+                        self.vboxDownloadStatusWidgets.reorder_child(self.message_area, 0)
+                        self.message_area.show_all()
+                    self.clean_up_downloads(delete_partial=False)
+                util.idle_add(offer_resuming)
+            elif not gpodder.ui.fremantle:
+                util.idle_add(self.wNotebook.set_current_page, 0)
+        executor.submit('background', find_partial_downloads)
 
         # Start the auto-update procedure
         self._auto_update_timer_source_id = None
@@ -1261,6 +1311,16 @@ class gPodder(BuilderWidget, dbus.service.Object):
         # For loading the list model
         self.episode_list_model = EpisodeListModel(self.on_episode_list_filter_changed)
 
+        # The "All episodes" and "New episodes" views use a model that
+        # loads episodes on demand (see update_episode_list_model)
+        self.default_episode_list_model = self.episode_list_model
+        if gpodder.ui.fremantle:
+            self.paged_episode_list_model = None
+        else:
+            self.paged_episode_list_model = PagedEpisodeListModel(\
+                    self.on_episode_list_filter_changed)
+        self.episode_list_column_sizing = {}
+
         if self.config.episode_list_view_mode == EpisodeListModel.VIEW_UNDELETED:
             self.item_view_episodes_undeleted.set_active(True)
         elif self.config.episode_list_view_mode == EpisodeListModel.VIEW_DOWNLOADED:
@@ -1335,6 +1395,9 @@ class gPodder(BuilderWidget, dbus.service.Object):
                 itemcolumn.set_reorderable(True)
                 self.treeAvailable.append_column(itemcolumn)
 
+        for column in self.treeAvailable.get_columns():
+            self.episode_list_column_sizing[column] = column.get_sizing()
+
         # Set up type-ahead find for the episode list
         def on_key_press(treeview, event):
             if event.keyval == gtk.keysyms.Escape:
@@ -1495,7 +1558,6 @@ class gPodder(BuilderWidget, dbus.service.Object):
     def enable_download_list_update(self):
         if not self.download_list_update_enabled:
             self.update_downloads_list()
-            gobject.timeout_add(1500, self.update_downloads_list)
             self.download_list_update_enabled = True
 
     def cleanup_downloads(self):
@@ -1547,64 +1609,50 @@ class gPodder(BuilderWidget, dbus.service.Object):
     def remove_download_task_monitor(self, monitor):
         self.download_task_monitors.remove(monitor)
 
-    def update_downloads_list(self, can_call_cleanup=True):
+    def update_downloads_list(self, can_call_cleanup=True, changed_tasks=None):
+        """Update the download status in the UI
+
+        Called by the download status model with the tasks that have
+        changed. If "changed_tasks" is None, all tasks are checked.
+        """
         try:
             model = self.download_status_model
 
-            downloading, failed, finished, queued, paused, others = 0, 0, 0, 0, 0, 0
-            total_speed, total_size, done_size = 0, 0, 0
+            if changed_tasks is None:
+                # Apply pending changes now, as we check all tasks
+                model.update_changed_tasks(notify=False)
 
             # Keep a list of all download tasks that we've seen
-            download_tasks_seen = set()
+            self.download_tasks_seen = set(model.get_tasks())
+
+            if changed_tasks is None:
+                changed_tasks = self.download_tasks_seen
+
+            DownloadTask = download.DownloadTask
+            downloading = model.get_status_count(DownloadTask.DOWNLOADING)
+            failed = model.get_status_count(DownloadTask.FAILED)
+            finished = model.get_status_count(DownloadTask.DONE)
+            queued = model.get_status_count(DownloadTask.QUEUED)
+            paused = model.get_status_count(DownloadTask.PAUSED)
+            others = len(self.download_tasks_seen) - \
+                    (downloading + failed + finished + queued + paused)
+            total_speed, total_size, done_size = model.get_transfer_statistics()
+
+            # Let the download task monitors know of changes
+            for task in changed_tasks:
+                for monitor in self.download_task_monitors:
+                    monitor.task_updated(task)
 
             # Remember the DownloadTask object for the episode that
             # has been opened in the episode shownotes dialog (if any)
+            shownotes_task = None
             if self.episode_shownotes_window is not None:
                 shownotes_episode = self.episode_shownotes_window.episode
-                shownotes_task = None
-            else:
-                shownotes_episode = None
-                shownotes_task = None
-
-            # Do not go through the list of the model is not (yet) available
-            if model is None:
-                model = ()
-
-            for row in model:
-                self.download_status_model.request_update(row.iter)
-
-                task = row[self.download_status_model.C_TASK]
-                speed, size, status, progress = task.speed, task.total_size, task.status, task.progress
-
-                # Let the download task monitors know of changes
-                for monitor in self.download_task_monitors:
-                    monitor.task_updated(task)
-
-                total_size += size
-                done_size += size*progress
-
-                if shownotes_episode is not None and \
-                        shownotes_episode.url == task.episode.url:
-                    shownotes_task = task
-
-                download_tasks_seen.add(task)
-
-                if status == download.DownloadTask.DOWNLOADING:
-                    downloading += 1
-                    total_speed += speed
-                elif status == download.DownloadTask.FAILED:
-                    failed += 1
-                elif status == download.DownloadTask.DONE:
-                    finished += 1
-                elif status == download.DownloadTask.QUEUED:
-                    queued += 1
-                elif status == download.DownloadTask.PAUSED:
-                    paused += 1
-                else:
-                    others += 1
-
-            # Remember which tasks we have seen after this run
-            self.download_tasks_seen = download_tasks_seen
+                if shownotes_episode is not None:
+                    for task in self.download_tasks_seen:
+                        if shownotes_episode.url == task.episode.url:
+                            shownotes_task = task
+                            break
 
             if gpodder.ui.desktop:
                 text = [_('Downloads')]
@@ -1641,7 +1689,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
             # re-setting the changed flag, so we need to get the "changed" list
             # of tuples first and split it into two lists afterwards
             changed = [(task.url, task.podcast_url) for task in \
-                    self.download_tasks_seen if task.status_changed]
+                    changed_tasks if task.status_changed]
             episode_urls = [episode_url for episode_url, channel_url in changed]
             channel_urls = [channel_url for episode_url, channel_url in changed]
 
@@ -1681,7 +1729,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
                 if self.config.auto_cleanup_downloads and can_call_cleanup:
                     self.cleanup_downloads()
 
-                # Stop updating the download list here
+                # Downloads are not active anymore
                 self.download_list_update_enabled = False
 
             if not gpodder.ui.fremantle:
@@ -1696,14 +1744,9 @@ class gPodder(BuilderWidget, dbus.service.Object):
             self.play_or_download()
             if channel_urls:
                 self.update_podcast_list_model(channel_urls)
-
-            return self.download_list_update_enabled
         except Exception, e:
             log('Exception happened while updating download list.', sender=self, traceback=True)
             self.show_message('%s\n\n%s' % (_('Please report this problem and restart gPodder:'), str(e)), _('Unhandled exception'), important=True)
-            # We return False here, so the update loop won't be called again,
-            # that's why we require the restart of gPodder in the message.
-            return False
 
     def on_config_changed(self, *args):
         util.idle_add(self._on_config_changed, *args)
@@ -2164,7 +2207,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
 
                 util.delete_file(destfile)
 
-        threading.Thread(target=convert_and_send_thread, args=[episodes_to_copy]).start()
+        executor.submit('background', convert_and_send_thread, episodes_to_copy)
 
     def get_device_name(self):
         if self.config.device_type == 'ipod':
@@ -2398,6 +2441,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
 
         if delete_partial:
             temporary_files += glob.glob('%s/*/*.partial' % self.config.download_dir)
+            temporary_files += glob.glob('%s/*/*.partial.segments' % self.config.download_dir)
 
         for tempfile in temporary_files:
             util.delete_file(tempfile)
@@ -2792,6 +2836,37 @@ class gPodder(BuilderWidget, dbus.service.Object):
                 self.episodes_window.pannablearea.hide()
                 self.episodes_window.empty_label.show()
 
+    def set_episode_list_model(self, model):
+        """Switch between the default and the paged episode list model
+
+        The paged model only creates rows for visible episodes. For
+        this to work, the tree view must not measure all rows, so it
+        is set to fixed-height mode while the paged model is in use.
+        """
+        if model is self.episode_list_model:
+            return
+
+        model.set_view_mode(self.episode_list_model.get_view_mode())
+        model.set_search_term(self.episode_list_model.get_search_term())
+        self.episode_list_model.clear()
+        self.episode_list_model = model
+
+        paged = (model is self.paged_episode_list_model)
+        if not paged:
+            self.treeAvailable.set_fixed_height_mode(False)
+
+        for column, sizing in self.episode_list_column_sizing.items():
+            if paged:
+                column.set_fixed_width(max(column.get_width(), 1))
+                column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+            else:
+                column.set_sizing(sizing)
+
+        if paged:
+            self.treeAvailable.set_fixed_height_mode(True)
+
+        self.treeAvailable.set_model(model.get_filtered_model())
+
     def update_episode_list_model(self):
         if self.channels and self.active_channel is not None:
             if gpodder.ui.fremantle:
@@ -2805,9 +2880,18 @@ class gPodder(BuilderWidget, dbus.service.Object):
                 self.episodes_window.empty_label.show()
 
             def update():
+                if self.paged_episode_list_model is not None:
+                    if getattr(self.active_channel, 'ALL_EPISODES_PROXY', False):
+                        self.set_episode_list_model(self.paged_episode_list_model)
+                    else:
+                        self.set_episode_list_model(self.default_episode_list_model)
+
                 additional_args = (self.episode_is_downloading, \
                         self.config.episode_list_descriptions and gpodder.ui.desktop, \
                         self.config.episode_list_thumbnails and gpodder.ui.desktop)
+                if self.episode_list_model is self.paged_episode_list_model:
+                    # Allows the model to detach from the view while loading
+                    additional_args += (self.treeAvailable,)
                 self.episode_list_model.replace_from_channel(self.active_channel, *additional_args)
 
                 self.treeAvailable.get_selection().unselect_all()
@@ -3006,7 +3090,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
                 self.channels.append(channel)
                 self.channel_list_changed = True
             util.idle_add(on_after_update)
-        threading.Thread(target=thread_proc).start()
+        executor.submit('podcasts', thread_proc)
 
     def save_channels_opml(self):
         exporter = opml.Exporter(gpodder.subscription_file)
@@ -3209,90 +3293,49 @@ class gPodder(BuilderWidget, dbus.service.Object):
         if channel is not None and not os.path.exists(channel.cover_file) and channel.image:
             self.cover_downloader.request_cover(channel)
 
-    def update_one_feed_cache_proc(self, queue,total):
-        """worker thread for updating feeds.
-            It will grab channels from the queue and
-            acknowledge them using Queue.task_done()
-            so that Queue.join() will succeed when the Queue
-            is empty and all the feeds are refreshed.
-            total is used to update the status
-        """
-        while not queue.empty():
-            try:
-                # get a channel to update
-                # get() will fail after 1s if the queue is empy
-                # (another thread stole the last channel since
-                # empty() was called).
-                # the Empty exception is caught at the end
-                channel = queue.get(True,1)
-                
-                # when update is cancelled, the channels are still
-                # dequeued to allow all threads to end
-                if not self.feed_cache_update_cancelled:
-                    try:
-                        channel.update(max_episodes=self.config.max_episodes_per_feed, \
-                                mimetype_prefs=self.config.mimetype_prefs)
-                        self._update_cover(channel)
-                    except Exception, e:
-                        d = {'url': saxutils.escape(channel.url), 'message': saxutils.escape(str(e))}
-                        if d['message']:
-                            message = _('Error while updating %(url)s: %(message)s')
-                        else:
-                            message = _('The feed at %(url)s could not be updated.')
-                        self.notification(message % d, _('Error while updating feed'), widget=self.treeChannels)
-                        log('Error: %s', str(e), sender=self, traceback=True)
-                
-                    # By the time we get here the update may have already been cancelled
-                    if not self.feed_cache_update_cancelled:
-                        log("Updated %s", channel.title, sender=self)
-                        
-                        # must keep track somehow of the number
-                        # of feeds already updated.
-                        # this is stored in self.update_feed_cache_count
-                        # and concurrent access is protected by
-                        # self.update_feed_cache_lock
-                        self.update_feed_cache_lock.acquire()
-                        updated = self.update_feed_cache_count + 1
-                        self.update_feed_cache_count = updated
-                        self.update_feed_cache_lock.release()
-                        
-                        # will update the ui later on
-                        self.update_feed_cache_status(updated,total,channel)
-                    
-                # notify main thread of completion of the task
-                # (even if feed_cache_update_cancelled)
-                queue.task_done()
-                    
-            except Queue.Empty:
-                pass
-            
-            log("Worker thread done: %s", threading.current_thread().name)
-        
-        
     def update_feed_cache_proc(self, channels, select_url_afterwards):
         """update given channels in parallel.
             will exit once all channels are updated or update is cancelled
         """
         total = len(channels)
         print("update_feed_cache_proc(%i)" % total)
-        
-        self.update_feed_cache_lock = threading.Lock()
+
         self.update_feed_cache_count = 0
-        
-        queue = Queue.Queue(len(channels))
-        
-        for channel in channels:
-            queue.put(channel)
-        
-        # 4 concurrent feed updates
-        for i in range(4):
-            args = (queue,total)
-            t = threading.Thread(target=self.update_one_feed_cache_proc, args=args)
-            t.start()
-            
-        # wait for all threads to be done
-        queue.join()
-        
+
+        def fetch_channel(channel):
+            # Runs in a worker thread - only downloads and parses the feed
+            return channel.fetch(self.config.max_episodes_per_feed)
+
+        def consume_channel(channel, result):
+            # Runs in this thread - the only one writing to the database
+            channel.consume(result, max_episodes=self.config.max_episodes_per_feed, \
+                    mimetype_prefs=self.config.mimetype_prefs)
+            self._update_cover(channel)
+
+        def on_channel_updated(channel, error):
+            if error is not None:
+                d = {'url': saxutils.escape(channel.url), 'message': saxutils.escape(str(error))}
+                if d['message']:
+                    message = _('Error while updating %(url)s: %(message)s')
+                else:
+                    message = _('The feed at %(url)s could not be updated.')
+                self.notification(message % d, _('Error while updating feed'), widget=self.treeChannels)
+                log('Error: %s', str(error), sender=self)
+
+            # By the time we get here the update may have already been cancelled
+            if not self.feed_cache_update_cancelled:
+                log("Updated %s", channel.title, sender=self)
+
+                # Results are consumed one by one in this
+                # thread, so no locking is needed for the count
+                self.update_feed_cache_count += 1
+
+                # will update the ui later on
+                self.update_feed_cache_status(self.update_feed_cache_count, total, channel)
+
+        self.feed_updater.update(channels, fetch_channel, consume_channel, \
+                on_channel_updated, self.db.commit)
+
         updated_urls = [c.url for c in channels]
         util.idle_add(self.update_feed_cache_finish_callback, updated_urls, select_url_afterwards)
 
@@ -3330,6 +3373,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
         if not self.feed_cache_update_cancelled:
             self.pbFeedUpdate.set_text(_('Cancelling...'))
             self.feed_cache_update_cancelled = True
+            self.feed_updater.cancel()
             if not gpodder.ui.fremantle:
                 self.btnCancelFeedUpdate.set_sensitive(False)
         elif not gpodder.ui.fremantle:
@@ -3340,6 +3384,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
         if self.updating_feed_cache:
             if gpodder.ui.fremantle:
                 self.feed_cache_update_cancelled = True
+                self.feed_updater.cancel()
             return
 
         if not force_update:
@@ -3393,7 +3438,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
         self.pbFeedUpdate.set_fraction(0)
 
         args = (channels, select_url_afterwards)
-        threading.Thread(target=self.update_feed_cache_proc, args=args).start()
+        executor.submit('feeds', self.update_feed_cache_proc, *args)
 
     def on_gPodder_delete_event(self, widget, *args):
         """Called when the GUI wants to close the window
@@ -3452,7 +3497,18 @@ class gPodder(BuilderWidget, dbus.service.Object):
         while gtk.events_pending():
             gtk.main_iteration(False)
 
-        self.db.close()
+        # Let paused downloads and running background jobs finish
+        # (and save their state) before closing the database
+        downloads_finished = self.download_queue_manager.close(timeout=10)
+        self.feed_cache_update_cancelled = True
+        self.feed_updater.cancel()
+        if executor.close(timeout=10) and downloads_finished:
+            self.db.close()
+        else:
+            # Closing would make the running job reopen the database
+            log('Background jobs still running, not closing the database', \
+                    sender=self)
+            self.db.commit()
 
         self.quit()
         #:sys.exit(0)
@@ -3550,7 +3606,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
 
             util.idle_add(finish_deletion, episode_urls, channel_urls)
 
-        threading.Thread(target=thread_proc).start()
+        executor.submit('delete', thread_proc)
 
         return True
 
@@ -3729,6 +3785,9 @@ class gPodder(BuilderWidget, dbus.service.Object):
         if enable_update:
             self.enable_download_list_update()
 
+            # Save the download queue (see DownloadTask)
+            self.db.commit()
+
         # Flush updated episode status
         self.mygpo_client.flush()
 
@@ -4072,7 +4131,7 @@ class gPodder(BuilderWidget, dbus.service.Object):
             # The remaining stuff is to be done in the GTK main thread
             util.idle_add(finish_deletion, select_url)
 
-        threading.Thread(target=thread_proc).start()
+        executor.submit('podcasts', thread_proc)
 
     def on_itemRemoveChannel_activate(self, widget, *args):
         if self.active_channel is None:
@@ -4380,9 +4439,25 @@ class gPodder(BuilderWidget, dbus.service.Object):
             self._auto_update_timer_source_id = gobject.timeout_add(\
                     interval, self._on_auto_update_timer)
 
+    def _on_db_maintenance_timer(self):
+        if not self.updating_feed_cache:
+            executor.submit('background', self.db.maintenance)
+        return True
+
     def _on_auto_update_timer(self):
         log('Auto update timer fired.', sender=self)
-        self.update_feed_cache(force_update=True)
+
+        # Only update podcasts that are due according to their release
+        # cycle; half an interval of slack so that podcasts without a
+        # known cycle are updated on every tick of the timer
+        interval = 60*self.config.auto_update_frequency
+        now = time.time() + interval/2
+        channels = [c for c in self.channels if c.feed_update_enabled and \
+                c.get_next_update(interval) <= now]
+        log('%d of %d podcasts are due for an update.', len(channels), \
+                len(self.channels), sender=self)
+        if channels:
+            self.update_feed_cache(channels=channels, force_update=True)
 
         # Ask web service for sub changes (if enabled)
         self.mygpo_client.flush()
@@ -27,6 +27,7 @@ import gpodder
 from gpodder import util
 from gpodder import feedcore
 from gpodder import youtube
+from gpodder import connectionpool
 
 from gpodder.liblogger import log
 
@@ -38,6 +39,7 @@ import time
 import datetime
 import rfc822
 import hashlib
+import heapq
 import feedparser
 import xml.sax.saxutils
 
@@ -57,7 +59,7 @@ class gPodderFetcher(feedcore.Fetcher):
     def __init__(self):
         feedcore.Fetcher.__init__(self, gpodder.user_agent)
 
-    def fetch_channel(self, channel):
+    def fetch_channel(self, channel, max_episodes=0):
         etag = channel.etag
         modified = feedparser._parse_date(channel.last_modified)
         # If we have a username or password, rebuild the url with them included
@@ -68,20 +70,19 @@ class gPodderFetcher(feedcore.Fetcher):
             custom_feed = handler.handle_url(url)
             if custom_feed is not None:
                 raise CustomFeed(custom_feed)
-        self.fetch(url, etag, modified)
+        self.fetch(url, etag, modified, channel.content_digest, max_episodes)
 
     def _resolve_url(self, url):
         return youtube.get_real_channel_url(url)
 
+    def _get_handlers(self):
+        # Reuse connections to the same server between feed updates
+        return connectionpool.get_handlers()
+
     @classmethod
     def register(cls, handler):
         cls.custom_handlers.append(handler)
 
-#    def _get_handlers(self):
-#        # Add a ProxyHandler for fetching data via a proxy server
-#        proxies = {'http': 'http://proxy.example.org:8080'}
-#        return[urllib2.ProxyHandler(proxies))]
-
 # The "register" method is exposed here for external usage
 register_custom_handler = gPodderFetcher.register
 
@@ -91,6 +92,9 @@ class PodcastModelObject(object):
     and utility functions.
     """
 
+    # Column values as last loaded from or saved to the database
+    _clean_values = None
+
     @classmethod
     def create_from_dict(cls, d, *args):
         """
@@ -99,8 +103,41 @@ class PodcastModelObject(object):
         """
         o = cls(*args)
         o.update_from_dict(d)
+        o.mark_clean(d)
         return o
 
+    def _column_value(self, name):
+        # Normalize values so they compare equal to values from the DB
+        value = getattr(self, name)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        elif isinstance(value, bool):
+            return int(value)
+        return value
+
+    def mark_clean(self, columns):
+        """
+        Remember the current values of the attributes listed in
+        "columns" as being in sync with the database.
+        """
+        if self._clean_values is None:
+            self._clean_values = {}
+        for name in columns:
+            if hasattr(self, name):
+                self._clean_values[name] = self._column_value(name)
+
+    def get_dirty_columns(self, columns):
+        """
+        Returns the subset of "columns" with values that have
+        changed since the object was loaded or last saved.
+        """
+        clean = self._clean_values
+        if clean is None:
+            return list(columns)
+
+        return [name for name in columns if name not in clean or \
+                clean[name] != self._column_value(name)]
+
     def update_from_dict(self, d):
         """
         Updates the attributes of this object with values from the
@@ -116,6 +153,11 @@ class PodcastChannel(PodcastModelObject):
     MAX_FOLDERNAME_LENGTH = 150
     SECONDS_PER_WEEK = 7*24*60*60
 
+    # Number of recent episodes used to estimate the release cycle
+    RELEASE_HISTORY = 10
+    # Longest time between two automatic updates of a podcast
+    MAX_UPDATE_INTERVAL = 24*60*60
+
     feed_fetcher = gPodderFetcher()
 
     @classmethod
@@ -216,8 +258,9 @@ class PodcastChannel(PodcastModelObject):
 
         self.save()
 
-        # Load all episodes to update them properly.
-        existing = self.get_all_episodes()
+        # Only (id, guid, title, pubDate, state) of existing episodes;
+        # episodes found in the feed are loaded after the loop (see below)
+        existing = self.db.load_episode_summaries(self)
 
         # We can limit the maximum number of entries that gPodder will parse
         if max_episodes > 0 and len(feed.entries) > max_episodes:
@@ -226,9 +269,8 @@ class PodcastChannel(PodcastModelObject):
             # max_episodes old episodes, new episodes will not be shown.
             # See also: gPodder Bug 1186
             try:
-                entries = sorted(feed.entries, \
-                        key=lambda x: x.get('updated_parsed', (0,)*9), \
-                        reverse=True)[:max_episodes]
+                entries = heapq.nlargest(max_episodes, feed.entries, \
+                        key=lambda x: x.get('updated_parsed', (0,)*9))
             except Exception, e:
                 log('Could not sort episodes: %s', e, sender=self, traceback=True)
                 entries = feed.entries[:max_episodes]
@@ -236,10 +278,12 @@ class PodcastChannel(PodcastModelObject):
             entries = feed.entries
 
         # Title + PubDate hashes for existing episodes
-        existing_dupes = dict((e.duplicate_id(), e) for e in existing)
+        existing_dupes = dict((hash((title, pubDate)), (id, title, pubDate)) \
+                for id, guid, title, pubDate, state in existing)
 
         # GUID-based existing episode list
-        existing_guids = dict((e.guid, e) for e in existing)
+        existing_guids = dict((guid, id) \
+                for id, guid, title, pubDate, state in existing)
 
         # Get most recent pubDate of all episodes
         last_pubdate = self.db.get_last_pubdate(self) or 0
@@ -247,6 +291,13 @@ class PodcastChannel(PodcastModelObject):
         # Keep track of episode GUIDs currently seen in the feed
         seen_guids = set()
 
+        # New and updated episodes, saved in one batch after the loop
+        episodes_to_save = []
+        new_guids = set()
+
+        # Parsed episodes for the IDs of existing episodes
+        updated_episodes = {}
+
         # Search all entries for new episodes
         for entry in entries:
             try:
@@ -273,20 +324,26 @@ class PodcastChannel(PodcastModelObject):
                 continue
 
             # Detect (and update) existing episode based on GUIDs
-            existing_episode = existing_guids.get(episode.guid, None)
-            if existing_episode:
-                existing_episode.update_from(episode)
-                existing_episode.save()
+            existing_id = existing_guids.get(episode.guid, None)
+            if existing_id is not None:
+                updated_episodes[existing_id] = episode
                 continue
 
             # Detect (and update) existing episode based on duplicate ID
-            existing_episode = existing_dupes.get(episode.duplicate_id(), None)
-            if existing_episode:
-                if existing_episode.is_duplicate(episode):
-                    existing_episode.update_from(episode)
-                    existing_episode.save()
+            existing_dupe = existing_dupes.get(episode.duplicate_id(), None)
+            if existing_dupe is not None:
+                existing_id, title, pubDate = existing_dupe
+                if title == episode.title and pubDate == episode.pubDate:
+                    log('Possible duplicate detected: %s', title)
+                    updated_episodes[existing_id] = episode
                     continue
 
+            # The same new GUID can only be inserted once per channel
+            if episode.guid in new_guids:
+                log('Skipping duplicate GUID in feed: %s', episode.guid, sender=self)
+                continue
+            new_guids.add(episode.guid)
+
             # Workaround for bug 340: If the episode has been
             # published earlier than one week before the most
             # recent existing episode, do not mark it as new.
@@ -294,21 +351,34 @@ class PodcastChannel(PodcastModelObject):
                 log('Episode with old date: %s', episode.title, sender=self)
                 episode.is_played = True
 
-            episode.save()
+            episodes_to_save.append(episode)
+
+        # Load the existing episodes that are still in the feed at once
+        existing_episodes = self.db.load_episodes_by_ids({self.id: self}, \
+                updated_episodes.keys(), descriptions=True)
+        for existing_id, existing_episode in existing_episodes.iteritems():
+            existing_episode.update_from(updated_episodes[existing_id])
+            episodes_to_save.append(existing_episode)
+
+        for episode in episodes_to_save:
+            episode.prepare_save()
+        self.db.save_episodes(self, episodes_to_save)
 
         # Remove "unreachable" episodes - episodes that have not been
         # downloaded and that the feed does not list as downloadable anymore
         # don't do it if channel is locked
         if self.id is not None:
-            episodes_to_purge = (e for e in existing if \
-                     ((not self.channel_is_locked and e.state != gpodder.STATE_DOWNLOADED) \
-                         or e.state == gpodder.STATE_DELETED \
+            episodes_to_purge = [(old_guid, old_title) for old_id, old_guid, \
+                    old_title, old_pubdate, old_state in existing if \
+                     ((not self.channel_is_locked and old_state != gpodder.STATE_DOWNLOADED) \
+                         or old_state == gpodder.STATE_DELETED \
                       ) and \
-                    e.guid not in seen_guids and e.guid is not None)
-            for episode in episodes_to_purge:
-                log('Episode removed from feed: %s (%s)', episode.title, \
-                        episode.guid, sender=self)
-                self.db.delete_episode_by_guid(episode.guid, self.id)
+                    old_guid not in seen_guids and old_guid is not None]
+            for old_guid, old_title in episodes_to_purge:
+                log('Episode removed from feed: %s (%s)', old_title, \
+                        old_guid, sender=self)
+            self.db.delete_episodes_by_guids([old_guid for old_guid, \
+                    old_title in episodes_to_purge], self.id)
 
         # This *might* cause episodes to be skipped if there were more than
         # max_episodes_per_feed items added to the feed between updates.
@@ -320,33 +390,92 @@ class PodcastChannel(PodcastModelObject):
     def update_channel_lock(self):
         self.db.update_channel_lock(self)
 
-    def _update_etag_modified(self, feed):
+    def _update_release_schedule(self):
         self.updated_timestamp = time.time()
+
+        pubdates = self.db.get_recent_pubdates(self, self.RELEASE_HISTORY+1)
+        estimate = util.estimate_release_interval(pubdates)
+        if estimate is None:
+            self.release_expected = 0
+            self.release_deviation = 0
+        else:
+            interval, deviation = estimate
+            self.release_expected = max(pubdates) + interval
+            self.release_deviation = deviation
+
+    def get_next_update(self, min_interval):
+        """Returns the time when this podcast should be updated next
+
+        "min_interval" is the shortest time (in seconds) between two
+        automatic updates. Podcasts with a regular release cycle are
+        only updated once a day until their next release is expected,
+        then every "min_interval" seconds until the release shows up.
+        If the release is overdue, updates become less frequent.
+
+        >>> day = 60*60*24
+        >>> podcast = PodcastChannel(None, None)
+        >>> podcast.updated_timestamp = 100*day
+        >>> podcast.get_next_update(60*60) - podcast.updated_timestamp
+        3600
+
+        With a release expected on day 103, plus or minus half a day:
+
+        >>> podcast.release_expected = 103*day
+        >>> podcast.release_deviation = day/2
+        >>> podcast.get_next_update(60*60) - podcast.updated_timestamp
+        86400
+        >>> podcast.updated_timestamp = 103*day
+        >>> podcast.get_next_update(60*60) - podcast.updated_timestamp
+        3600
+        >>> podcast.updated_timestamp = 105*day
+        >>> podcast.get_next_update(60*60) - podcast.updated_timestamp
+        43200
+        """
+        last_update = self.updated_timestamp
+        max_interval = max(min_interval, self.MAX_UPDATE_INTERVAL)
+
+        if not self.release_expected:
+            # Not enough episodes to know the release cycle
+            return last_update + min_interval
+
+        window_start = self.release_expected - self.release_deviation
+        window_end = self.release_expected + self.release_deviation
+
+        if last_update < window_start:
+            return max(last_update + min_interval, \
+                    min(window_start, last_update + max_interval))
+        elif last_update < window_end:
+            return last_update + min_interval
+        else:
+            overdue = last_update - self.release_expected
+            return last_update + min(max_interval, max(min_interval, overdue/4))
+
+    def _update_etag_modified(self, feed):
         self.etag = feed.headers.get('etag', self.etag)
         self.last_modified = feed.headers.get('last-modified', self.last_modified)
+        self.content_digest = feed.get('content_digest', None) or self.content_digest
 
-    def update(self, max_episodes=0, mimetype_prefs=''):
+    def fetch(self, max_episodes=0):
+        """Download and parse the feed of this podcast
+
+        This only accesses the network, not the database, so it
+        can be run in parallel for many podcasts. Returns the
+        result that has to be passed to consume() afterwards.
+        Errors (see the feedcore module) are raised as usual.
+
+        If "max_episodes" is set, only the most recent entries of
+        the feed are parsed.
+        """
         try:
-            self.feed_fetcher.fetch_channel(self)
+            self.feed_fetcher.fetch_channel(self, max_episodes)
         except CustomFeed, updated:
-            custom_feed = updated.data
-            self._consume_custom_feed(custom_feed, max_episodes)
-            self.save()
+            return updated
         except feedcore.UpdatedFeed, updated:
-            feed = updated.data
-            self._consume_updated_feed(feed, max_episodes, mimetype_prefs)
-            self._update_etag_modified(feed)
-            self.save()
+            return updated
         except feedcore.NewLocation, updated:
-            feed = updated.data
-            self.url = feed.href
-            self._consume_updated_feed(feed, max_episodes, mimetype_prefs)
-            self._update_etag_modified(feed)
-            self.save()
+            return updated
         except feedcore.NotModified, updated:
-            feed = updated.data
-            self._update_etag_modified(feed)
-            self.save()
+            return updated
         except Exception, e:
             # "Not really" errors
             #feedcore.AuthenticationRequired
@@ -362,9 +491,40 @@ class PodcastChannel(PodcastModelObject):
             #feedcore.UnknownStatusCode
             raise
 
+    def consume(self, result, max_episodes=0, mimetype_prefs=''):
+        """Write the result of fetch() to the database
+
+        The changes are not committed; call db.commit() afterwards.
+        """
+        if isinstance(result, CustomFeed):
+            custom_feed = result.data
+            self._consume_custom_feed(custom_feed, max_episodes)
+            self._update_release_schedule()
+            self.save()
+        elif isinstance(result, feedcore.UpdatedFeed):
+            feed = result.data
+            self._consume_updated_feed(feed, max_episodes, mimetype_prefs)
+            self._update_etag_modified(feed)
+            self._update_release_schedule()
+            self.save()
+        elif isinstance(result, feedcore.NewLocation):
+            feed = result.data
+            self.url = feed.href
+            self._consume_updated_feed(feed, max_episodes, mimetype_prefs)
+            self._update_etag_modified(feed)
+            self._update_release_schedule()
+            self.save()
+        elif isinstance(result, feedcore.NotModified):
+            feed = result.data
+            self._update_etag_modified(feed)
+            self._update_release_schedule()
+            self.save()
+
         if gpodder.user_hooks is not None:
             gpodder.user_hooks.on_podcast_updated(self)
 
+    def update(self, max_episodes=0, mimetype_prefs=''):
+        self.consume(self.fetch(max_episodes), max_episodes, mimetype_prefs)
         self.db.commit()
 
     def delete(self):
@@ -412,18 +572,22 @@ class PodcastChannel(PodcastModelObject):
 
         self.last_modified = None
         self.etag = None
+        self.content_digest = None
 
         self.save_dir_size = 0
         self.__save_dir_size_set = False
 
         self.channel_is_locked = False
 
-        self.release_expected = time.time() # <= DEPRECATED
-        self.release_deviation = 0 # <= DEPRECATED
+        self.release_expected = 0
+        self.release_deviation = 0
         self.updated_timestamp = 0
 
         self.feed_update_enabled = True
 
+        # Set by the database when saving (see Database.get_sort_key)
+        self.sort_key = ''
+
     def request_save_dir_size(self):
         if not self.__save_dir_size_set:
             self.update_save_dir_size()
@@ -665,6 +829,32 @@ class PodcastEpisode(PodcastModelObject):
     # Accessor for the "channel_id" DB column
     channel_id = property(fget=_get_channel_id, fset=_set_channel_id)
 
+    def _get_description(self):
+        if self._description is None:
+            # Not loaded with the episode list - see Database.load_episodes()
+            self._description = self.db.load_episode_description(self.id) or ''
+            self.mark_clean(('description',))
+        return self._description
+
+    def _set_description(self, description):
+        self._description = description
+
+    # The description is loaded on demand for episode lists
+    description = property(fget=_get_description, fset=_set_description)
+
+    @classmethod
+    def create_from_dict(cls, d, *args):
+        episode = super(PodcastEpisode, cls).create_from_dict(d, *args)
+        if episode.id is not None and 'description' not in d:
+            episode._description = None
+        return episode
+
+    def get_dirty_columns(self, columns):
+        if self._description is None:
+            # A description that has not been loaded can't have changed
+            columns = [name for name in columns if name != 'description']
+        return super(PodcastEpisode, self).get_dirty_columns(columns)
+
     @staticmethod
     def sort_by_pubdate(episodes, reverse=False):
         """Sort a list of PodcastEpisode objects chronologically
@@ -682,8 +872,9 @@ class PodcastEpisode(PodcastModelObject):
         been updated (e.g. the filename has been set after a
         download where it was not set before the download)
         """
-        d = self.db.load_episode(self.id)
+        d = self.db.load_episode(self.id, descriptions=False)
         self.update_from_dict(d or {})
+        self.mark_clean(d or {})
         return self
 
     def has_website_link(self):
@@ -836,6 +1027,7 @@ class PodcastEpisode(PodcastModelObject):
         self.mimetype = 'application/octet-stream'
         self.guid = ''
         self.description = ''
+        self.description_excerpt = None
         self.link = ''
         self.channel = channel
         self.pubDate = 0
@@ -862,11 +1054,19 @@ class PodcastEpisode(PodcastModelObject):
 
     is_locked = property(fget=get_is_locked, fset=set_is_locked)
 
-    def save(self):
+    def prepare_save(self):
+        """Update the state and run hooks before saving
+
+        This is called by save(), and has to be called on each
+        episode before saving a batch of episodes to the database.
+        """
         if self.state != gpodder.STATE_DOWNLOADED and self.file_exists():
             self.state = gpodder.STATE_DOWNLOADED
         if gpodder.user_hooks is not None:
             gpodder.user_hooks.on_episode_save(self)
+
+    def save(self):
+        self.prepare_save()
         self.db.save_episode(self)
 
     def on_downloaded(self, filename):
@@ -940,7 +1140,12 @@ class PodcastEpisode(PodcastModelObject):
 
     def one_line_description(self):
         MAX_LINE_LENGTH = 120
-        desc = util.remove_html_tags(self.description or '')
+        if self._description is None and self.description_excerpt is not None:
+            # Avoid loading the full description; strip a cut-off tag
+            desc = re.sub('<[^>]*$', '', self.description_excerpt)
+        else:
+            desc = self.description or ''
+        desc = util.remove_html_tags(desc)
         desc = re.sub('\s+', ' ', desc).strip()
         if not desc:
             return _('No description available')
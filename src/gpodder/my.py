@@ -32,13 +32,15 @@ import datetime
 import calendar
 import os
 import sys
-import threading
 import time
+import urllib2
 
 from gpodder.liblogger import log
 
 from gpodder import util
 from gpodder import minidb
+from gpodder import connectionpool
+from gpodder.executor import executor
 
 # Append gPodder's user agent to mygpoclient's user agent
 import mygpoclient
@@ -60,6 +62,25 @@ if not hasattr(mygpoclient, 'require_version') or \
 from mygpoclient import api
 
 from mygpoclient import util as mygpoutil
+from mygpoclient import json as mygpojson
+from mygpoclient import http as mygpohttp
+
+
+class JsonClient(mygpojson.JsonClient):
+    """A mygpoclient JsonClient using gPodder's HTTP handlers
+
+    Requests to the gpodder.net API reuse connections and
+    negotiate compressed responses (see connectionpool).
+    """
+    def __init__(self, username=None, password=None):
+        mygpojson.JsonClient.__init__(self, username, password)
+        handlers = connectionpool.get_handlers()
+        handlers.append(urllib2.HTTPCookieProcessor(self._cookie_jar))
+        if username is not None and password is not None:
+            password_manager = mygpohttp.SimpleHttpPasswordManager(username, \
+                    password)
+            handlers.append(urllib2.HTTPBasicAuthHandler(password_manager))
+        self._opener = urllib2.build_opener(*handlers)
 
 
 # Database model classes
@@ -181,7 +202,8 @@ class MygPoClient(object):
 
         self._config.add_observer(self.on_config_changed)
 
-        self._worker_thread = None
+        self._worker_job = None
+        executor.add_queue('mygpo', executor.PRIORITY_LOW, 1)
         atexit.register(self._at_exit)
 
     def create_device(self):
@@ -328,17 +350,10 @@ class MygPoClient(object):
         self._store.close()
 
     def _worker_proc(self, forced=False):
-        if not forced:
-            # Store the current contents of the queue database
-            self._store.commit()
-
-            log('Worker thread waiting for timeout', sender=self)
-            time.sleep(self.FLUSH_TIMEOUT)
-
         # Only work when enabled, UID set and allowed to work
         if self.can_access_webservice() and \
-                (self._worker_thread is not None or forced):
-            self._worker_thread = None
+                (self._worker_job is not None or forced):
+            self._worker_job = None
 
             log('Worker thread starting to work...', sender=self)
             for retry in range(self.FLUSH_RETRIES):
@@ -384,14 +399,19 @@ class MygPoClient(object):
             log('Flush requested, but sync disabled.', sender=self)
             return
 
-        if self._worker_thread is None or now:
+        if self._worker_job is None or now:
             if now:
                 log('Flushing NOW.', sender=self)
+                if self._worker_job is not None:
+                    self._worker_job.cancel()
+                delay = 0
             else:
                 log('Flush requested.', sender=self)
-            self._worker_thread = threading.Thread(target=self._worker_proc, args=[now])
-            self._worker_thread.setDaemon(True)
-            self._worker_thread.start()
+                # Store the current contents of the queue database
+                executor.submit('mygpo', self._store.commit)
+                delay = self.FLUSH_TIMEOUT
+            self._worker_job = executor.submit_later(delay, 'mygpo', \
+                    self._worker_proc, now)
         else:
             log('Flush requested, already waiting.', sender=self)
 
@@ -399,7 +419,8 @@ class MygPoClient(object):
         if name in ('mygpo_username', 'mygpo_password', 'mygpo_server') \
                 or self._client is None:
             self._client = api.MygPodderClient(self._config.mygpo_username,
-                    self._config.mygpo_password, self._config.mygpo_server)
+                    self._config.mygpo_password, self._config.mygpo_server,
+                    JsonClient)
             log('Reloading settings.', sender=self)
         elif name.startswith('mygpo_device_'):
             # Update or create the device
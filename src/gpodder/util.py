@@ -31,6 +31,7 @@ are not tied to any specific part of gPodder.
 
 import gpodder
 from gpodder.liblogger import log
+from gpodder import connectionpool
 
 import os
 import os.path
@@ -45,7 +46,6 @@ import re
 import subprocess
 from htmlentitydefs import entitydefs
 import time
-import gzip
 import datetime
 import threading
 
@@ -58,7 +58,6 @@ import mimetypes
 
 import feedparser
 
-import StringIO
 import xml.dom.minidom
 
 _ = gpodder.gettext
@@ -886,16 +885,18 @@ def url_add_authentication(url, username, password):
 def urlopen(url):
     """
     An URL opener with the User-agent set to gPodder (with version)
+
+    Connections are kept open for later requests to the same
+    server (see the connectionpool module).
     """
+    handlers = connectionpool.get_handlers()
     username, password = username_password_from_url(url)
     if username is not None or password is not None:
         url = url_strip_authentication(url)
         password_mgr = urllib2.HTTPPasswordMgrWithDefaultRealm()
         password_mgr.add_password(None, url, username, password)
-        handler = urllib2.HTTPBasicAuthHandler(password_mgr)
-        opener = urllib2.build_opener(handler)
-    else:
-        opener = urllib2.build_opener()
+        handlers.append(urllib2.HTTPBasicAuthHandler(password_mgr))
+    opener = urllib2.build_opener(*handlers)
 
     headers = {'User-agent': gpodder.user_agent}
     request = urllib2.Request(url, headers=headers)
@@ -940,13 +941,8 @@ def http_get_and_gunzip(uri):
 
     Returns the uncompressed document at the given URI.
     """
-    request = urllib2.Request(uri)
-    request.add_header("Accept-encoding", "gzip")
-    usock = urllib2.urlopen(request)
-    data = usock.read()
-    if usock.headers.get('content-encoding', None) == 'gzip':
-        data = gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
-    return data
+    # Compressed responses are decompressed by urlopen's handlers
+    return urlopen(uri).read()
 
 
 def idle_add(func, *args):
@@ -1108,6 +1104,37 @@ def format_seconds_to_hour_min_sec(seconds):
     else:
         return result[0]
 
+
+def estimate_release_interval(timestamps):
+    """Estimate the release cycle from a list of publication times
+
+    Returns a tuple (interval, deviation) in seconds, where interval
+    is the median time between two releases and deviation is the
+    median absolute deviation from that. Releases less than a minute
+    apart count as one. Returns None if there are not enough
+    releases to estimate the cycle.
+
+    >>> day = 60*60*24
+    >>> estimate_release_interval([day, 8*day, 15*day, 22*day])
+    (604800, 0)
+    >>> estimate_release_interval([22*day, day, 15*day, 15*day-5, 9*day])
+    (604800, 86400)
+    >>> estimate_release_interval([day, 8*day]) is None
+    True
+    >>> estimate_release_interval([]) is None
+    True
+    """
+    timestamps = sorted(t for t in timestamps if t)
+    intervals = [b-a for a, b in zip(timestamps, timestamps[1:]) if b-a >= 60]
+    if len(intervals) < 2:
+        return None
+
+    intervals.sort()
+    interval = intervals[len(intervals)/2]
+    deviations = sorted(abs(i-interval) for i in intervals)
+    return (int(interval), int(deviations[len(deviations)/2]))
+
+
 def http_request(url, method='HEAD'):
     (scheme, netloc, path, parms, qry, fragid) = urlparse.urlparse(url)
     conn = httplib.HTTPConnection(netloc)